@@ -0,0 +1,146 @@
+"""
+Event-to-first-API-call latency of the Docker action vs the prebuilt runner of the composite action.
+
+The Docker action builds its image on every event, which is mostly `pip install -r requirements.txt`, then runs
+Castanets from source without bytecode. The composite action extracts the prebuilt runner (once per runner tool cache)
+and runs it with compiled templates and bytecode. Downloads of the base image and of the runner are not measured.
+
+Each run handles an `issues` event of the example process against a fake GitHub API in the process,
+and reports when the first API call and the first comment (after rendering a template) are sent.
+
+Usage: python benchmarks/runner_startup.py [--runs 5] [--runner dist/castanets-runner-<tag>.tar.gz]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT_DIR, "scripts"))
+
+from build_runner import RUNNER_NAME, build  # noqa: E402
+
+#: Runs Castanets with a fake GitHub API, printing times of the first API call and the first comment
+DRIVER = """
+import json, os, runpy, sys, time
+import requests
+
+ISSUE = {"number": 5, "title": "Process", "body": "", "labels": [], "assignees": [], "comments": 0}
+times = []
+
+class Response:
+    status_code, ok, headers = 200, True, {"Content-Type": "application/json"}
+
+    def __init__(self, body):
+        self.text = json.dumps(body)
+
+    def json(self):
+        return json.loads(self.text)
+
+def request(self, method, url, **kwargs):
+    if not times:
+        times.append(time.time())
+    if method == "POST" and url.endswith("/comments"):
+        print(json.dumps({"api": times[0], "comment": time.time()}), flush=True)
+        os._exit(0)
+    if url.endswith("/user"):
+        return Response({"id": 1, "login": "castanets[bot]"})
+    if url.endswith("/issues/5"):
+        return Response(ISSUE)
+    return Response([] if method == "GET" else {})
+
+requests.Session.request = request
+sys.argv = ["castanets"]
+runpy.run_module("castanets", run_name="__main__")
+"""
+
+
+def run_event(pythonpath: str, workdir: str) -> dict:
+    event_path = os.path.join(workdir, "event.json")
+    with open(event_path, "w") as f:
+        json.dump({"action": "opened", "issue": {"number": 5}}, f)
+    env = {
+        **os.environ,
+        "PYTHONPATH": pythonpath,
+        "GITHUB_EVENT_NAME": "issues",
+        "GITHUB_EVENT_PATH": event_path,
+        "GITHUB_WORKSPACE": ROOT_DIR,
+        "GITHUB_REPOSITORY": "org/repo",
+        "GITHUB_REF_NAME": "main",
+        "GITHUB_TOKEN": "token",
+        "CASTANETS_CONFIG_PATH": "resources/castanets_example.yaml",
+        "CASTANETS_LOG_LEVEL": "WARNING",
+        "SLACK": "false",
+        "TEAMS": "false",
+        "ISSUE_AUTOCLOSE": "false",
+    }
+    start = time.time()
+    result = subprocess.run(
+        [sys.executable, "-c", DRIVER], env=env, cwd=workdir, capture_output=True, text=True, check=True
+    )
+    times = json.loads(result.stdout.strip().splitlines()[-1])
+    return {key: value - start for key, value in times.items()}
+
+
+def summarize(name: str, prepare: float, runs: list):
+    api = statistics.median(run["api"] for run in runs)
+    comment = statistics.median(run["comment"] for run in runs)
+    print(f"{name:<12}{prepare:>10.2f}s{api * 1000:>12.0f}ms{comment * 1000:>14.0f}ms{prepare + api:>12.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--runner", help="Runner archive, built if not given")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        runner = args.runner or build(os.path.join(workdir, "dist"))
+
+        # Docker action: a fresh image with dependencies installed, and Castanets without bytecode
+        docker_dir = os.path.join(workdir, "docker")
+        start = time.time()
+        subprocess.run(
+            [sys.executable, "-m", "pip", "install", "--quiet", "--target", docker_dir]
+            + ["-r", os.path.join(ROOT_DIR, "requirements.txt")],
+            check=True,
+        )
+        shutil.copytree(
+            os.path.join(ROOT_DIR, "castanets"),
+            os.path.join(docker_dir, "castanets"),
+            ignore=shutil.ignore_patterns("__pycache__", "compiled"),
+        )
+        docker_prepare = time.time() - start
+        docker_runs = []
+        for _ in range(args.runs):
+            shutil.rmtree(os.path.join(docker_dir, "castanets"))
+            shutil.copytree(
+                os.path.join(ROOT_DIR, "castanets"),
+                os.path.join(docker_dir, "castanets"),
+                ignore=shutil.ignore_patterns("__pycache__", "compiled"),
+            )
+            docker_runs.append(run_event(docker_dir, workdir))
+
+        # Composite action: the prebuilt runner extracted to the tool cache
+        runner_dir = os.path.join(workdir, "runner")
+        start = time.time()
+        with tarfile.open(runner) as f:
+            f.extractall(runner_dir)
+        runner_prepare = time.time() - start
+        runner_runs = [run_event(os.path.join(runner_dir, RUNNER_NAME), workdir) for _ in range(args.runs)]
+
+    print(f"Median of {args.runs} events, without image and runner downloads")
+    print(f"{'mode':<12}{'prepare':>11}{'first API':>14}{'first comment':>16}{'total':>13}")
+    summarize("docker", docker_prepare, docker_runs)
+    summarize("composite", runner_prepare, runner_runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Per-event CPU and memory of validated pydantic models vs compiled slim models.
+
+Each Action event is a new process, and the config is rendered per issue and state, so `compile_config` is cold
+on a normal event: it loads the YAML, validates it with pydantic and converts it with `to_slim`.
+The cache is hit only when the same rendered config is loaded again in a process, like reloads within an event
+and `castanets sweep` over issues on the same stage. Both are measured, with the cold cost split into its steps.
+
+Usage: python benchmarks/runtime_models.py [--events 2000] [--stages 20]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from castanets.models import (  # noqa: E402
+    CastanetsConfig,
+    GithubActionsContext,
+    SlimGithubActionsContext,
+    compile_config,
+    to_slim,
+)
+
+
+def make_config(stages: int) -> str:
+    return yaml.safe_dump(
+        {
+            "name": "Benchmark",
+            "description": "Benchmark process",
+            "stages": [
+                {
+                    "name": f"Stage {idx}",
+                    "label": f"stage_{idx}",
+                    "description": f"Description of stage {idx}",
+                    "review": {
+                        "reviewers": ["alice", "bob", "org/infra"],
+                        "must_review": ["alice"],
+                        "minimum_approval": 2,
+                    },
+                    "workflow": {
+                        "filename": f"stage_{idx}.yaml",
+                        "inputs": {"model": "model", "dataset": "dataset"},
+                        "track": True,
+                        "on_success": "stage_next",
+                        "output": {"artifact": "outputs"},
+                    },
+                }
+                for idx in range(stages)
+            ],
+        }
+    )
+
+
+EVENT = dict(event_name="issue_comment", repo="org/repo", ref="main", token="token", action="created", issue_id=1)
+
+
+def pydantic_event(text: str):
+    config = CastanetsConfig.from_dict(yaml.load(text, Loader=yaml.FullLoader))
+    return config, GithubActionsContext(**EVENT)
+
+
+def slim_event_cold(text: str):
+    compile_config.cache_clear()
+    return compile_config(text), SlimGithubActionsContext(**EVENT)
+
+
+def slim_event_cached(text: str):
+    return compile_config(text), SlimGithubActionsContext(**EVENT)
+
+
+def measure_cpu(func, events: int) -> float:
+    start = time.perf_counter()
+    for _ in range(events):
+        func()
+    return (time.perf_counter() - start) / events
+
+
+def measure_memory(build, count: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    kept = [build() for _ in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return size / count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--stages", type=int, default=20)
+    args = parser.parse_args()
+
+    text = make_config(args.stages)
+    loaded = yaml.load(text, Loader=yaml.FullLoader)
+    config = CastanetsConfig.from_dict(loaded)
+
+    pydantic_cpu = measure_cpu(lambda: pydantic_event(text), args.events)
+    cold_cpu = measure_cpu(lambda: slim_event_cold(text), args.events)
+    compile_config(text)
+    cached_cpu = measure_cpu(lambda: slim_event_cached(text), args.events)
+    load_cpu = measure_cpu(lambda: yaml.load(text, Loader=yaml.FullLoader), args.events)
+    validate_cpu = measure_cpu(lambda: CastanetsConfig.from_dict(loaded), args.events)
+    slim_cpu = measure_cpu(lambda: to_slim(config), args.events)
+    pydantic_memory = measure_memory(lambda: CastanetsConfig.from_dict(yaml.load(text, Loader=yaml.FullLoader)), 200)
+    slim_memory = measure_memory(lambda: to_slim(config), 200)
+
+    print(f"{args.events} events, {args.stages} stages")
+    print(f"{'':<22}{'CPU/event':>12}{'config memory':>16}")
+    print(f"{'pydantic':<22}{pydantic_cpu * 1e3:>10.2f}ms{pydantic_memory / 1024:>14.1f}KB")
+    print(f"{'slim, cold cache':<22}{cold_cpu * 1e3:>10.2f}ms{slim_memory / 1024:>14.1f}KB")
+    print(f"{'slim, cached':<22}{cached_cpu * 1e3:>10.2f}ms{0:>14.1f}KB")
+    print(
+        f"Cold compile: YAML {load_cpu * 1e3:.2f}ms, validation {validate_cpu * 1e3:.2f}ms, to_slim {slim_cpu * 1e3:.2f}ms"
+    )
+    print("A normal event compiles cold. Cached configs are shared, so cache hits allocate no config memory.")
+
+
+if __name__ == "__main__":
+    main()
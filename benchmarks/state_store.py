@@ -0,0 +1,148 @@
+"""
+Read and write latency of state stores on issues with many comments.
+
+GitHub API is replaced by an in-memory fake with a fixed latency per call and a bandwidth, so results count
+API calls and transferred bytes rather than network noise. Each write also updates the body of the Castanets comment,
+as the engine does after commands.
+
+Usage: python benchmarks/state_store.py [--comments 10 300 1000] [--latency-ms 150] [--bandwidth-mbps 20]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import unquote, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from castanets.models import SlimGithubActionsContext  # noqa: E402
+from castanets.stores import CommentStateStore, GitRefStateStore, SqliteStateStore  # noqa: E402
+from castanets.utils import embed_state_to_comment, github  # noqa: E402
+
+REPO = "org/repo"
+BOT = {"id": 1, "login": "castanets[bot]"}
+#: Comments per page of GitHub API without `per_page`
+DEFAULT_PER_PAGE = 30
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body, content_type: str = "application/json"):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.text = body if isinstance(body, str) else json.dumps(body)
+        self.headers = {"Content-Type": content_type}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeGithub:
+    """
+    Issue comments and the Git Data API of one repository, counting calls and response bytes.
+    """
+
+    def __init__(self, comments: int, state: dict):
+        body = embed_state_to_comment("## Castanets\n" + "Stage status\n" * 20, state)
+        self.comments = [{"id": 1, "user": BOT, "body": body}] + [
+            {"id": idx, "user": {"id": 2, "login": "reviewer"}, "body": f"Comment {idx} " + "x" * 300}
+            for idx in range(2, comments + 1)
+        ]
+        self.refs, self.commits, self.trees = {}, {}, {}
+        self.calls = 0
+        self.bytes = 0
+
+    def request(self, method, url, headers=None, json=None):
+        response = self._route(method, urlparse(url), headers or {}, json)
+        self.calls += 1
+        self.bytes += len(response.text)
+        return response
+
+    def _route(self, method, url, headers, payload):
+        path = unquote(url.path)
+        query = dict(item.split("=", 1) for item in url.query.split("&") if "=" in item)
+        prefix = f"/repos/{REPO}/"
+        if path == "/user":
+            return FakeResponse(200, BOT)
+        endpoint = path[len(prefix) :]
+        if endpoint.endswith("/comments") and method == "GET":
+            return FakeResponse(200, self.comments[: int(query.get("per_page", DEFAULT_PER_PAGE))])
+        if endpoint.startswith("issues/comments/") and method == "PATCH":
+            comment_id = int(endpoint.split("/")[-1])
+            next(comment for comment in self.comments if comment["id"] == comment_id)["body"] = payload["body"]
+            return FakeResponse(200, {"id": comment_id})
+        if endpoint.startswith("git/ref/"):
+            ref = "refs/" + endpoint[len("git/ref/") :]
+            return FakeResponse(200, {"object": {"sha": self.refs[ref]}}) if ref in self.refs else FakeResponse(404, {})
+        if endpoint.startswith("contents/"):
+            ref = unquote(query["ref"])
+            files = self.trees[self.commits[self.refs[ref]]] if ref in self.refs else {}
+            name = endpoint[len("contents/") :]
+            return FakeResponse(200, files[name], "text/plain") if name in files else FakeResponse(404, {})
+        if endpoint.startswith("git/commits/"):
+            return FakeResponse(200, {"tree": {"sha": self.commits[endpoint.split("/")[-1]]}})
+        if endpoint == "git/trees":
+            files = dict(self.trees.get(payload.get("base_tree"), {}))
+            files.update({item["path"]: item["content"] for item in payload["tree"]})
+            sha = f"tree{len(self.trees)}"
+            self.trees[sha] = files
+            return FakeResponse(201, {"sha": sha})
+        if endpoint == "git/commits":
+            sha = f"commit{len(self.commits)}"
+            self.commits[sha] = payload["tree"]
+            return FakeResponse(201, {"sha": sha})
+        if endpoint == "git/refs" or endpoint.startswith("git/refs/"):
+            self.refs[payload.get("ref") or "refs/" + endpoint[len("git/refs/") :]] = payload["sha"]
+            return FakeResponse(200, {})
+        raise ValueError(f"Unknown call {method} {path}")
+
+
+def measure(store, fake: FakeGithub, operation, repeat: int, latency: float, bandwidth: float):
+    fake.calls = fake.bytes = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        operation(store)
+    cpu = (time.perf_counter() - start) / repeat
+    calls, size = fake.calls / repeat, fake.bytes / repeat
+    return calls, size, cpu + calls * latency + size / bandwidth
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--comments", type=int, nargs="+", default=[10, 300, 1000])
+    parser.add_argument("--latency-ms", type=float, default=150)
+    parser.add_argument("--bandwidth-mbps", type=float, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    latency = args.latency_ms / 1000
+    bandwidth = args.bandwidth_mbps * 1e6 / 8
+    context = SlimGithubActionsContext(event_name="issue_comment", repo=REPO, ref="main", token="token", issue_id=1)
+    state = {"stage_idx": 3, "stages": {f"stage_{idx}": {"status": "done", "approvers": ["alice"]} for idx in range(5)}}
+
+    print(f"{args.latency_ms:.0f}ms per call, {args.bandwidth_mbps:.0f}Mbps")
+    print(f"{'store':<10}{'comments':>10}{'read calls':>12}{'read KB':>10}{'read':>10}{'write calls':>13}{'write':>10}")
+    for comments in args.comments:
+        with tempfile.TemporaryDirectory() as directory:
+            for store in [CommentStateStore(), GitRefStateStore(), SqliteStateStore(os.path.join(directory, "db"))]:
+                fake = FakeGithub(comments, state)
+                github._session = fake
+                github._action_user = None
+                store.write(context, state)
+                read = measure(store, fake, lambda s: s.read(context), args.repeat, latency, bandwidth)
+                write = measure(
+                    store, fake, lambda s: s.write(context, state, "## Castanets\n"), args.repeat, latency, bandwidth
+                )
+                print(
+                    f"{store.name:<10}{comments:>10}{read[0]:>12.0f}{read[1] / 1024:>10.1f}{read[2] * 1000:>8.0f}ms"
+                    f"{write[0]:>13.0f}{write[2] * 1000:>8.0f}ms"
+                )
+    print("Comments are listed from the first page only, so the comment store costs the same beyond 30 comments.")
+
+
+if __name__ == "__main__":
+    main()
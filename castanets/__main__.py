@@ -1,19 +1,134 @@
-import castanets.commands.castanets  # noqa: F401
-from castanets import context, engine
-from castanets.alerts import SlackAlert, TeamsAlert
-from castanets.constants import SLACK, SLACK_CHANNEL, SLACK_TOKEN, TEAMS, TEAMS_WEBHOOK_URL
+import sys
 
+from castanets.hooks import ChromeTraceHook, ProfileHook, register_hook, registry
+from castanets.stores import create_state_store, migrate_state, set_state_store
+from castanets.utils import AppCredential, CredentialPool, TokenCredential, get_logger, github
 
-def main():
-    engine.push_command_from_context()
+USAGE = """usage: python -m castanets [<command>]
+
+Handle the event of GitHub Actions, or run a command:
+  sweep                             Poll workflow runs, remind reviewers and escalate stages of open issues
+  flush-alerts                      Redeliver alerts of the outbox
+  analytics [<output>]              Export stage metrics
+  migrate-state <source> [<target>] Copy state of all issues to the configured or the target store
+"""
+
+# Help is printed after dependencies are imported, before the GitHub Actions environment is loaded
+if len(sys.argv) > 1 and sys.argv[1] in ["-h", "--help"]:
+    print(USAGE, end="")
+    exit(0)
+
+from castanets.constants import (  # noqa: E402
+    CASTANETS_CONFIG_PATH,
+    CASTANETS_PROFILE_DIR,
+    CASTANETS_STATE_DB,
+    CASTANETS_STATE_REF,
+    CASTANETS_STATE_STORE,
+    CASTANETS_TRACE_PATH,
+    GITHUB_APP_ID,
+    GITHUB_APP_INSTALLATION_ID,
+    GITHUB_APP_PRIVATE_KEY,
+    GITHUB_EXTRA_TOKENS,
+    GITHUB_REPO_TOKENS,
+    GITHUB_REPOSITORY,
+    GITHUB_TOKEN,
+    SLACK,
+    SLACK_CHANNEL,
+    SLACK_TOKEN,
+    SLACK_USER_CACHE_TTL,
+    TEAMS,
+    TEAMS_WEBHOOK_URL,
+)
+
+logger = get_logger("castanets.main")
+
+# Hooks are registered before the context is constructed, so its API calls are traced too.
+if CASTANETS_TRACE_PATH:
+    register_hook(ChromeTraceHook(CASTANETS_TRACE_PATH))
+if CASTANETS_PROFILE_DIR:
+    register_hook(ProfileHook(CASTANETS_PROFILE_DIR))
+
+# Credentials are set before the context is constructed too. Without App or extra tokens, GITHUB_TOKEN is used.
+if GITHUB_APP_ID or GITHUB_EXTRA_TOKENS:
+    credentials = [TokenCredential(token, f"extra:{idx}") for idx, token in enumerate(GITHUB_EXTRA_TOKENS)]
+    if GITHUB_APP_ID:
+        app = AppCredential(GITHUB_APP_ID, GITHUB_APP_PRIVATE_KEY, GITHUB_APP_INSTALLATION_ID, GITHUB_REPOSITORY)
+        credentials = [app, TokenCredential(GITHUB_TOKEN)] + credentials
+    else:
+        credentials = [TokenCredential(GITHUB_TOKEN)] + credentials
+    github.set_credential_pool(CredentialPool(credentials))
+if GITHUB_REPO_TOKENS:
+    github.set_repo_credentials(
+        {repo: TokenCredential(token, f"repo:{repo}") for repo, token in GITHUB_REPO_TOKENS.items()}
+    )
+
+
+def _create_state_store(name: str):
+    return create_state_store(name, {"git_ref": CASTANETS_STATE_REF, "sqlite": CASTANETS_STATE_DB}.get(name))
+
+
+# The state store is set before the context is constructed, so the state is read from it.
+set_state_store(_create_state_store(CASTANETS_STATE_STORE))
+
+import castanets.commands.castanets  # noqa: E402, F401
+from castanets import context, engine  # noqa: E402
+from castanets.alerts import SlackAlert, TeamsAlert  # noqa: E402
 
-    # Alerts
+
+def register_alerts():
     if SLACK:
-        engine.register_alert(SlackAlert(context, SLACK_CHANNEL, SLACK_TOKEN))
+        engine.register_alert(SlackAlert(context, SLACK_CHANNEL, SLACK_TOKEN, SLACK_USER_CACHE_TTL))
     if TEAMS:
         engine.register_alert(TeamsAlert(context, TEAMS_WEBHOOK_URL))
 
-    engine.run()
+
+def main():
+    # `castanets sweep` runs on a schedule, without an issue event
+    if len(sys.argv) > 1 and sys.argv[1] == "sweep":
+        from castanets.sweep import sweep
+
+        register_alerts()
+        try:
+            return 1 if sweep() else 0
+        finally:
+            registry.close()
+
+    # `castanets flush-alerts` redelivers alerts of the outbox, on a schedule
+    if len(sys.argv) > 1 and sys.argv[1] == "flush-alerts":
+        from castanets.sweep import flush_alerts
+
+        register_alerts()
+        try:
+            return 1 if flush_alerts() else 0
+        finally:
+            registry.close()
+
+    # `castanets analytics` exports stage metrics, without an issue event
+    if len(sys.argv) > 1 and sys.argv[1] == "analytics":
+        from castanets.analytics import analytics
+
+        try:
+            return analytics(*sys.argv[2:3])
+        finally:
+            registry.close()
+
+    # `castanets migrate-state <source> [<target>]` copies state of all issues to the configured or the target store
+    if len(sys.argv) > 2 and sys.argv[1] == "migrate-state":
+        target = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3] else CASTANETS_STATE_STORE
+        migrate_state(context.github_actions, _create_state_store(sys.argv[2]), _create_state_store(target))
+        return 0
+
+    if context.castanets is None:
+        logger.info("No process config of %s matches the issue, skip the event.", CASTANETS_CONFIG_PATH)
+        return 0
+
+    engine.push_command_from_context()
+    register_alerts()
+
+    try:
+        engine.run()
+    finally:
+        registry.close()
     return 0
 
 
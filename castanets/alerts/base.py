@@ -1,4 +1,4 @@
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple
 
 from castanets.utils import get_logger
 
@@ -64,3 +64,19 @@ class BaseAlert:
         if key not in self._handlers:
             return
         self._handlers[key](self, command_output)
+
+    def alert_batch(self, events: List[Tuple[str, Dict[str, Any]]]) -> int:
+        """
+        Trigger events in order, like redelivery of the alert outbox. Stop at the first failure.
+        Handlers which can send several events in one message override it.
+
+        :param events: Key and command output of each event
+        :returns: Number of events delivered
+        """
+        for count, (key, command_output) in enumerate(events):
+            try:
+                self.alert(key, command_output)
+            except Exception:
+                logger.exception("%s: alert %s failed", self.__class__.__name__, key)
+                return count
+        return len(events)
@@ -1,13 +1,84 @@
-from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 
 from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
 
-from castanets.utils import get_logger
+from castanets.utils import TTLCache, get_logger, github
 
 from .base import BaseAlert, alert_handler, subscribe
 
 logger = get_logger(__name__)
 
+_LOOKUP_FAILED = object()
+#: Maximum number of blocks in a Slack message
+MAX_MESSAGE_BLOCKS = 50
+
+
+class SlackMentionResolver:
+    """
+    Resolve GitHub usernames to Slack user IDs.
+    `slack_users` of the config is checked first, then the cache in the state, then `users.lookupByEmail`
+    with the public email of the GitHub profile. Users who are not found are cached as None for `negative_ttl`.
+
+    :param context: castanets.context.Context
+    :param client: Slack web client, the token needs `users:read.email` scope
+    :param ttl: Seconds to cache found users
+    :param negative_ttl: Seconds to cache users who are not found
+    :param max_workers: Maximum number of concurrent lookups
+    """
+
+    def __init__(self, context: Any, client: WebClient, ttl: int, negative_ttl: int = 3600, max_workers: int = 8):
+        self.context = context
+        self.client = client
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_workers = max_workers
+
+    def _lookup(self, username: str) -> Any:
+        """
+        Look up Slack user ID of a GitHub user by email.
+
+        :param username: GitHub username
+        :returns: Slack user ID, None if not found, or `_LOOKUP_FAILED` on errors which must not be cached
+        """
+        try:
+            email = github.get_user_by_login(self.context.github_actions, username).get("email")
+            if not email:
+                return None
+            return self.client.users_lookupByEmail(email=email)["user"]["id"]
+        except SlackApiError as e:
+            if e.response.get("error") == "users_not_found":
+                return None
+            logger.warning("Slack user lookup of %s failed: %s", username, e)
+        except Exception as e:
+            logger.warning("Slack user lookup of %s failed: %s", username, e)
+        return _LOOKUP_FAILED
+
+    def resolve(self, usernames: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Resolve Slack user IDs of GitHub users. Users missing in the cache are looked up concurrently.
+
+        :param usernames: GitHub usernames, teams (`org/team`) are ignored
+        :returns: Slack user ID by username, None if not found
+        """
+        mapping = self.context.castanets.config.slack_users or {}
+        state = self.context.state if self.context.state is not None else {}
+        cache = TTLCache(state.setdefault("cache", {}).setdefault("slack_users", {}), self.ttl)
+        usernames = [username for username in usernames if "/" not in username]
+
+        missing = [username for username in cache.missing(usernames) if username not in mapping]
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(len(missing), self.max_workers)) as executor:
+                results = list(executor.map(self._lookup, missing))
+            cache.prune()
+            for username, user_id in zip(missing, results):
+                if user_id is not _LOOKUP_FAILED:
+                    cache.set(username, user_id, ttl=self.ttl if user_id else self.negative_ttl)
+            self.context.state_changed = self.context.state is not None
+
+        return {username: mapping.get(username) or cache.get(username) for username in usernames}
+
 
 @alert_handler
 class SlackAlert(BaseAlert):
@@ -17,12 +88,17 @@ class SlackAlert(BaseAlert):
     :param context: castanets.context.Context
     :param channel: Slack channel
     :param token: Slack token
+    :param user_cache_ttl: Seconds to cache Slack user IDs of reviewers
     """
 
-    def __init__(self, context: Any, channel: str, token: str):
+    #: Blocks of messages rendered by `alert_batch`, posted together
+    _batch: Optional[List[List[Dict[str, Any]]]] = None
+
+    def __init__(self, context: Any, channel: str, token: str, user_cache_ttl: int = 86400):
         self.context = context
         self.channel = channel
         self.client = WebClient(token=token)
+        self.mention_resolver = SlackMentionResolver(context, self.client, user_cache_ttl)
 
     def _render_header(self, title: str, process_info_as_description: bool = False) -> List[Dict[str, Any]]:
         """
@@ -141,7 +217,7 @@ class SlackAlert(BaseAlert):
 
     def _render_remaining_reviewers(self, approvers: List[str], reviewers: List[str], must_review: List[str]):
         """
-        Render remaining reviewers message.
+        Render remaining reviewers message. Remaining reviewers are mentioned.
 
         :param approvers: Approvers
         :param reviewers: Reviewers
@@ -149,10 +225,13 @@ class SlackAlert(BaseAlert):
         :returns: Slack message blocks
         """
         rendered = []
+        mentions = self.mention_resolver.resolve([reviewer for reviewer in reviewers if reviewer not in approvers])
 
         rendered.append({"type": "section", "text": {"type": "mrkdwn", "text": "🔥 *Current Review Status*"}})
         for reviewer in reviewers:
             reviewer_text = f"• ✅ {reviewer}" if reviewer in approvers else f"• 🟠 *{reviewer}*"
+            if mentions.get(reviewer):
+                reviewer_text += f" <@{mentions[reviewer]}>"
             if reviewer in must_review:
                 reviewer_text += " (Must Review)"
             rendered.append({"type": "section", "text": {"type": "mrkdwn", "text": reviewer_text}})
@@ -165,6 +244,9 @@ class SlackAlert(BaseAlert):
 
         :blocks: Slack message blocks
         """
+        if self._batch is not None:
+            self._batch.append(blocks)
+            return
         self.client.chat_postMessage(
             channel=self.channel,
             blocks=blocks,
@@ -172,9 +254,52 @@ class SlackAlert(BaseAlert):
             icon_url="https://gcdnb.pbrd.co/images/UySphOakKcZh.png",
         )
 
+    def alert_batch(self, events: List[Tuple[str, Dict[str, Any]]]) -> int:
+        """
+        Send events in as few messages as the block limit allows, separated by dividers.
+
+        :param events: Key and command output of each event
+        :returns: Number of events delivered
+        """
+        # Messages with the 1-based index of their event
+        messages = []
+        rendered = 0
+        self._batch = []
+        try:
+            for key, command_output in events:
+                self.alert(key, command_output)
+                rendered += 1
+                messages.extend((rendered, blocks) for blocks in self._batch)
+                self._batch = []
+        except Exception:
+            logger.exception("SlackAlert: rendering alert %s failed", events[rendered][0])
+        finally:
+            self._batch = None
+
+        delivered = 0
+        chunk: List[Dict[str, Any]] = []
+        for index, blocks in messages:
+            if chunk and len(chunk) + 1 + len(blocks) > MAX_MESSAGE_BLOCKS:
+                try:
+                    self._post_message(chunk)
+                except Exception:
+                    logger.exception("SlackAlert: posting alerts failed")
+                    return delivered
+                # Messages of events before this one are all posted
+                delivered = index - 1
+                chunk = []
+            chunk.extend(([{"type": "divider"}] if chunk else []) + blocks)
+        if chunk:
+            try:
+                self._post_message(chunk)
+            except Exception:
+                logger.exception("SlackAlert: posting alerts failed")
+                return delivered
+        return rendered
+
     @subscribe(on="initialize")
     def on_initialize(self, command_output: Dict[str, Any]):
-        logger.info(f"SlackAlert: initialize, payload: {command_output}")
+        logger.debug("SlackAlert: initialize, payload: %s", command_output)
         blocks = []
         blocks.extend(self._render_header("Castanets Process Start", process_info_as_description=True))
         blocks.extend(self._render_footer())
@@ -182,7 +307,7 @@ class SlackAlert(BaseAlert):
 
     @subscribe(on="stage_start")
     def on_stage_start(self, command_output: Dict[str, Any]):
-        logger.info(f"SlackAlert: stage_start, payload: {command_output}")
+        logger.debug("SlackAlert: stage_start, payload: %s", command_output)
 
         stage_idx = command_output["stage_idx"]
         stage_name = self.context.castanets.config.stages[stage_idx].name
@@ -200,12 +325,12 @@ class SlackAlert(BaseAlert):
 
     @subscribe(on="approve")
     def on_approve(self, command_output: Dict[str, Any]):
-        logger.info(f"SlackAlert: approve, payload: {command_output}")
+        logger.debug("SlackAlert: approve, payload: %s", command_output)
 
         username = command_output["username"]
         approvers = command_output["approvers"]
 
-        stage_idx = self.context.castanets.stage_idx
+        stage_idx = command_output["stage_idx"]
         review = self.context.castanets.config.stages[stage_idx].review
         reviewers = review.reviewers
         must_review = review.must_review
@@ -219,26 +344,44 @@ class SlackAlert(BaseAlert):
 
     @subscribe(on="dismiss")
     def on_dismiss(self, command_output: Dict[str, Any]):
-        logger.info(f"SlackAlert: dismiss, payload: {command_output}")
+        logger.debug("SlackAlert: dismiss, payload: %s", command_output)
 
         username = command_output["username"]
         approvers = command_output["approvers"]
 
-        stage_idx = self.context.castanets.stage_idx
-        review = self.context.castanets.config.stages[stage_idx].reviewers
+        stage_idx = command_output["stage_idx"]
+        review = self.context.castanets.config.stages[stage_idx].review
         reviewers = review.reviewers
         must_review = review.must_review
 
         blocks = []
         blocks.extend(self._render_header("Dismiss Event"))
-        blocks.extend(self._render_review(username, True))
+        blocks.extend(self._render_review(username, False))
         blocks.extend(self._render_remaining_reviewers(approvers, reviewers, must_review))
         blocks.extend(self._render_footer())
         self._post_message(blocks)
 
+    @subscribe(on="remind")
+    def on_remind(self, command_output: Dict[str, Any]):
+        logger.debug("SlackAlert: remind, payload: %s", command_output)
+        if not command_output["reminders"]:
+            return
+
+        # Reminders of the issue are sent in one message
+        blocks = []
+        blocks.extend(self._render_header("Review Reminder"))
+        for reminder in command_output["reminders"]:
+            review = self.context.castanets.config.stages[reminder["stage_idx"]].review
+            kind = "Timeout" if reminder["kind"] == "escalation" else "Waiting"
+            text = f"*{kind}:* {reminder['name']} ({reminder['elapsed_hours']} hours)"
+            blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": text}})
+            blocks.extend(self._render_remaining_reviewers(reminder["approvers"], review.reviewers, review.must_review))
+        blocks.extend(self._render_footer())
+        self._post_message(blocks)
+
     @subscribe(on="finish")
     def on_finish(self, command_output: Dict[str, Any]):
-        logger.info(f"SlackAlert: finish, payload: {command_output}")
+        logger.debug("SlackAlert: finish, payload: %s", command_output)
 
         blocks = []
         blocks.extend(self._render_header("Process finished"))
@@ -105,14 +105,14 @@ class TeamsAlert(BaseAlert):
 
     @subscribe(on="initialize")
     def on_initialize(self, command_output: Dict[str, Any]):
-        logger.info(f"TeamsAlert: initialize, payload: {command_output}")
+        logger.debug("TeamsAlert: initialize, payload: %s", command_output)
         self._render_header("Castanets Process Start")
         self._render_footer()
         self._send()
 
     @subscribe(on="stage_start")
     def on_stage_start(self, command_output: Dict[str, Any]):
-        logger.info(f"TeamsAlert: stage_start, payload: {command_output}")
+        logger.debug("TeamsAlert: stage_start, payload: %s", command_output)
 
         stage_idx = command_output["stage_idx"]
         stage_name = self.context.castanets.config.stages[stage_idx].name
@@ -129,12 +129,12 @@ class TeamsAlert(BaseAlert):
 
     @subscribe(on="approve")
     def on_approve(self, command_output: Dict[str, Any]):
-        logger.info(f"TeamsAlert: approve, payload: {command_output}")
+        logger.debug("TeamsAlert: approve, payload: %s", command_output)
 
         username = command_output["username"]
         approvers = command_output["approvers"]
 
-        stage_idx = self.context.castanets.stage_idx
+        stage_idx = command_output["stage_idx"]
         review = self.context.castanets.config.stages[stage_idx].review
         reviewers = review.reviewers
         must_review = review.must_review
@@ -147,25 +147,43 @@ class TeamsAlert(BaseAlert):
 
     @subscribe(on="dismiss")
     def on_dismiss(self, command_output: Dict[str, Any]):
-        logger.info(f"TeamsAlert: dismiss, payload: {command_output}")
+        logger.debug("TeamsAlert: dismiss, payload: %s", command_output)
 
         username = command_output["username"]
         approvers = command_output["approvers"]
 
-        stage_idx = self.context.castanets.stage_idx
-        review = self.context.castanets.config.stages[stage_idx].reviewers
+        stage_idx = command_output["stage_idx"]
+        review = self.context.castanets.config.stages[stage_idx].review
         reviewers = review.reviewers
         must_review = review.must_review
 
         self._render_header("Dismiss Event")
-        self._render_review(username, True)
+        self._render_review(username, False)
         self._render_remaining_reviewers(approvers, reviewers, must_review)
         self._render_footer()
         self._send()
 
+    @subscribe(on="remind")
+    def on_remind(self, command_output: Dict[str, Any]):
+        logger.debug("TeamsAlert: remind, payload: %s", command_output)
+        if not command_output["reminders"]:
+            return
+
+        # Reminders of the issue are sent in one message
+        self._render_header("Review Reminder")
+        for reminder in command_output["reminders"]:
+            review = self.context.castanets.config.stages[reminder["stage_idx"]].review
+            kind = "Timeout" if reminder["kind"] == "escalation" else "Waiting"
+            section = pymsteams.cardsection()
+            section.activityTitle(f"{kind}: {reminder['name']} ({reminder['elapsed_hours']} hours)")
+            self.teams.addSection(section)
+            self._render_remaining_reviewers(reminder["approvers"], review.reviewers, review.must_review)
+        self._render_footer()
+        self._send()
+
     @subscribe(on="finish")
     def on_finish(self, command_output: Dict[str, Any]):
-        logger.info(f"TeamsAlert: finish, payload: {command_output}")
+        logger.debug("TeamsAlert: finish, payload: %s", command_output)
 
         self._render_header("Process finished")
         self._render_finish()
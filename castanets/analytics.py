@@ -0,0 +1,105 @@
+"""
+Stage lead-time analytics, exported with `castanets analytics`.
+
+Timeline events of issues updated since the last run are fetched into a local store, then per-stage metrics of all
+stored issues are written as CSV or JSON. Timeline pages fetched before are requested with their ETag,
+so unchanged issues cost no rate limit, and the run stops early with a checkpoint when the rate limit runs low.
+"""
+
+from typing import Optional
+
+from castanets import context
+from castanets.constants import (
+    CASTANETS_ANALYTICS_MIN_RATE_LIMIT,
+    CASTANETS_ANALYTICS_OUTPUT,
+    CASTANETS_ANALYTICS_STORE,
+)
+from castanets.utils import get_logger, github
+from castanets.utils.analytics import (
+    AnalyticsStore,
+    aggregate_stage_metrics,
+    compact_timeline_event,
+    get_stage_visits,
+    write_stage_metrics,
+)
+
+logger = get_logger(__name__)
+
+#: Issues fetched between checkpoints of the store
+CHECKPOINT_INTERVAL = 50
+#: Timeline events per page
+TIMELINE_PER_PAGE = 100
+
+
+def fetch_issue_timeline(store: AnalyticsStore, issue_id: int, bot_login: str):
+    """
+    Fetch new timeline events of an issue, from the last page fetched before.
+
+    :param store: Analytics store
+    :param issue_id: Issue number
+    :param bot_login: Username of the Castanets bot
+    """
+    issue = store.get_issue(issue_id)
+    while True:
+        events, etag = github.get_timeline_page(
+            context.github_actions, issue_id, issue["page"], issue["etag"], TIMELINE_PER_PAGE
+        )
+        if events is None:
+            return
+        store.add_events(
+            issue_id, [compact for event in events for compact in compact_timeline_event(event, bot_login)]
+        )
+        if len(events) < TIMELINE_PER_PAGE:
+            issue["etag"] = etag
+            return
+        # New events of a full page are on the next page
+        issue["page"] += 1
+        issue["etag"] = None
+
+
+def fetch(store: AnalyticsStore, min_rate_limit: int) -> bool:
+    """
+    Fetch timelines of issues updated since the checkpoint of the store, oldest update first.
+
+    :param store: Analytics store
+    :param min_rate_limit: Stop when remaining requests of the rate limit are fewer
+    :returns: Whether all updated issues were fetched
+    """
+    bot_login = github.get_user(context.github_actions)["login"]
+    issues = github.list_issues_since(context.github_actions, store.since)
+    logger.info("Fetch timelines of %d issues updated since %s", len(issues), store.since)
+
+    for count, issue in enumerate(issues, 1):
+        if github.get_rate_limit_remaining() < min_rate_limit:
+            logger.warning("Rate limit is running low, stop at %s. The next run continues from it.", store.since)
+            return False
+        # Castanets processes always have the bot's comment
+        if issue["comments"] > 0:
+            fetch_issue_timeline(store, issue["number"], bot_login)
+        store.since = issue["updated_at"]
+        if count % CHECKPOINT_INTERVAL == 0:
+            store.save()
+    return True
+
+
+def analytics(output: Optional[str] = None, store_path: Optional[str] = None) -> int:
+    """
+    Fetch new timeline events and write per-stage metrics. The format is JSON if the output ends with `.json`.
+
+    :param output: Output path of metrics
+    :param store_path: Path of the analytics store, kept between runs (ex. with actions/cache)
+    :returns: Exit code
+    """
+    output = output or CASTANETS_ANALYTICS_OUTPUT
+    store = AnalyticsStore(store_path or CASTANETS_ANALYTICS_STORE)
+    try:
+        fetch(store, CASTANETS_ANALYTICS_MIN_RATE_LIMIT)
+    finally:
+        store.save()
+
+    visits = [visit for events in store.iter_issue_events() for visit in get_stage_visits(events)]
+    metrics = aggregate_stage_metrics(visits)
+    with open(output, "w", newline="") as f:
+        write_stage_metrics(metrics, f, "json" if output.endswith(".json") else "csv")
+    logger.info("Wrote metrics of %d stages from %d visits to %s", len(metrics), len(visits), output)
+    return 0
@@ -1,6 +1,7 @@
-from .base import command, get_command
+from .base import CommandInputError, command, get_command
 
 __all__ = [
+    "CommandInputError",
     "command",
     "get_command",
 ]
@@ -1,3 +1,3 @@
-from .registry import command, get_command
+from .registry import CommandInputError, command, get_command
 
-__all__ = ["command", "get_command"]
+__all__ = ["CommandInputError", "command", "get_command"]
@@ -4,6 +4,13 @@ from typing import Callable
 __COMMAND_REGISTRY = {}
 
 
+class CommandInputError(ValueError):
+    """
+    Invalid input of a command given by a user, like a stage that is not running.
+    The engine replies to the issue with the message instead of failing the run.
+    """
+
+
 def command(name: str):
     """
     Decorator for defining Command.
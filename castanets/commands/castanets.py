@@ -1,179 +1,1131 @@
+import math
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, ModuleLoader
 
 from castanets import context, engine
-from castanets.commands import command
-from castanets.constants import ISSUE_AUTOCLOSE, ROOT_DIR
-from castanets.utils import get_castanets_stage_label, get_logger, get_mermaid_from_context, github
+from castanets.commands import CommandInputError, command
+from castanets.constants import CASTANETS_TEAM_CACHE_TTL, COMPILED_TEMPLATES_DIR, ISSUE_AUTOCLOSE, TEMPLATES_DIR
+from castanets.models import Review, Workflow, WorkflowOutput, WorkflowTarget
+from castanets.utils import (
+    WORKFLOW_SPECULATIVE_INPUT,
+    TTLCache,
+    create_correlation_id,
+    evaluate_stage_condition,
+    expand_matrix,
+    format_github_datetime,
+    get_castanets_stage_label,
+    get_logger,
+    get_matrix_cell_key,
+    get_mermaid_from_context,
+    get_workflow_hash,
+    github,
+    parse_github_datetime,
+    read_outputs_from_artifact,
+    render_matrix_inputs,
+)
 
 logger = get_logger(__name__)
-jinja_env = Environment(loader=FileSystemLoader(os.path.join(ROOT_DIR, "templates")))
+# Prebuilt runners ship templates compiled to Python modules, so they are not parsed on every event
+jinja_env = Environment(
+    loader=(
+        ModuleLoader(COMPILED_TEMPLATES_DIR)
+        if os.path.isdir(COMPILED_TEMPLATES_DIR)
+        else FileSystemLoader(TEMPLATES_DIR)
+    )
+)
+
+#: Number of latest events shown in the status comment
+MAX_STATUS_EVENTS = 20
+
+#: Latest pull request reviews by username for each issue, fetched once per run with `pull_request_reviews`
+_pull_request_reviews: Dict[int, Dict[str, dict]] = {}
+
+
+def _mark_state_changed():
+    """
+    Mark state of the context as changed. The engine writes it once after running the command queue.
+    """
+    context.state_changed = True
+
+
+def _get_stage_states() -> Dict[str, dict]:
+    """
+    Get state of each started stage by label.
+    """
+    return context.state.setdefault("stages", {})
+
+
+def _get_stage_status() -> Dict[str, str]:
+    """
+    Get status of each started stage by label (running, done).
+    """
+    return {label: stage_state["status"] for label, stage_state in _get_stage_states().items()}
+
+
+def _get_running_stages() -> List[int]:
+    """
+    Get indices of running stages.
+    """
+    stage_status = _get_stage_status()
+    return [
+        idx for idx, stage in enumerate(context.castanets.config.stages) if stage_status.get(stage.label) == "running"
+    ]
+
+
+def _get_target_stage_idx(stage_label: Optional[str] = None) -> int:
+    """
+    Get index of the running stage targeted by a command.
+
+    :param stage_label: Stage label given with the command, can be omitted when only one stage is running
+    """
+    running_stages = _get_running_stages()
+    labels = ", ".join(f"`{context.castanets.config.stages[idx].label}`" for idx in running_stages) or "none"
+    if stage_label is not None:
+        stage_idx = _get_stage_idx_of_label(stage_label)
+        if stage_idx not in running_stages:
+            raise CommandInputError(f"Stage `{stage_label}` is not running, running stages: {labels}")
+        return stage_idx
+
+    if len(running_stages) != 1:
+        raise CommandInputError(f"Target stage must be given, running stages: {labels}")
+    return running_stages[0]
+
+
+def _get_stage_idx_of_label(stage_label: str) -> int:
+    """
+    Get index of a stage by the label given with a command.
+
+    :param stage_label: Stage label
+    """
+    if not any(stage.label == stage_label for stage in context.castanets.config.stages):
+        raise CommandInputError(f"Stage `{stage_label}` does not exist.")
+    return context.castanets.config.get_stage_idx(stage_label)
+
+
+def _get_team_members(review: Review) -> Dict[str, List[str]]:
+    """
+    Get members of teams needed to evaluate the review, cached in `state["cache"]["team_members"]`.
+    Expired teams are fetched concurrently.
+
+    :param review: Review condition of the stage
+    """
+    teams = review.required_teams
+    if not teams:
+        return {}
+
+    cache = TTLCache(context.state.setdefault("cache", {}).setdefault("team_members", {}), CASTANETS_TEAM_CACHE_TTL)
+    missing = cache.missing(teams)
+    if missing:
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            members = list(executor.map(lambda team: github.get_team_members(context.github_actions, team), missing))
+        cache.prune()
+        for team, team_members in zip(missing, members):
+            cache.set(team, team_members)
+        _mark_state_changed()
+    return {team: cache.get(team, []) for team in teams}
+
+
+def _get_approvers(stage_idx: int) -> List[str]:
+    """
+    Get approvers of a stage.
+    With `pull_request_reviews`, reviewers whose latest review approved after the stage started, otherwise from the state.
+
+    :param stage_idx: Stage ID
+    """
+    stage_state = _get_stage_states().get(context.castanets.config.stages[stage_idx].label, {})
+    if not context.castanets.config.pull_request_reviews:
+        return stage_state.get("approvers", [])
+
+    issue_id = context.github_actions.issue_id
+    if issue_id not in _pull_request_reviews:
+        _pull_request_reviews[issue_id] = github.get_latest_reviews(context.github_actions)
+    started_at = parse_github_datetime(stage_state["started_at"]) if "started_at" in stage_state else None
+    return sorted(
+        username
+        for username, review in _pull_request_reviews[issue_id].items()
+        if review["state"] == "APPROVED"
+        and (started_at is None or parse_github_datetime(review["submitted_at"]) >= started_at)
+    )
+
+
+def _is_stage_approved(stage_idx: int, approvers: List[str]) -> bool:
+    """
+    Check the review of the stage is approved, resolving team reviewers.
+
+    :param stage_idx: Stage ID
+    :param approvers: Users who approved the stage
+    """
+    review = context.castanets.config.stages[stage_idx].review
+    return review.is_stage_approved(approvers, _get_team_members(review))
+
+
+def _reconcile_issue():
+    """
+    Set labels and reviewers of running stages to the issue, and remove those of the other stages.
+    Team reviewers are not assigned, they are mentioned in the stage comment instead.
+    """
+    stages = context.castanets.config.stages
+    running_stages = _get_running_stages()
+    reviewers = []
+    for idx in running_stages:
+        reviewers.extend(reviewer for reviewer in stages[idx].review.users if reviewer not in reviewers)
+    finished_reviewers = {
+        reviewer
+        for label in _get_stage_states()
+        for reviewer in stages[context.castanets.config.get_stage_idx(label)].review.users
+    }
+
+    context.issue = github.reconcile_issue_metadata(
+        context.github_actions,
+        context.issue,
+        [get_castanets_stage_label(stages[idx].label) for idx in running_stages],
+        assignees_to_remove=finished_reviewers - set(reviewers),
+        assignees_to_add=reviewers,
+    )
+
+
+def _get_target_inputs(workflow: Workflow, target: WorkflowTarget, cell: Optional[dict] = None) -> Optional[dict]:
+    """
+    Get inputs of a dispatch, with inputs of the target and the matrix cell.
+
+    :param workflow: Workflow to dispatch
+    :param target: Target of the dispatch
+    :param cell: Matrix cell of the dispatch
+    """
+    inputs = {**(workflow.inputs or {}), **target.inputs} if target.inputs else workflow.inputs
+    return render_matrix_inputs(inputs, cell) if cell is not None else inputs
+
+
+def _get_workflow_url(workflow: Workflow) -> str:
+    """
+    Get URL of the workflow, in the repository of its first target.
+
+    :param workflow: Workflow
+    """
+    repo = workflow.dispatch_targets[0].repo or context.github_actions.repo
+    return f"https://github.com/{repo}/actions/workflows/{workflow.filename}"
+
+
+def _run_stage_workflow(
+    stage_idx: int,
+    workflow: Workflow,
+    state: dict,
+    dispatch_keys: Optional[List[Tuple[int, Optional[dict]]]] = None,
+    force: bool = False,
+):
+    """
+    Dispatch a workflow of the stage.
+    Tracked workflows get a correlation ID, recorded in `state["workflow_runs"]`.
+    Workflows are dispatched once per target and matrix cell, concurrently up to `max_parallel`,
+    to the repository and ref of the target.
+    Memoized workflows reuse the successful run with the same hash instead of dispatching.
+
+    :param stage_idx: Stage ID
+    :param workflow: Workflow to dispatch
+    :param state: State to record the dispatch (not written here)
+    :param dispatch_keys: Target index and matrix cell of each dispatch, all dispatches if not given
+    :param force: Dispatch even if a memoized run exists
+    :returns: Correlation IDs of tracked dispatches, including memoized ones
+    """
+    stage = context.castanets.config.stages[stage_idx]
+    targets = workflow.dispatch_targets
+    if dispatch_keys is None:
+        cells = expand_matrix(workflow.matrix) if workflow.matrix is not None else [None]
+        dispatch_keys = [(target_idx, cell) for target_idx in range(len(targets)) for cell in cells]
+    dispatches = [
+        (targets[target_idx], _get_target_inputs(workflow, targets[target_idx], cell))
+        for target_idx, cell in dispatch_keys
+    ]
+
+    # Commit of each repository and ref, for memoized runs
+    shas: Dict[Tuple[Optional[str], str], str] = {}
+    memo = state.get("memo", {})
+
+    correlation_ids = []
+    tracked_ids = []
+    to_dispatch = []
+    memoized = False
+    for idx, ((target_idx, cell), (target, inputs)) in enumerate(zip(dispatch_keys, dispatches)):
+        correlation_id = None
+        if workflow.track:
+            correlation_id = engine.run_once(
+                "correlation_id",
+                lambda: create_correlation_id(context.github_actions.issue_id, stage.label),
+                record=True,
+            )
+            record = {
+                "stage_idx": stage_idx,
+                "workflow": workflow.filename,
+                "status": "dispatched",
+                "dispatched_at": format_github_datetime(),
+            }
+            if cell is not None:
+                record["cell"] = cell
+            if workflow.targets:
+                record["target"] = target_idx
+            if target.repo is not None:
+                record["repo"] = target.repo
+            if workflow.memoize:
+                ref = target.ref or workflow.ref or context.github_actions.ref
+                if (target.repo, ref) not in shas:
+                    shas[(target.repo, ref)] = github.get_commit_sha(context.github_actions, ref, target.repo)
+                filename = f"{target.repo}/{workflow.filename}" if target.repo else workflow.filename
+                record["hash"] = get_workflow_hash(filename, shas[(target.repo, ref)], inputs)
+                if not force and record["hash"] in memo:
+                    logger.info("Reuse memoized run of %s for hash %s", workflow.filename, record["hash"])
+                    record["status"] = "completed"
+                    record["conclusion"] = "success"
+                    record["memoized_from"] = memo[record["hash"]]["correlation_id"]
+                    memoized = True
+            state.setdefault("workflow_runs", {})[correlation_id] = record
+            tracked_ids.append(correlation_id)
+            if record["status"] == "completed":
+                continue
+        correlation_ids.append(correlation_id)
+        to_dispatch.append(idx)
+
+    def dispatch(order: int):
+        target, inputs = dispatches[to_dispatch[order]]
+        engine.run_once(
+            f"dispatch:{to_dispatch[order]}",
+            lambda: github.run_workflow(
+                context.github_actions,
+                workflow.filename,
+                inputs,
+                correlation_ids[order],
+                repo=target.repo,
+                ref=target.ref or workflow.ref,
+            ),
+        )
+
+    if len(to_dispatch) == 1:
+        dispatch(0)
+    elif to_dispatch:
+        with ThreadPoolExecutor(max_workers=workflow.max_parallel) as executor:
+            list(executor.map(dispatch, range(len(to_dispatch))))
+
+    if memoized:
+        _apply_workflow_policy(stage_idx, workflow, "success")
+
+    return tracked_ids
+
+
+def _get_dispatch_runs(stage_idx: int, workflow: Workflow) -> Dict[str, dict]:
+    """
+    Get the latest run record of each dispatch (target and matrix cell) of a fan-out workflow.
+
+    :param stage_idx: Stage ID
+    :param workflow: Fan-out workflow of the stage
+    :returns: Run record by dispatch key
+    """
+    dispatch_runs = {}
+    for record in context.state.get("workflow_runs", {}).values():
+        if record["stage_idx"] != stage_idx or record["workflow"] != workflow.filename or record.get("speculative"):
+            continue
+        cell_key = get_matrix_cell_key(record["cell"]) if "cell" in record else ""
+        dispatch_runs[f"{record.get('target', 0)}:{cell_key}"] = record
+    return dispatch_runs
+
+
+def _is_workflow_gate_passed(stage_idx: int) -> bool:
+    """
+    Check enough dispatches of the stage's fan-out workflow (matrix or targets) succeeded.
+    Always True for stages without fan-out workflow.
+
+    :param stage_idx: Stage ID
+    """
+    workflow = context.castanets.config.stages[stage_idx].workflow
+    if workflow is None or not workflow.is_fan_out:
+        return True
+
+    dispatch_runs = _get_dispatch_runs(stage_idx, workflow)
+    succeeded = sum(1 for record in dispatch_runs.values() if record.get("conclusion") == "success")
+    cells = len(expand_matrix(workflow.matrix)) if workflow.matrix is not None else 1
+    return succeeded >= math.ceil(len(workflow.dispatch_targets) * cells * workflow.success_ratio)
+
+
+def _is_prefetch_ready(stage_idx: int, approval_ratio: float) -> bool:
+    """
+    Check a stage is far enough along for the stages that need it to prefetch.
+
+    :param stage_idx: Stage ID of the need
+    :param approval_ratio: Ratio of minimum approvals the running stage must reach
+    """
+    stage = context.castanets.config.stages[stage_idx]
+    stage_state = _get_stage_states().get(stage.label, {})
+    if stage_state.get("status") in ["done", "skipped"]:
+        return True
+    if stage_state.get("status") != "running":
+        return False
+    return len(_get_approvers(stage_idx)) >= math.ceil(stage.review.minimum_approval * approval_ratio)
+
+
+def _get_prefetch_hash(workflow: Workflow) -> str:
+    """
+    Get hash of a speculative run, with the commit of the workflow's ref like `_run_stage_workflow`.
+
+    :param workflow: Workflow of the stage, in the repository of the process
+    """
+    sha = github.get_commit_sha(context.github_actions, workflow.ref or context.github_actions.ref)
+    return get_workflow_hash(workflow.filename, sha, workflow.inputs)
+
+
+def _prefetch_dependents(stage_idx: int):
+    """
+    Dispatch speculative runs of the dependent stages' workflows with `prefetch` enabled.
+    The run is recorded in `state["prefetch"]` with its hash, and adopted when the stage starts with the same hash.
+
+    :param stage_idx: Stage ID of the running stage
+    """
+    config = context.castanets.config
+    stage_status = _get_stage_status()
+    prefetches = context.state.setdefault("prefetch", {})
+    for idx in config.get_dependents(stage_idx):
+        stage = config.stages[idx]
+        if not stage.prefetch or stage.label in stage_status or stage.label in prefetches:
+            continue
+        if not all(_is_prefetch_ready(need, stage.prefetch_approval_ratio) for need in config.get_needs(idx)):
+            continue
+        if stage.when is not None and not evaluate_stage_condition(
+            stage.when, params=context.castanets.params, state=context.state, github=context.github_actions
+        ):
+            continue
+
+        workflow = stage.workflow
+        workflow_hash = _get_prefetch_hash(workflow)
+        if workflow.memoize and workflow_hash in context.state.get("memo", {}):
+            continue
+
+        logger.info("Prefetch workflow %s of stage %s", workflow.filename, stage.label)
+        correlation_id = engine.run_once(
+            f"correlation_id:{stage.label}",
+            lambda: create_correlation_id(context.github_actions.issue_id, stage.label),
+            record=True,
+        )
+        prefetches[stage.label] = {"correlation_id": correlation_id, "hash": workflow_hash}
+        context.state.setdefault("workflow_runs", {})[correlation_id] = {
+            "stage_idx": idx,
+            "workflow": workflow.filename,
+            "status": "dispatched",
+            "dispatched_at": format_github_datetime(),
+            "hash": workflow_hash,
+            "speculative": True,
+        }
+        engine.run_once(
+            f"dispatch:{stage.label}",
+            lambda: github.run_workflow(
+                context.github_actions,
+                workflow.filename,
+                {**(workflow.inputs or {}), WORKFLOW_SPECULATIVE_INPUT: "true"},
+                correlation_id,
+                ref=workflow.ref,
+            ),
+        )
+        _mark_state_changed()
+
+
+def _cancel_prefetch(stage_label: str):
+    """
+    Cancel the speculative run of the stage, if any.
+    Cancelling is best effort, the result of a cancelled speculative run is ignored.
+
+    :param stage_label: Stage label
+    """
+    prefetch = context.state.get("prefetch", {}).pop(stage_label, None)
+    if prefetch is None:
+        return
+    record = context.state.get("workflow_runs", {}).get(prefetch["correlation_id"])
+    _mark_state_changed()
+    if record is None or record["status"] != "dispatched":
+        return
+
+    record["status"] = "cancelled"
+    try:
+        run = github.find_workflow_run(
+            context.github_actions, record["workflow"], prefetch["correlation_id"], record["dispatched_at"]
+        )
+        if run is None:
+            logger.warning("Speculative run of stage %s is not created yet, its result will be ignored.", stage_label)
+            return
+        logger.info("Cancel speculative run %s of stage %s", run["id"], stage_label)
+        engine.run_once(f"cancel:{run['id']}", lambda: github.cancel_workflow_run(context.github_actions, run["id"]))
+    except Exception:
+        # The result of the speculative run is ignored anyway
+        logger.exception("Cancelling speculative run of stage %s failed.", stage_label)
+
+
+def _adopt_prefetch(stage_idx: int, workflow: Workflow) -> bool:
+    """
+    Adopt the speculative run of the starting stage if its hash still matches, or cancel it.
+
+    :param stage_idx: Stage ID
+    :param workflow: Workflow of the stage
+    :returns: True if the speculative run is adopted and the workflow must not be dispatched
+    """
+    stage = context.castanets.config.stages[stage_idx]
+    prefetch = context.state.get("prefetch", {}).get(stage.label)
+    if prefetch is None:
+        return False
+
+    if _get_prefetch_hash(workflow) != prefetch["hash"]:
+        logger.info("Inputs of stage %s changed since prefetch.", stage.label)
+        _cancel_prefetch(stage.label)
+        return False
+
+    correlation_id = context.state["prefetch"].pop(stage.label)["correlation_id"]
+    record = context.state["workflow_runs"][correlation_id]
+    record.pop("speculative", None)
+    if not workflow.memoize:
+        record.pop("hash", None)
+    logger.info("Adopt speculative run of stage %s", stage.label)
+    if record["status"] == "completed":
+        _process_workflow_result(correlation_id, record)
+    return True
+
+
+def _get_help_text() -> str:
+    """
+    Get usage of slash commands.
+    """
+    help_text = "* `/help`\n"
+    if context.castanets.config.pull_request_reviews:
+        help_text += "* Approve the stage with a pull request review. Approvals before the stage started don't count.\n"
+    else:
+        help_text += "* `/approve [stage]`: Approve the stage.\n"
+        help_text += "* `/dismiss [stage]`: Dismiss the stage.\n"
+    help_text += "* `/rerun [stage] [--force]`: Rerun the stage's workflow. `--force` ignores memoized runs.\n"
+    help_text += "* `/clean_up [stage]`: Clean up the stage.\n"
+    help_text += "* `/stage_next [stage]`: Force move to next stage.\n"
+    help_text += "* `/finish`: Finish the process.\n"
+    help_text += "\n`[stage]` is the stage label, which can be omitted when only one stage is running.\n"
+    return help_text
+
+
+def _add_event(text: str):
+    """
+    Add an event line to the status comment. Only the latest events are kept.
+
+    :param text: Event message in markdown
+    """
+    if not context.castanets.config.status_comment:
+        return
+    events = context.state.setdefault("events", [])
+    events.append({"at": format_github_datetime(), "text": text})
+    del events[:-MAX_STATUS_EVENTS]
+    _mark_state_changed()
+
+
+def _render_status_comment() -> Optional[str]:
+    """
+    Render the status comment from the state, None if the process does not use a status comment.
+    """
+    config = context.castanets.config
+    if not config.status_comment or context.state is None:
+        return None
+
+    stage_states = context.state.get("stages", {})
+    running_stages = []
+    for stage_idx, stage in enumerate(config.stages):
+        stage_state = stage_states.get(stage.label, {})
+        if stage_state.get("status") != "running":
+            continue
+        running_stages.append(
+            {
+                "name": stage.name,
+                "description": stage.description,
+                "workflow_url": _get_workflow_url(stage.workflow) if stage.workflow else None,
+                "approvers": _get_approvers(stage_idx),
+                "minimum_approval": stage.review.minimum_approval,
+                "reviewers": stage.review.reviewers,
+                "must_review": stage.review.must_review,
+            }
+        )
+
+    template = jinja_env.get_template("castanets_status.md")
+    return template.render(
+        name=config.name,
+        description=config.description,
+        stage_mermaid=get_mermaid_from_context(
+            context.castanets, {label: stage_state["status"] for label, stage_state in stage_states.items()}
+        ),
+        running_stages=running_stages,
+        finished=context.state.get("finished", False),
+        issue_autoclose=ISSUE_AUTOCLOSE,
+        events=context.state.get("events", []),
+        help_text=_get_help_text(),
+    )
+
+
+engine.set_comment_renderer(_render_status_comment)
 
 
 @command("help")
 def help():
     """
     Create help message.
+    With the status comment, usage is in the status comment, and the comment gets a reaction instead.
     """
-    help_text = "## Castanets Usage\n"
-    help_text += "* `/help`\n"
-    help_text += "* `/approve`: Approve the current stage.\n"
-    help_text += "* `/dismiss`: Dismiss the current stage.\n"
-    help_text += "* `/rerun`: Rerun the current stage's workflow.\n"
-    help_text += "* `/clean_up`: Clean up current stage.\n"
-    help_text += "* `/stage_next`: Force move to next stage.\n"
-    help_text += "* `/finish`: Finish the process.\n"
-    github.comment(context.github_actions, help_text)
+    if context.castanets.config.status_comment:
+        if context.github_actions.issue_comment_id is not None:
+            engine.run_once(
+                "reaction",
+                lambda: github.add_reaction(
+                    context.github_actions, context.github_actions.issue_comment_id, "confused"
+                ),
+            )
+        return
+    engine.run_once(
+        "comment", lambda: github.comment(context.github_actions, "## Castanets Usage\n" + _get_help_text())
+    )
 
 
 @command("initialize")
 def initialize():
     """
     Initialize castanets.
+    With the status comment, the status comment is posted instead, which holds the state.
     """
+    # Routed config of the config directory is kept, so the process stays on it even if the issue changes
+    if context.castanets.config_name is not None:
+        context.state["config"] = context.castanets.config_name
+        _mark_state_changed()
+
+    if context.castanets.config.status_comment:
+        engine.run_once("comment", lambda: github.comment(context.github_actions, _render_status_comment()))
+        return
+
     template = jinja_env.get_template("castanets_initialize.md")
     comment = template.render(name=context.castanets.config.name, description=context.castanets.config.description)
-    github.comment(context.github_actions, comment)
+    engine.run_once("comment", lambda: github.comment(context.github_actions, comment))
 
 
 @command("stage_start")
-def stage_start(stage_idx: int):
+def stage_start(stage_idx: int, reconcile_issue: bool = True):
     """
     Start stage with stage index.
 
     :param stage_idx: Stage ID
+    :param reconcile_issue: Update labels and assignees of the issue.
+        Set False when another stage starts right after, so the issue is updated once.
     """
     if stage_idx >= len(context.castanets.config.stages) or stage_idx < 0:
         raise ValueError(f"Stage Index is out of range: {stage_idx}")
 
     stage = context.castanets.config.stages[stage_idx]
-    if stage_idx == 0:
+    needs = context.castanets.config.get_needs(stage_idx)
+    if needs:
+        prev_stage_name = ", ".join(context.castanets.config.stages[idx].name for idx in needs)
+    else:
         prev_stage_name = "Start"
+
+    # State update
+    _get_stage_states()[stage.label] = {"status": "running", "started_at": format_github_datetime()}
+    if not context.castanets.config.pull_request_reviews:
+        _get_stage_states()[stage.label]["approvers"] = []
+    context.state["stage_idx"] = stage_idx
+    context.castanets.stage_idx = stage_idx
+    context.castanets.approvers = []
+
+    if context.castanets.config.status_comment:
+        _add_event(f"Stage **{stage.name}** started after **{prev_stage_name}**.")
     else:
-        prev_stage_name = context.castanets.config.stages[stage_idx - 1].name
-    mermaid = get_mermaid_from_context(context.castanets, stage_idx)
-    workflow_url = (
-        f"https://github.com/{context.github_actions.repo}/actions/workflows/{stage.workflow.filename}"
-        if stage.workflow
-        else None
-    )
+        mermaid = get_mermaid_from_context(context.castanets, _get_stage_status())
+        workflow_url = _get_workflow_url(stage.workflow) if stage.workflow else None
 
-    template = jinja_env.get_template("castanets_process.md")
-    comment = template.render(
-        prev_stage=prev_stage_name,
-        current_stage=stage.name,
-        workflow_url=workflow_url,
-        stage_mermaid=mermaid,
-        description=stage.description,
-        minimum_approval=stage.review.minimum_approval,
-        reviewers=stage.review.reviewers,
-        must_review=stage.review.must_review,
-    )
+        template = jinja_env.get_template("castanets_process.md")
+        comment = template.render(
+            prev_stage=prev_stage_name,
+            current_stage=stage.name,
+            workflow_url=workflow_url,
+            stage_mermaid=mermaid,
+            description=stage.description,
+            minimum_approval=stage.review.minimum_approval,
+            reviewers=stage.review.reviewers,
+            must_review=stage.review.must_review,
+        )
+        engine.run_once("comment", lambda: github.comment(context.github_actions, comment))
 
-    github.comment(context.github_actions, comment)
-    github.set_label(context.github_actions, get_castanets_stage_label(stage.label))
-    github.set_assignees(context.github_actions, stage.review.reviewers)
-    if stage.workflow:
-        github.run_workflow(context.github_actions, stage.workflow.filename, stage.workflow.inputs)
+    if reconcile_issue:
+        _reconcile_issue()
 
-    # State update
-    state = github.read_state_from_first_comment(context.github_actions)
-    state["stage_idx"] = stage_idx
-    github.write_state_to_first_comment(context.github_actions, state)
+    if stage.workflow and not _adopt_prefetch(stage_idx, stage.workflow):
+        _run_stage_workflow(stage_idx, stage.workflow, context.state)
+    _prefetch_dependents(stage_idx)
+
+    _mark_state_changed()
 
     return {"stage_idx": stage_idx}
 
 
 @command("stage_rerun")
-def stage_rerun():
+def stage_rerun(stage_label: Optional[str] = None, force: bool = False):
     """
-    Rerun current stage's workflow.
+    Rerun the stage's workflow.
+
+    :param stage_label: Stage label, can be omitted when only one stage is running
+    :param force: Dispatch even if a memoized run exists
     """
-    stage_idx = context.castanets.stage_idx
+    stage_idx = _get_target_stage_idx(stage_label)
     stage = context.castanets.config.stages[stage_idx]
-    github.run_workflow(context.github_actions, stage.workflow.filename, stage.workflow.inputs)
+    if stage.workflow is None:
+        raise CommandInputError(f"Stage `{stage.label}` has no workflow to rerun.")
+
+    # Fan-out workflow reruns failed targets and cells only
+    dispatch_keys = None
+    if stage.workflow.is_fan_out:
+        dispatch_keys = [
+            (record.get("target", 0), record.get("cell"))
+            for record in _get_dispatch_runs(stage_idx, stage.workflow).values()
+            if record["status"] == "completed" and record.get("conclusion") != "success"
+        ]
+        if not dispatch_keys:
+            logger.info("No failed dispatch in stage %s.", stage.label)
+            return
+
+    if _run_stage_workflow(stage_idx, stage.workflow, context.state, dispatch_keys, force=force):
+        _mark_state_changed()
 
 
 @command("stage_clean_up")
-def stage_clean_up():
+def stage_clean_up(stage_label: Optional[str] = None, reconcile_issue: bool = True):
     """
-    Clean up current stage.
+    Clean up the stage. The stage is marked as done.
+
+    :param stage_label: Stage label, can be omitted when only one stage is running
+    :param reconcile_issue: Remove stage label and reviewers from the issue.
+        Set False when the next stage starts right after, since `stage_start` replaces them in one call.
     """
-    stage_idx = context.castanets.stage_idx
+    if stage_label is None:
+        stage_idx = _get_target_stage_idx()
+    else:
+        stage_idx = _get_stage_idx_of_label(stage_label)
     stage = context.castanets.config.stages[stage_idx]
-    github.remove_label(
-        context.github_actions,
-        get_castanets_stage_label(stage.label),
-    )
-    github.remove_assignees(context.github_actions, stage.review.reviewers)
-    github.write_state_to_first_comment(context.github_actions, {})
+
+    stage_state = _get_stage_states().setdefault(stage.label, {})
+    stage_state["status"] = "done"
+    stage_state["finished_at"] = format_github_datetime()
+    _add_event(f"Stage **{stage.name}** done.")
+
+    # Point the last started stage to one of the running stages
+    running_stages = _get_running_stages()
+    if context.state.get("stage_idx") == stage_idx:
+        if running_stages:
+            context.state["stage_idx"] = running_stages[-1]
+        else:
+            context.state.pop("stage_idx", None)
+        context.castanets.stage_idx = context.state.get("stage_idx")
+
+    if reconcile_issue:
+        _reconcile_issue()
+    _mark_state_changed()
 
     if stage.workflow_clean_up:
-        github.run_workflow(context.github_actions, stage.workflow_clean_up.filename, stage.workflow_clean_up.inputs)
+        workflow = stage.workflow_clean_up
+        for target_idx, target in enumerate(workflow.dispatch_targets):
+            engine.run_once(
+                "dispatch_clean_up" if target_idx == 0 else f"dispatch_clean_up:{target_idx}",
+                lambda: github.run_workflow(
+                    context.github_actions,
+                    workflow.filename,
+                    _get_target_inputs(workflow, target),
+                    repo=target.repo,
+                    ref=target.ref or workflow.ref,
+                ),
+            )
 
 
-@command("stage_next")
-def stage_next():
+def _get_stages_to_start(stage_status: Dict[str, str]) -> List[int]:
     """
-    Move to next stage.
+    Get stages to start, whose needs are all done or skipped.
+    Stages whose `when` condition is false are marked as skipped, and stages after them are checked again.
+
+    :param stage_status: Status of stages by label, updated with skipped stages
+    :returns: Indices of stages to start
     """
-    engine.push_command("stage_clean_up")
-    stage_idx = context.castanets.stage_idx
-    if stage_idx + 1 >= len(context.castanets.config.stages):
+    stages = context.castanets.config.stages
+    to_start = []
+    ready_stages = context.castanets.config.get_ready_stages(stage_status)
+    while ready_stages:
+        skipped = False
+        for idx in ready_stages:
+            stage = stages[idx]
+            if stage.when is None or evaluate_stage_condition(
+                stage.when, params=context.castanets.params, state=context.state, github=context.github_actions
+            ):
+                stage_status[stage.label] = "running"
+                to_start.append(idx)
+            else:
+                logger.info("Skip stage %s, condition is false: %s", stage.label, stage.when)
+                stage_status[stage.label] = "skipped"
+                _get_stage_states()[stage.label] = {"status": "skipped", "finished_at": format_github_datetime()}
+                _cancel_prefetch(stage.label)
+                _add_event(f"Stage **{stage.name}** skipped.")
+                skipped = True
+        ready_stages = context.castanets.config.get_ready_stages(stage_status) if skipped else []
+
+    for idx in to_start:
+        del stage_status[stages[idx].label]
+    return to_start
+
+
+def _push_stage_transition(done_stage_label: Optional[str] = None):
+    """
+    Push commands to clean up the done stage, and to start the next stages or finish the process.
+
+    :param done_stage_label: Label of the done stage, None on process start
+    """
+    stage_status = _get_stage_status()
+    if done_stage_label is not None:
+        stage_status[done_stage_label] = "done"
+    to_start = _get_stages_to_start(stage_status)
+    others_running = any(status == "running" for status in stage_status.values())
+
+    if done_stage_label is not None:
+        engine.push_command("stage_clean_up", done_stage_label, reconcile_issue=not to_start)
+    for order, idx in enumerate(to_start):
+        engine.push_command("stage_start", idx, reconcile_issue=order == len(to_start) - 1)
+    if not to_start and not others_running:
         engine.push_command("finish")
-    else:
-        engine.push_command("stage_start", stage_idx + 1)
+
+
+@command("process_start")
+def process_start():
+    """
+    Start the first stages of the process.
+    """
+    _push_stage_transition()
+    _mark_state_changed()
+
+
+@command("stage_next")
+def stage_next(stage_label: Optional[str] = None):
+    """
+    Finish the stage, and start stages whose needs are all done.
+    Stages whose `when` condition is false are skipped in the same transition.
+    Finish the process when no stage is left.
+
+    :param stage_label: Stage label, can be omitted when only one stage is running
+    """
+    stage_idx = _get_target_stage_idx(stage_label)
+    _push_stage_transition(context.castanets.config.stages[stage_idx].label)
+
+
+def _read_workflow_output(run_id: int, output: WorkflowOutput, repo: Optional[str] = None) -> dict:
+    """
+    Read outputs of a workflow run from its artifact.
+
+    :param run_id: Workflow run ID
+    :param output: Workflow output settings
+    :param repo: Repository of the workflow run, the repository of the process if not given
+    :returns: Outputs
+    """
+    artifact = github.get_workflow_run_artifact(context.github_actions, run_id, output.artifact, repo)
+    if artifact is None:
+        raise ValueError(f"Artifact {output.artifact} is not found in workflow run {run_id}.")
+    if artifact["size_in_bytes"] > output.max_artifact_size:
+        raise ValueError(f"Artifact {output.artifact} is too large: {artifact['size_in_bytes']} bytes")
+
+    with tempfile.TemporaryFile() as f:
+        github.download_artifact(context.github_actions, artifact["id"], f, output.max_artifact_size, repo=repo)
+        return read_outputs_from_artifact(f, output.path, output.max_output_size)
+
+
+def _apply_workflow_policy(
+    stage_idx: int,
+    workflow: Workflow,
+    conclusion: str,
+    run_id: Optional[int] = None,
+    run_attempt: int = 1,
+    repo: Optional[str] = None,
+) -> bool:
+    """
+    Apply `on_success`/`on_failure` policy of the running stage's workflow.
+
+    :param stage_idx: Stage ID
+    :param workflow: Workflow of the stage
+    :param conclusion: Conclusion of the workflow run
+    :param run_id: Workflow run ID, None for memoized results
+    :param run_attempt: Run attempt of the workflow run
+    :param repo: Repository of the workflow run, the repository of the process if not given
+    :returns: True if the workflow run is rerun
+    """
+    stage = context.castanets.config.stages[stage_idx]
+    if _get_stage_status().get(stage.label) != "running":
+        return False
+
+    if workflow.is_fan_out and conclusion == "success":
+        # Fan-out stage moves forward once enough targets and cells succeeded
+        approvers = _get_approvers(stage_idx)
+        if _is_workflow_gate_passed(stage_idx) and (
+            workflow.on_success == "stage_next" or _is_stage_approved(stage_idx, approvers)
+        ):
+            engine.push_command("stage_next", stage.label)
+    elif conclusion == "success" and workflow.on_success == "stage_next":
+        engine.push_command("stage_next", stage.label)
+    elif (
+        run_id is not None
+        and conclusion in ["failure", "timed_out"]
+        and workflow.on_failure == "rerun"
+        and run_attempt < workflow.max_attempts
+    ):
+        engine.run_once(f"rerun:{run_id}", lambda: github.rerun_workflow_run(context.github_actions, run_id, repo=repo))
+        return True
+    return False
+
+
+def _process_workflow_result(correlation_id: str, record: dict):
+    """
+    Read outputs, memoize and apply the workflow policy for a completed run record.
+
+    :param correlation_id: Correlation ID of the run
+    :param record: Run record in `state["workflow_runs"]`
+    """
+    state = context.state
+    stage_idx = record["stage_idx"]
+    stage = context.castanets.config.stages[stage_idx]
+    workflow = stage.workflow if stage.workflow and stage.workflow.filename == record["workflow"] else None
+    if workflow is None:
+        return
+
+    # Merge outputs, and render config again so the following stages can use them
+    record.pop("output_error", None)
+    if record["conclusion"] == "success" and workflow.output:
+        try:
+            outputs = _read_workflow_output(record["run_id"], workflow.output, record.get("repo"))
+        except Exception as e:
+            logger.exception("Reading outputs of workflow run %s failed.", record["run_id"])
+            record["output_error"] = str(e)
+            return
+        state.setdefault("workflow_output", {}).update(outputs)
+        context.castanets.reload_config(context.github_actions, state)
+
+    if record["conclusion"] == "success" and record.get("hash"):
+        state.setdefault("memo", {})[record["hash"]] = {
+            "correlation_id": correlation_id,
+            "run_id": record["run_id"],
+            "html_url": record.get("html_url"),
+            "completed_at": record.get("completed_at"),
+        }
+
+    if _apply_workflow_policy(
+        stage_idx, workflow, record["conclusion"], record["run_id"], record["run_attempt"], record.get("repo")
+    ):
+        record["status"] = "rerunning"
+
+
+def _complete_workflow_run(correlation_id: str, record: dict, run: dict):
+    """
+    Record the result of a completed workflow run, then apply the stage's workflow policy.
+
+    :param correlation_id: Correlation ID of the run
+    :param record: Run record in `state["workflow_runs"]`
+    :param run: Completed workflow run of GitHub API
+    """
+    record["status"] = "completed"
+    record["conclusion"] = run["conclusion"]
+    record["run_id"] = run["id"]
+    record["run_attempt"] = run["run_attempt"]
+    record["html_url"] = run["html_url"]
+    record["completed_at"] = run["updated_at"]
+    if run.get("run_started_at") and run["updated_at"]:
+        duration = parse_github_datetime(run["updated_at"]) - parse_github_datetime(run["run_started_at"])
+        record["duration"] = duration.total_seconds()
+
+    if not record.get("speculative"):
+        stage = context.castanets.config.stages[record["stage_idx"]]
+        _add_event(f"[Workflow run]({run['html_url']}) of **{stage.name}** completed: `{run['conclusion']}`.")
+        _process_workflow_result(correlation_id, record)
+
+    _mark_state_changed()
+
+
+@command("workflow_completed")
+def workflow_completed():
+    """
+    Record the result of a tracked workflow run, then apply the stage's workflow policy.
+    Results of speculative runs are kept until the stage starts and adopts them.
+    """
+    run = context.github_actions.workflow_run
+    records = context.state.get("workflow_runs", {})
+    correlation_id = next((key for key in records if key in run.display_title), None)
+    if correlation_id is None:
+        logger.info("Workflow run %s is not tracked by this process.", run.id)
+        return None
+
+    record = records[correlation_id]
+    fields = ["id", "conclusion", "run_attempt", "html_url", "updated_at", "run_started_at"]
+    _complete_workflow_run(correlation_id, record, {field: getattr(run, field) for field in fields})
+
+    return {"correlation_id": correlation_id, **record}
+
+
+@command("poll_workflow_runs")
+def poll_workflow_runs():
+    """
+    Poll tracked runs of other repositories, which don't send `workflow_run` events to this repository.
+    Runs being rerun are completed again once a later attempt completes.
+    """
+    completed = []
+    for correlation_id, record in list(context.state.get("workflow_runs", {}).items()):
+        if "repo" not in record or record["status"] not in ["dispatched", "rerunning"]:
+            continue
+        run = github.find_workflow_run(
+            context.github_actions, record["workflow"], correlation_id, record["dispatched_at"], repo=record["repo"]
+        )
+        if run is None or run["status"] != "completed":
+            continue
+        if record["status"] == "rerunning" and run["run_attempt"] <= record["run_attempt"]:
+            continue
+        _complete_workflow_run(correlation_id, record, run)
+        completed.append(correlation_id)
+
+    return {"completed": completed}
 
 
 @command("approve")
-def approve(username: str):
+def approve(username: str, stage_label: Optional[str] = None):
     """
     Approve user.
+
+    :param username: Username of the reviewer
+    :param stage_label: Stage label, can be omitted when only one stage is running
     """
-    approvers = set(context.castanets.approvers) if context.castanets.approvers else set()
-    approvers.add(username)
-    new_approvers = list(approvers)
+    stage_idx = _get_target_stage_idx(stage_label)
+    stage = context.castanets.config.stages[stage_idx]
+    stage_state = _get_stage_states()[stage.label]
+    approvers = stage_state.setdefault("approvers", [])
+    if username not in approvers:
+        approvers.append(username)
+        _add_event(f"{username} approved **{stage.name}**.")
 
-    stage_idx = context.castanets.stage_idx
-    review = context.castanets.config.stages[stage_idx].review
-    if review.is_stage_approved(new_approvers):
-        engine.push_command("stage_next")
+    if _is_stage_approved(stage_idx, approvers) and _is_workflow_gate_passed(stage_idx):
+        engine.push_command("stage_next", stage.label)
     else:
-        # Update State Comment
-        state = github.read_state_from_first_comment(context.github_actions)
-        state["approvers"] = new_approvers
-        github.write_state_to_first_comment(context.github_actions, state)
+        _prefetch_dependents(stage_idx)
+        _mark_state_changed()
 
-    return {"username": username, "approvers": new_approvers}
+    return {"username": username, "approvers": list(approvers), "stage_idx": stage_idx}
+
+
+@command("sync_reviews")
+def sync_reviews():
+    """
+    Move running stages approved by pull request reviews to the next stage.
+    Reviews are read from GitHub on each event, so approvals are not stored in the state.
+    """
+    approvals = {}
+    for stage_idx in _get_running_stages():
+        stage = context.castanets.config.stages[stage_idx]
+        approvers = _get_approvers(stage_idx)
+        approvals[stage.label] = approvers
+        if _is_stage_approved(stage_idx, approvers) and _is_workflow_gate_passed(stage_idx):
+            _add_event(f"**{stage.name}** was approved by {', '.join(approvers)}.")
+            engine.push_command("stage_next", stage.label)
+        else:
+            _prefetch_dependents(stage_idx)
+
+    return {"approvals": approvals}
+
+
+@command("remind")
+def remind():
+    """
+    Remind pending reviewers of running stages waiting longer than `remind_after`,
+    and escalate stages running longer than `timeout` once.
+    Reminded and escalated times are kept in the stage state, so reminders are not repeated before `remind_after`.
+    """
+    now = datetime.now(timezone.utc)
+    reminders = []
+    for stage_idx in _get_running_stages():
+        stage = context.castanets.config.stages[stage_idx]
+        stage_state = _get_stage_states()[stage.label]
+        if "started_at" not in stage_state:
+            continue
+
+        elapsed = (now - parse_github_datetime(stage_state["started_at"])).total_seconds()
+        if stage.timeout is not None and elapsed >= stage.timeout_seconds and "escalated_at" not in stage_state:
+            kind = "escalation"
+            stage_state["escalated_at"] = format_github_datetime(now)
+        elif stage.remind_after is not None:
+            reminded_at = parse_github_datetime(stage_state.get("reminded_at", stage_state["started_at"]))
+            if (now - reminded_at).total_seconds() < stage.remind_after_seconds:
+                continue
+            kind = "reminder"
+            stage_state["reminded_at"] = format_github_datetime(now)
+        else:
+            continue
+
+        approvers = _get_approvers(stage_idx)
+        reminders.append(
+            {
+                "stage_idx": stage_idx,
+                "kind": kind,
+                "name": stage.name,
+                "elapsed_hours": round(elapsed / 3600, 1),
+                "approvers": approvers,
+                "pending_reviewers": [reviewer for reviewer in stage.review.reviewers if reviewer not in approvers],
+            }
+        )
+        _add_event(f"**{stage.name}** has waited {round(elapsed / 3600, 1)} hours ({kind}).")
+
+    if not reminders:
+        return {"reminders": []}
+
+    template = jinja_env.get_template("castanets_remind.md")
+    comment = template.render(reminders=reminders)
+    engine.run_once("comment", lambda: github.comment(context.github_actions, comment))
+    _mark_state_changed()
+
+    return {"reminders": reminders}
 
 
 @command("dismiss")
-def dismiss(username: str):
+def dismiss(username: str, stage_label: Optional[str] = None):
     """
     Dismiss user.
-    """
-    approvers = set(context.castanets.approvers) if context.castanets.approvers else set()
-    approvers.discard(username)
-    new_approvers = list(approvers.add(username))
 
-    # Update State Comment
-    state = github.read_state_from_first_comment(context.github_actions)
-    state["approvers"] = new_approvers
-    github.write_state_to_first_comment(context.github_actions, state)
+    :param username: Username of the reviewer
+    :param stage_label: Stage label, can be omitted when only one stage is running
+    """
+    stage_idx = _get_target_stage_idx(stage_label)
+    stage = context.castanets.config.stages[stage_idx]
+    stage_state = _get_stage_states()[stage.label]
+    approvers = [approver for approver in stage_state.get("approvers", []) if approver != username]
+    stage_state["approvers"] = approvers
+    _add_event(f"{username} dismissed **{stage.name}**.")
+    for idx in context.castanets.config.get_dependents(stage_idx):
+        _cancel_prefetch(context.castanets.config.stages[idx].label)
+    _mark_state_changed()
 
-    return {"username": username, "approvers": new_approvers}
+    return {"username": username, "approvers": approvers, "stage_idx": stage_idx}
 
 
 @command("finish")
 def finish(auto_close: bool = False):
     """
     Finish the process.
+    With the status comment, the status comment shows the process is finished.
     """
-    template = jinja_env.get_template("castanets_finish.md")
-    comment = template.render(issue_autoclose=ISSUE_AUTOCLOSE)
-    github.comment(context.github_actions, comment)
-    github.write_state_to_first_comment(context.github_actions, {"finished": True})
+    for stage_label in list(context.state.get("prefetch", {})):
+        _cancel_prefetch(stage_label)
+
+    if context.castanets.config.status_comment:
+        # Stages and events are kept to render the final status
+        _add_event("Process finished.")
+        context.state = {key: context.state[key] for key in ["stages", "events", "config"] if key in context.state}
+        context.state["finished"] = True
+    else:
+        template = jinja_env.get_template("castanets_finish.md")
+        comment = template.render(issue_autoclose=ISSUE_AUTOCLOSE)
+        engine.run_once("comment", lambda: github.comment(context.github_actions, comment))
+        context.state = {key: context.state[key] for key in ["config"] if key in context.state}
+        context.state["finished"] = True
+    _mark_state_changed()
 
     if ISSUE_AUTOCLOSE:
         github.update_issue(context.github_actions, {"state": "closed"})
@@ -1,4 +1,6 @@
 import os
+import re
+from typing import Optional
 
 from dotenv import load_dotenv
 
@@ -19,6 +21,18 @@ def check_and_load(key: str) -> str:
         raise Exception(f"{key} is not set")
 
 
+def load_or_default(key: str, default: Optional[str] = None) -> Optional[str]:
+    """
+    Load optional environment variable.
+    Empty value is treated as not set.
+
+    :param key: Enviroment variable name
+    :param default: Value returned when variable is not set
+    :returns: Value of environment variable
+    """
+    return os.environ.get(key) or default
+
+
 def boolean_str_to_bool(value: str) -> bool:
     """
     Get string of true or false, return into boolean value.
@@ -33,6 +47,22 @@ GITHUB_WORKSPACE = check_and_load("GITHUB_WORKSPACE")
 GITHUB_TOKEN = check_and_load("GITHUB_TOKEN")
 GITHUB_REPOSITORY = check_and_load("GITHUB_REPOSITORY")
 GITHUB_REF_NAME = check_and_load("GITHUB_REF_NAME")
+#: Same on reruns of a workflow run, None outside of GitHub Actions
+GITHUB_RUN_ID = load_or_default("GITHUB_RUN_ID")
+
+#: GitHub App, installation tokens are used instead of GITHUB_TOKEN when set
+GITHUB_APP_ID = load_or_default("GITHUB_APP_ID")
+GITHUB_APP_PRIVATE_KEY = load_or_default("GITHUB_APP_PRIVATE_KEY")
+GITHUB_APP_INSTALLATION_ID = load_or_default("GITHUB_APP_INSTALLATION_ID")
+#: Extra tokens for reads, separated by comma or newline
+GITHUB_EXTRA_TOKENS = [
+    token.strip() for token in re.split(r"[,\n]", load_or_default("GITHUB_EXTRA_TOKENS", "")) if token.strip()
+]
+
+#: Tokens of other repositories, `owner/repo=token` or `owner=token` separated by comma or newline
+GITHUB_REPO_TOKENS = dict(
+    item.strip().split("=", 1) for item in re.split(r"[,\n]", load_or_default("GITHUB_REPO_TOKENS", "")) if "=" in item
+)
 
 #: Castanets
 CASTANETS_CONFIG_PATH = check_and_load("CASTANETS_CONFIG_PATH")
@@ -42,10 +72,31 @@ ISSUE_AUTOCLOSE = boolean_str_to_bool(check_and_load("ISSUE_AUTOCLOSE"))
 SLACK = boolean_str_to_bool(check_and_load("SLACK"))
 SLACK_TOKEN = check_and_load("SLACK_TOKEN") if SLACK else None
 SLACK_CHANNEL = check_and_load("SLACK_CHANNEL") if SLACK else None
+SLACK_USER_CACHE_TTL = int(load_or_default("SLACK_USER_CACHE_TTL", "86400"))
 
 #: Teams
 TEAMS = boolean_str_to_bool(check_and_load("TEAMS"))
 TEAMS_WEBHOOK_URL = check_and_load("TEAMS_WEBHOOK_URL") if TEAMS else None
 
+#: Tracing
+CASTANETS_TRACE_PATH = load_or_default("CASTANETS_TRACE_PATH")
+CASTANETS_PROFILE_DIR = load_or_default("CASTANETS_PROFILE_DIR")
+
+#: Cache
+CASTANETS_TEAM_CACHE_TTL = int(load_or_default("CASTANETS_TEAM_CACHE_TTL", "3600"))
+
+#: Analytics
+CASTANETS_ANALYTICS_STORE = load_or_default("CASTANETS_ANALYTICS_STORE", ".castanets/analytics.json")
+CASTANETS_ANALYTICS_OUTPUT = load_or_default("CASTANETS_ANALYTICS_OUTPUT", "castanets_analytics.csv")
+CASTANETS_ANALYTICS_MIN_RATE_LIMIT = int(load_or_default("CASTANETS_ANALYTICS_MIN_RATE_LIMIT", "100"))
+
+#: State store (comment, git_ref or sqlite)
+CASTANETS_STATE_STORE = load_or_default("CASTANETS_STATE_STORE", "comment")
+CASTANETS_STATE_REF = load_or_default("CASTANETS_STATE_REF", "refs/heads/castanets-state")
+CASTANETS_STATE_DB = load_or_default("CASTANETS_STATE_DB", ".castanets/state.db")
+
 #: Others
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(ROOT_DIR, "templates")
+#: Templates compiled to Python modules by `scripts/build_runner.py`
+COMPILED_TEMPLATES_DIR = os.path.join(TEMPLATES_DIR, "compiled")
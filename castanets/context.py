@@ -1,7 +1,7 @@
 import os
 import sys
-
-from pydantic.dataclasses import dataclass
+from dataclasses import dataclass
+from typing import Optional
 
 from .constants import (
     CASTANETS_CONFIG_PATH,
@@ -12,8 +12,9 @@ from .constants import (
     GITHUB_TOKEN,
     GITHUB_WORKSPACE,
 )
-from .models.contexts import CastanetsContext, GithubActionsContext
-from .utils import github
+from .models import CastanetsContext, GithubActionsContext, SlimModel, load_config_index
+from .stores import get_state_store
+from .utils import find_correlation_id, get_castanets_params_from_comment, get_issue_id_from_correlation_id, github
 
 
 @dataclass
@@ -22,10 +23,16 @@ class Context:
     Manage the context of the current execution.
     """
 
-    #: Github Actions context
-    github_actions: GithubActionsContext
-    #: Castanets context
-    castanets: CastanetsContext
+    #: Github Actions context (SlimGithubActionsContext)
+    github_actions: SlimModel
+    #: Castanets context, None if no process config of the config directory matches the issue
+    castanets: Optional[CastanetsContext]
+    #: Issue data fetched on construction, kept up to date by commands
+    issue: Optional[dict] = None
+    #: Castanets state read on construction, updated by commands
+    state: Optional[dict] = None
+    #: Whether commands changed the state, written by the engine after running commands
+    state_changed: bool = False
 
     @classmethod
     def construct(cls) -> "Context":
@@ -40,31 +47,81 @@ class Context:
             token=GITHUB_TOKEN,
         )
 
+        # Tracked workflow runs carry the issue number in their correlation ID
+        if github_actions.workflow_run is not None:
+            correlation_id = find_correlation_id(github_actions.workflow_run.display_title)
+            if correlation_id is not None:
+                github_actions = github_actions.replace(issue_id=get_issue_id_from_correlation_id(correlation_id))
+
+        return cls.load(github_actions)
+
+    @classmethod
+    def load(cls, github_actions: SlimModel) -> "Context":
+        """
+        Load the state, the issue and the process config of the issue in the Github Actions context.
+
+        :param github_actions: Github Actions context (SlimGithubActionsContext)
+        """
         # Get Castanets State and Parameters
         if github_actions.issue_id is not None:
-            state = github.read_state_from_first_comment(github_actions)
-            params = github.read_params_from_issue_body(github_actions)
+            state = get_state_store().read(github_actions)
+            issue = github.get_issue(github_actions)
+            params = get_castanets_params_from_comment(issue["body"]) if issue and issue["body"] else {}
         else:
             state = {}
+            issue = None
             params = {}
 
+        # With a config directory, the process config is routed by the issue, and kept in the state once started
+        config_path = os.path.join(GITHUB_WORKSPACE, CASTANETS_CONFIG_PATH)
+        config_name = None
+        if os.path.isdir(config_path):
+            config_name = state.get("config")
+            if config_name is None and issue is not None:
+                config_name = load_config_index(config_path).route(issue, params)
+            if config_name is None:
+                return cls(github_actions=github_actions, castanets=None, issue=issue, state=state)
+            config_path = os.path.join(config_path, config_name)
+
         stage_idx = state.get("stage_idx", None)
-        approvers = state.get("approvers", None)
         finished = state.get("finished", False)
         castanets = CastanetsContext.construct(
-            os.path.join(GITHUB_WORKSPACE, CASTANETS_CONFIG_PATH),
+            config_path,
             github_actions,
             state,
             finished=finished,
             params=params,
             stage_idx=stage_idx,
-            approvers=approvers,
+            config_name=config_name,
         )
 
+        # State of older version has only one running stage
+        if "stages" not in state and stage_idx is not None:
+            label = castanets.config.stages[stage_idx].label
+            state["stages"] = {label: {"status": "running", "approvers": state.pop("approvers", None) or []}}
+        if stage_idx is not None:
+            current_stage = state.get("stages", {}).get(castanets.config.stages[stage_idx].label, {})
+            castanets.approvers = current_stage.get("approvers")
+
         return cls(
             github_actions=github_actions,
             castanets=castanets,
+            issue=issue,
+            state=state,
         )
 
+    def switch_issue(self, issue_id: int):
+        """
+        Load another issue in place, so modules holding the context see it. Used by the sweep over many issues.
+
+        :param issue_id: Issue number
+        """
+        loaded = self.load(self.github_actions.replace(issue_id=issue_id))
+        self.github_actions = loaded.github_actions
+        self.castanets = loaded.castanets
+        self.issue = loaded.issue
+        self.state = loaded.state
+        self.state_changed = False
+
 
 sys.modules[__name__] = Context.construct()
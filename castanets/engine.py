@@ -1,14 +1,29 @@
+import copy
+import json
 import sys
+from datetime import datetime, timedelta, timezone
 from queue import Queue
-from typing import Any, List
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from castanets import context
+from castanets import context, hooks
 from castanets.alerts import BaseAlert
-from castanets.commands import get_command
-from castanets.utils import get_logger, github
+from castanets.commands import CommandInputError, get_command
+from castanets.constants import GITHUB_RUN_ID
+from castanets.stores import get_state_store
+from castanets.utils import format_github_datetime, get_logger, github, parse_github_datetime, parse_slash_commands
 
 logger = get_logger(__name__)
 
+#: Slash commands on a stage, and their command names
+STAGE_SLASH_COMMANDS = {"rerun": "stage_rerun", "clean_up": "stage_clean_up", "stage_next": "stage_next"}
+#: Failed alerts kept in the outbox of the state at most, the oldest are dropped
+MAX_ALERT_OUTBOX_SIZE = 50
+#: Failed deliveries of an alert before it is dropped
+MAX_ALERT_ATTEMPTS = 8
+#: Seconds before the first redelivery, doubled on each failure up to `MAX_ALERT_RETRY_DELAY`
+ALERT_RETRY_DELAY = 60
+MAX_ALERT_RETRY_DELAY = 6 * 3600
+
 
 class CastanetsEngine:
     """
@@ -22,27 +37,169 @@ class CastanetsEngine:
     - You can register alert handlers (Class that inherits `BaseAlert`) with `register_alert` method.
     - Each alert handler will be called when a command is executed.
 
+    3. Hook Management
+    - You can register lifecycle hooks (Class that inherits `BaseHook`) with `register_hook` method.
+    - Each hook will be called before and after commands, alerts and GitHub API calls.
+
+    4. Run Journal
+    - When a command fails, the state before the command is written with a journal of the remaining commands
+      and the side effects (`run_once` steps) of the failed command which already completed.
+    - A rerun of the same workflow run resumes the remaining commands, skipping the completed steps.
+
     :param config_path: Configuration file path
     """
 
     _command_queue: Queue = Queue()
     _alerts: List[BaseAlert] = []
+    _comment_renderer: Optional[Callable[[], Optional[str]]] = None
+    _last_seq: int = 0
+    _current_command: Optional[Tuple[int, str]] = None
+    _steps: Dict[str, Any] = {}
+    _step_counts: Dict[str, int] = {}
+    _resumed: bool = False
 
     def run(self):
         """
-        Run commands in command queue.
+        Run commands in command queue, after redelivering alerts of the outbox.
+        State changed by commands is written once, after the queue is empty or a command failed.
         """
-        while not self._command_queue.empty():
-            command_name, args, kwargs = self._command_queue.get()
-            command = get_command(command_name)
+        try:
+            self.flush_alerts()
+            while not self._command_queue.empty():
+                seq, command_name, args, kwargs = self._command_queue.get()
+                command = get_command(command_name)
+                snapshot = copy.deepcopy(context.state)
+                self._current_command = (seq, command_name)
+                self._step_counts = {}
 
+                try:
+                    logger.info("Running command %s with args: %s and kwargs: %s", command_name, args, kwargs)
+                    with hooks.span("command", command_name, args=args, kwargs=kwargs):
+                        output = command(*args, **kwargs)
+                except CommandInputError as e:
+                    # A mistake in a slash command is replied to the issue, and the other commands still run
+                    logger.warning("Ignore command %s: %s", command_name, e)
+                    context.state = snapshot
+                    reply = f"`{command_name}` was ignored. {e}"
+                    self.run_once("reply", lambda: github.comment(context.github_actions, reply))
+                    self._current_command = None
+                    self._steps = {}
+                    continue
+                except Exception as e:
+                    self._suspend(snapshot, (seq, command_name, args, kwargs))
+                    raise RuntimeError(f"{command_name} Command 실행에 실패하였습니다.") from e
+
+                self.alert(command._command_name, output)
+                self._current_command = None
+                self._steps = {}
+
+            if self._resumed and context.state is not None:
+                context.state.pop("journal", None)
+                context.state_changed = True
+        except Exception:
+            # The journal is written on failure, without hiding the error of the command
             try:
-                logger.info(f"Running command {command_name} with args: {args} and kwargs: {kwargs}")
-                output = command(*args, **kwargs)
-            except Exception as e:
-                raise RuntimeError(f"{command_name} Command 실행에 실패하였습니다.") from e
+                self.write_state()
+            except Exception:
+                logger.exception("Failed to write state after a failed command")
+            raise
+        self.write_state()
+
+    def _suspend(self, snapshot: Optional[dict], failed_command: tuple):
+        """
+        Restore the state before the failed command, and journal the remaining commands with completed steps.
+        Changes of the failed command are never written. Nothing is journaled outside of GitHub Actions,
+        and nothing is written before the state comment exists.
+
+        :param snapshot: State before the failed command
+        :param failed_command: Sequence number, name, args and kwargs of the failed command
+        """
+        context.state = snapshot
+        if not snapshot:
+            context.state_changed = False
+            return
+        if GITHUB_RUN_ID is None:
+            return
+
+        pending = [failed_command]
+        while not self._command_queue.empty():
+            pending.append(self._command_queue.get())
+        context.state["journal"] = {
+            "run_id": GITHUB_RUN_ID,
+            "pending": [[seq, name, list(args), kwargs] for seq, name, args, kwargs in pending],
+            "steps": self._steps,
+        }
+        context.state_changed = True
+
+    def _resume(self, journal: dict) -> bool:
+        """
+        Resume commands of the journal if it was written by the same workflow run (rerun).
+        A journal of another run is dropped, since the event of the run is not replayed.
+
+        :param journal: Journal in the state
+        :returns: True if the commands are resumed
+        """
+        context.state.pop("journal")
+        context.state_changed = True
+        if journal["run_id"] != GITHUB_RUN_ID:
+            logger.warning("Drop journal of workflow run %s, commands left: %s", journal["run_id"], journal["pending"])
+            return False
 
-            self.alert(command._command_name, output)
+        logger.info("Resume commands of workflow run %s: %s", GITHUB_RUN_ID, journal["pending"])
+        for seq, command_name, args, kwargs in journal["pending"]:
+            self._command_queue.put((seq, command_name, tuple(args), kwargs))
+            self._last_seq = max(self._last_seq, seq)
+        self._steps = journal["steps"]
+        self._resumed = True
+        return True
+
+    def run_once(self, step: str, func: Callable[[], Any], record: bool = False) -> Any:
+        """
+        Run a side effect of the current command once per workflow run.
+        When the command is resumed after a failure, the completed step is skipped.
+        Steps are keyed by command sequence, command name, step name and its order in the command,
+        so use unique step names for steps run concurrently.
+
+        :param step: Step name
+        :param func: Side effect to run
+        :param record: Record the result (JSON serializable), and return it when the step is skipped
+        :returns: Result of the side effect, or the recorded result if skipped
+        """
+        if self._current_command is None:
+            return func()
+
+        seq, command_name = self._current_command
+        order = self._step_counts.get(step, 0)
+        self._step_counts[step] = order + 1
+        key = f"{seq}:{command_name}:{step}#{order}"
+        if key in self._steps:
+            logger.info("Skip completed step %s", key)
+            return self._steps[key]
+
+        result = func()
+        self._steps[key] = result if record else None
+        return result
+
+    def reset(self):
+        """
+        Drop commands and steps left by the previous issue, before running commands of another issue.
+        """
+        self._command_queue = Queue()
+        self._current_command = None
+        self._steps = {}
+        self._step_counts = {}
+        self._resumed = False
+
+    def write_state(self):
+        """
+        Write state to the state store if commands changed it.
+        The comment body is re-rendered with the comment renderer, if it returns a body.
+        """
+        if not context.state_changed:
+            return
+        body = self._comment_renderer() if self._comment_renderer is not None else None
+        get_state_store().write(context.github_actions, context.state, body)
+        context.state_changed = False
 
     def push_command(self, command_name: str, *args, **kwargs):
         """
@@ -50,7 +207,8 @@ class CastanetsEngine:
 
         :param command: Name of command
         """
-        self._command_queue.put((command_name, args, kwargs))
+        self._last_seq += 1
+        self._command_queue.put((self._last_seq, command_name, args, kwargs))
 
     def push_command_from_context(self):
         """
@@ -59,14 +217,18 @@ class CastanetsEngine:
         event_name = context.github_actions.event_name
         action = context.github_actions.action
 
+        # Rerun of a failed workflow run continues its commands
+        journal = (context.state or {}).get("journal")
+        if journal is not None and self._resume(journal):
+            return
+
         if context.castanets.finished:
             return
 
         if event_name in ["pull_request", "issues"] and action == "opened":
             self.push_command("initialize")
-            self.push_command("stage_start", 0)
+            self.push_command("process_start")
         elif event_name == "issue_comment" and action == "created":
-            comment = context.github_actions.issue_comment
             author = context.github_actions.issue_comment_author
             action_user = github.get_user(context=context.github_actions)
 
@@ -74,31 +236,204 @@ class CastanetsEngine:
             if author == action_user["login"]:
                 return
 
-            # If current comment is not slash command, then do nothing.
-            if not comment.startswith("/"):
+            # Help is posted once, even if several commands are unknown
+            help_pushed = False
+            for comment_author, tokens in self._get_new_slash_commands(action_user["login"]):
+                command_name, args, kwargs = self._get_slash_command(comment_author, tokens)
+                if command_name == "help":
+                    if help_pushed:
+                        continue
+                    help_pushed = True
+                self.push_command(command_name, *args, **kwargs)
+        elif event_name == "pull_request_review" and action in ["submitted", "dismissed"]:
+            if context.castanets.config.pull_request_reviews:
+                self.push_command("sync_reviews")
+        elif event_name == "workflow_run" and action == "completed":
+            # Only runs linked to an issue with correlation ID
+            if context.github_actions.issue_id is None:
                 return
+            self.push_command("workflow_completed")
+
+    def _get_new_slash_commands(self, action_user: str) -> List[Tuple[str, List[str]]]:
+        """
+        Get slash commands of comments newer than the watermark in the state, in order of comments.
+        Comments of runs which were cancelled or are still waiting are processed together,
+        so runs after them find nothing new. The watermark is moved to the last comment with commands.
+
+        :param action_user: Username of GitHub PAT's user, whose comments are ignored
+        :returns: Author and tokens of each command
+        """
+        github_actions = context.github_actions
+        watermark = (context.state or {}).get("comment_watermark")
+        comment_id = github_actions.issue_comment_id
+
+        if watermark is None or comment_id is None:
+            # First command of the process, or a legacy state. Only the current comment is processed.
+            comments = [
+                {
+                    "id": comment_id,
+                    "body": github_actions.issue_comment,
+                    "user": {"login": github_actions.issue_comment_author},
+                    "created_at": github_actions.issue_comment_created_at,
+                }
+            ]
+        elif comment_id <= watermark["id"]:
+            logger.info("Comment %s was already processed with the watermark %s.", comment_id, watermark["id"])
+            return []
+        else:
+            comments = [
+                comment
+                for comment in github.get_comments_since(github_actions, watermark["created_at"])
+                if comment["id"] > watermark["id"] and comment["user"]["login"] != action_user
+            ]
+
+        commands = []
+        last_comment = None
+        for comment in sorted(comments, key=lambda comment: comment["id"] or 0):
+            for tokens in parse_slash_commands(comment["body"] or ""):
+                commands.append((comment["user"]["login"], tokens))
+                last_comment = comment
+
+        # Started process only, the state comment exists
+        if context.state and last_comment is not None and last_comment["id"] is not None:
+            context.state["comment_watermark"] = {"id": last_comment["id"], "created_at": last_comment["created_at"]}
+            context.state_changed = True
+        return commands
+
+    def _get_slash_command(self, author: str, tokens: List[str]) -> Tuple[str, tuple, dict]:
+        """
+        Get command of a slash command. Unknown slash command is help.
+        Slash command can name the target stage, like `/approve stage_label`.
 
-            command = comment[1:].split()[0]
-            if command in ["approve", "dismiss"]:
-                self.push_command(command, author)
-            elif command == ["rerun", "clean_up", "stage_next", "finish", "help"]:
-                self.push_command(command)
-            else:
-                self.push_command("help")
+        :param author: Author of the comment
+        :param tokens: Tokens of the slash command without the leading slash
+        :returns: Command name, args and kwargs
+        """
+        command = tokens[0]
+        stage_args = tuple(token for token in tokens[1:] if not token.startswith("--"))[:1]
+        if command in ["approve", "dismiss"]:
+            # Approvals come from pull request reviews in this mode
+            if context.castanets.config.pull_request_reviews:
+                return "help", (), {}
+            return command, (author, *stage_args), {}
+        elif command == "rerun" and "--force" in tokens:
+            return "stage_rerun", stage_args, {"force": True}
+        elif command in STAGE_SLASH_COMMANDS:
+            return STAGE_SLASH_COMMANDS[command], stage_args, {}
+        elif command == "finish":
+            return command, (), {}
+        return "help", (), {}
 
     def alert(self, key: str, payload: Any):
         """
-        Make an alert.
+        Make an alert. A failed alert is kept in the outbox of the state and redelivered by later runs,
+        so an unavailable chat backend doesn't fail the command.
 
+        :param key: Key(command_name) of alert
+        :param payload: Payload of alert
+        """
+        for alert_handler in self._alerts:
+            logger.info("Alerting %s with payload: %s", alert_handler.__class__.__name__, payload)
+            handler_name = alert_handler.__class__.__name__
+            with hooks.span("alert", key, handler=handler_name):
+                self.run_once(f"alert:{handler_name}", lambda: self._send_alert(alert_handler, key, payload))
+
+    def _send_alert(self, alert_handler: BaseAlert, key: str, payload: Any):
+        """
+        Send an alert, or keep it in the outbox if it fails.
+
+        :param alert_handler: Alert handler
         :param key: Key(command_name) of alert
         :param payload: Payload of alert
         """
         try:
-            for alert_handler in self._alerts:
-                logger.info(f"Alerting {alert_handler.__class__.__name__} with payload: {payload}")
-                alert_handler.alert(key, payload)
-        except Exception as e:
-            raise RuntimeError(f"Alert for {key} event failed.") from e
+            alert_handler.alert(key, payload)
+        except Exception:
+            logger.exception(
+                "Alert for %s event of %s failed, keep it in the outbox", key, alert_handler.__class__.__name__
+            )
+            self._enqueue_alert(alert_handler.__class__.__name__, key, payload)
+
+    @staticmethod
+    def _get_alert_retry_at(attempts: int) -> str:
+        delay = min(ALERT_RETRY_DELAY * 2 ** (attempts - 1), MAX_ALERT_RETRY_DELAY)
+        return format_github_datetime(datetime.now(timezone.utc) + timedelta(seconds=delay))
+
+    def _enqueue_alert(self, handler_name: str, key: str, payload: Any):
+        """
+        Keep a failed alert in the outbox of the state, written with the state after the commands.
+
+        :param handler_name: Class name of the alert handler
+        :param key: Key(command_name) of alert
+        :param payload: Payload of alert, JSON serializable
+        """
+        if context.state is None:
+            logger.warning("Drop alert for %s event of %s, the issue has no state", key, handler_name)
+            return
+        try:
+            payload = json.loads(json.dumps(payload))
+        except (TypeError, ValueError):
+            logger.warning("Drop alert for %s event of %s, the payload is not serializable", key, handler_name)
+            return
+
+        outbox = context.state.setdefault("alert_outbox", [])
+        outbox.append(
+            {
+                "handler": handler_name,
+                "key": key,
+                "payload": payload,
+                "attempts": 1,
+                "retry_at": self._get_alert_retry_at(1),
+            }
+        )
+        if len(outbox) > MAX_ALERT_OUTBOX_SIZE:
+            dropped = outbox[:-MAX_ALERT_OUTBOX_SIZE]
+            del outbox[:-MAX_ALERT_OUTBOX_SIZE]
+            logger.warning("Alert outbox is full, drop alerts for %s", [entry["key"] for entry in dropped])
+        context.state_changed = True
+
+    def flush_alerts(self):
+        """
+        Redeliver alerts of the outbox whose retry time has come, in one batch per handler.
+        Alerts failed again are retried with exponential backoff, and dropped after `MAX_ALERT_ATTEMPTS`.
+        Alerts of handlers not registered in this run are kept.
+        """
+        outbox = (context.state or {}).get("alert_outbox")
+        if not outbox:
+            return
+
+        now = datetime.now(timezone.utc)
+        handlers = {alert_handler.__class__.__name__: alert_handler for alert_handler in self._alerts}
+        delivered_ids = set()
+        for handler_name, alert_handler in handlers.items():
+            due = [
+                entry
+                for entry in outbox
+                if entry["handler"] == handler_name and parse_github_datetime(entry["retry_at"]) <= now
+            ]
+            if not due:
+                continue
+            logger.info("Redeliver %d alerts of %s from the outbox", len(due), handler_name)
+            with hooks.span("alert", "outbox", handler=handler_name):
+                delivered = alert_handler.alert_batch([(entry["key"], entry["payload"]) for entry in due])
+            delivered_ids.update(id(entry) for entry in due[:delivered])
+            for entry in due[delivered:]:
+                entry["attempts"] += 1
+                entry["retry_at"] = self._get_alert_retry_at(entry["attempts"])
+                if entry["attempts"] > MAX_ALERT_ATTEMPTS:
+                    logger.warning(
+                        "Drop alert for %s event of %s after %d attempts",
+                        entry["key"],
+                        handler_name,
+                        MAX_ALERT_ATTEMPTS,
+                    )
+            context.state_changed = True
+
+        kept = [entry for entry in outbox if id(entry) not in delivered_ids and entry["attempts"] <= MAX_ALERT_ATTEMPTS]
+        if kept:
+            context.state["alert_outbox"] = kept
+        else:
+            context.state.pop("alert_outbox")
 
     def register_alert(self, alert: BaseAlert):
         """
@@ -108,5 +443,22 @@ class CastanetsEngine:
         """
         self._alerts.append(alert)
 
+    def set_comment_renderer(self, renderer: Callable[[], Optional[str]]):
+        """
+        Set a function rendering the body of the state comment, called when the state is written.
+        The renderer returns None to keep the current body.
+
+        :param renderer: Comment renderer
+        """
+        self._comment_renderer = renderer
+
+    def register_hook(self, hook: hooks.BaseHook):
+        """
+        Register a lifecycle hook, called before and after commands, alerts and GitHub API calls.
+
+        :param hook: Hook instance
+        """
+        hooks.register_hook(hook)
+
 
 sys.modules[__name__] = CastanetsEngine()
@@ -0,0 +1,8 @@
+from .base import BaseHook, Span, registry
+from .chrome_trace import ChromeTraceHook
+from .profile import ProfileHook
+
+span = registry.span
+register_hook = registry.register_hook
+
+__all__ = ["BaseHook", "Span", "ChromeTraceHook", "ProfileHook", "registry", "span", "register_hook"]
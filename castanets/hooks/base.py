@@ -0,0 +1,139 @@
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from castanets.utils import get_logger
+
+logger = get_logger(__name__)
+
+#: Shared no-op context manager returned when no hook is registered.
+_NULL_SPAN = nullcontext()
+
+
+@dataclass
+class Span:
+    """
+    Timing record of one traced operation.
+    """
+
+    #: Kind of operation (command, alert, http)
+    kind: str
+    #: Name of operation (command name, alert key, API endpoint)
+    name: str
+    #: Arguments of operation
+    args: Dict[str, Any] = field(default_factory=dict)
+    #: Start time from `time.perf_counter`, in seconds
+    start: float = 0.0
+    #: Duration in seconds
+    duration: float = 0.0
+    #: Representation of the raised exception, if any
+    error: Optional[str] = None
+
+
+class BaseHook:
+    """
+    Base class for Castanets lifecycle hooks.
+
+    Hooks are called before and after every command, alert and GitHub API call.
+    Override only the methods you need.
+
+    Example
+    --------
+    .. code-block:: python
+        class SlowCommandHook(BaseHook):
+            def after(self, span: Span):
+                if span.kind == "command" and span.duration > 10:
+                    print(f"{span.name} took {span.duration:.1f}s")
+
+        hooks.register_hook(SlowCommandHook())
+    """
+
+    def before(self, span: Span):
+        """
+        Called before an operation starts.
+
+        :param span: Span of the operation (duration is not set yet)
+        """
+
+    def after(self, span: Span):
+        """
+        Called after an operation finished, including failures.
+
+        :param span: Span of the operation
+        """
+
+    def close(self):
+        """
+        Called once when the Castanets run is over.
+        """
+
+
+class HookRegistry:
+    """
+    Registry of lifecycle hooks.
+    While no hook is registered, `span` returns a shared no-op context manager.
+    """
+
+    def __init__(self):
+        self._hooks: List[BaseHook] = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._hooks)
+
+    def register_hook(self, hook: BaseHook):
+        """
+        Register a hook.
+
+        :param hook: Hook instance
+        """
+        self._hooks.append(hook)
+
+    def span(self, kind: str, name: str, **args):
+        """
+        Trace an operation.
+
+        .. code-block:: python
+            with hooks.span("command", "stage_start", stage_idx=0) as span:
+                ...
+
+        :param kind: Kind of operation (command, alert, http)
+        :param name: Name of operation
+        :param args: Arguments recorded in the span
+        :returns: Context manager yielding `Span`, or `None` when no hook is registered
+        """
+        if not self._hooks:
+            return _NULL_SPAN
+        return self._span(kind, name, args)
+
+    @contextmanager
+    def _span(self, kind: str, name: str, args: Dict[str, Any]):
+        span = Span(kind=kind, name=name, args=args)
+        for hook in self._hooks:
+            hook.before(span)
+
+        span.start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.duration = time.perf_counter() - span.start
+            for hook in reversed(self._hooks):
+                hook.after(span)
+
+    def close(self):
+        """
+        Close every registered hook.
+        """
+        for hook in self._hooks:
+            try:
+                hook.close()
+            except Exception:
+                logger.exception("Closing hook %s failed.", hook.__class__.__name__)
+
+
+#: Global hook registry
+registry = HookRegistry()
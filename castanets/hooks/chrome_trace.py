@@ -0,0 +1,47 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List
+
+from .base import BaseHook, Span
+
+
+class ChromeTraceHook(BaseHook):
+    """
+    Export spans as a Chrome trace-event JSON file.
+    Open the file with `chrome://tracing` or https://ui.perfetto.dev.
+
+    :param path: Output file path
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._events: List[Dict[str, Any]] = []
+        # perf_counter has an arbitrary epoch, so keep the offset to wall clock time.
+        self._epoch = time.time() - time.perf_counter()
+
+    def after(self, span: Span):
+        args = {key: repr(value) for key, value in span.args.items()}
+        if span.error is not None:
+            args["error"] = span.error
+
+        self._events.append(
+            {
+                "name": span.name,
+                "cat": span.kind,
+                "ph": "X",
+                "ts": int((self._epoch + span.start) * 1_000_000),
+                "dur": int(span.duration * 1_000_000),
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+        )
+
+    def close(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump({"traceEvents": self._events, "displayTimeUnit": "ms"}, f)
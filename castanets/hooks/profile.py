@@ -0,0 +1,33 @@
+import cProfile
+import os
+
+from .base import BaseHook, Span
+
+
+class ProfileHook(BaseHook):
+    """
+    Profile each command with `cProfile` and dump the stats to a directory.
+    Dumps are named `<order>_<command>.pstats` and can be read with `pstats` or `snakeviz`.
+
+    :param directory: Output directory
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._profiler = None
+        self._count = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def before(self, span: Span):
+        if span.kind != "command":
+            return
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+
+    def after(self, span: Span):
+        if span.kind != "command" or self._profiler is None:
+            return
+        self._profiler.disable()
+        self._profiler.dump_stats(os.path.join(self.directory, f"{self._count:03d}_{span.name}.pstats"))
+        self._profiler = None
+        self._count += 1
@@ -1,11 +1,52 @@
-from .castanets_config import CastanetsConfig, CastanetsStage, Review, Workflow
-from .contexts import CastanetsContext, GithubActionsContext
+from .castanets_config import (
+    CastanetsConfig,
+    CastanetsStage,
+    Review,
+    Workflow,
+    WorkflowOutput,
+    WorkflowTarget,
+    parse_duration,
+)
+from .contexts import CastanetsContext, GithubActionsContext, SlimGithubActionsContext, SlimWorkflowRun, WorkflowRun
+from .routes import CONFIG_INDEX_FILENAME, ConfigIndex, ProcessRoute, load_config_index
+from .runtime import (
+    SlimCastanetsConfig,
+    SlimCastanetsStage,
+    SlimModel,
+    SlimReview,
+    SlimWorkflow,
+    SlimWorkflowOutput,
+    SlimWorkflowTarget,
+    compile_config,
+    slim_model,
+    to_slim,
+)
 
 __all__ = [
     "Review",
     "Workflow",
+    "WorkflowOutput",
+    "WorkflowTarget",
     "CastanetsStage",
     "CastanetsConfig",
+    "parse_duration",
     "GithubActionsContext",
     "CastanetsContext",
+    "WorkflowRun",
+    "ProcessRoute",
+    "ConfigIndex",
+    "CONFIG_INDEX_FILENAME",
+    "load_config_index",
+    "SlimModel",
+    "SlimReview",
+    "SlimWorkflow",
+    "SlimWorkflowOutput",
+    "SlimWorkflowTarget",
+    "SlimCastanetsStage",
+    "SlimCastanetsConfig",
+    "SlimGithubActionsContext",
+    "SlimWorkflowRun",
+    "compile_config",
+    "slim_model",
+    "to_slim",
 ]
@@ -1,8 +1,27 @@
-from typing import List, Optional
+import re
+from typing import Any, Dict, List, Optional, Tuple
 
 from pydantic import validator
 from pydantic.dataclasses import dataclass
 
+#: Duration like `30m`, `12h`, `2d` or `1w`
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)([mhdw])")
+#: Seconds of duration units
+DURATION_UNITS = {"m": 60, "h": 60 * 60, "d": 24 * 60 * 60, "w": 7 * 24 * 60 * 60}
+
+
+def parse_duration(value: str) -> float:
+    """
+    Parse duration like `30m`, `12h`, `2d` or `1w`.
+
+    :param value: Duration
+    :returns: Seconds
+    """
+    match = DURATION_PATTERN.fullmatch(value.strip())
+    if match is None:
+        raise ValueError(f"Invalid duration: {value}, use a number with m, h, d or w like 12h.")
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
 
 @dataclass
 class Review:
@@ -10,24 +29,73 @@ class Review:
     Review condition for current stage's approval.
     """
 
-    #: Usernames of reviewers
+    #: Usernames or `org/team` of reviewers
     reviewers: List[str]
-    #: Usernames who must review
+    #: Usernames or `org/team` who must review. A team is satisfied by an approval of any member.
     must_review: List[str]
     #: Minimum number of approvals required
     minimum_approval: int
+    #: Require an approval from each team in reviewers
+    one_per_team: bool = False
 
-    def is_stage_approved(self, approvers: List[str]) -> bool:
+    @staticmethod
+    def is_team(reviewer: str) -> bool:
+        """
+        Check the reviewer is a team (`org/team`).
+
+        :param reviewer: Username or `org/team`
+        """
+        return "/" in reviewer
+
+    @property
+    def users(self) -> List[str]:
+        """
+        Usernames of reviewers, without teams.
+        """
+        return [reviewer for reviewer in self.reviewers if not self.is_team(reviewer)]
+
+    @property
+    def teams(self) -> List[str]:
+        """
+        Teams (`org/team`) of reviewers.
+        """
+        return [reviewer for reviewer in self.reviewers if self.is_team(reviewer)]
+
+    @property
+    def required_teams(self) -> List[str]:
+        """
+        Teams whose members are needed to evaluate the approval.
+        """
+        if self.one_per_team:
+            return self.teams
+        return [reviewer for reviewer in self.must_review if self.is_team(reviewer)]
+
+    def is_stage_approved(self, approvers: List[str], team_members: Optional[Dict[str, List[str]]] = None) -> bool:
         """
         Get current stage's approval status.
 
         :param approvers: Users who approved the stage
+        :param team_members: Members of `required_teams` by `org/team`
         """
-        return all(reviewer in approvers for reviewer in self.must_review) and len(approvers) >= self.minimum_approval
+        approved = set(approvers)
+        team_members = team_members or {}
+
+        def is_satisfied(reviewer: str) -> bool:
+            if self.is_team(reviewer):
+                return not approved.isdisjoint(team_members.get(reviewer, []))
+            return reviewer in approved
+
+        if not all(is_satisfied(reviewer) for reviewer in self.must_review):
+            return False
+        if self.one_per_team and not all(is_satisfied(team) for team in self.teams):
+            return False
+        return len(approved) >= self.minimum_approval
 
     @validator("reviewers", always=True)
     def _validate_reviewers(cls, v: List[str]) -> List[str]:
         assert len(v) > 0, "Reviewers must be at least one."
+        for reviewer in v:
+            assert reviewer.count("/") <= 1, f"Team reviewer {reviewer} must be org/team."
         return v
 
     @validator("must_review", each_item=True)
@@ -41,6 +109,46 @@ class Review:
         return v
 
 
+@dataclass
+class WorkflowOutput:
+    """
+    Outputs file in an artifact of the workflow run, merged into `state.workflow_output`.
+    """
+
+    #: Artifact name
+    artifact: str
+    #: Path of outputs file (JSON or YAML) in the artifact
+    path: str = "outputs.json"
+    #: Maximum size of the artifact zip in bytes, the zip is streamed to a temporary file
+    max_artifact_size: int = 2 * 1024 * 1024 * 1024
+    #: Maximum size of the outputs file in bytes, the file is read into memory
+    max_output_size: int = 1024 * 1024
+
+    @validator("max_artifact_size", "max_output_size", always=True)
+    def _validate_size(cls, v: int) -> int:
+        assert v > 0, "Size limit must be greater than 0."
+        return v
+
+
+@dataclass
+class WorkflowTarget:
+    """
+    Repository to dispatch a workflow to. A stage with several targets dispatches to all of them concurrently.
+    """
+
+    #: Repository (owner/repo), the repository of the process if not set
+    repo: Optional[str] = None
+    #: Branch or tag, `ref` of the workflow or the ref of the process if not set
+    ref: Optional[str] = None
+    #: Inputs merged over the inputs of the workflow
+    inputs: Optional[dict] = None
+
+    @validator("repo")
+    def _validate_repo(cls, v: Optional[str]) -> Optional[str]:
+        assert v is None or len(v.split("/")) == 2, f"Repository must be owner/repo: {v}"
+        return v
+
+
 @dataclass
 class Workflow:
     """
@@ -51,6 +159,104 @@ class Workflow:
     filename: str
     #: Workflow Input
     inputs: Optional[dict] = None
+    #: Track workflow run result with `workflow_run` event.
+    #: The workflow must declare `castanets_correlation_id` input and put it in `run-name`.
+    track: bool = False
+    #: Action when tracked workflow succeeded (stage_next)
+    on_success: Optional[str] = None
+    #: Action when tracked workflow failed (rerun)
+    on_failure: Optional[str] = None
+    #: Maximum attempts of tracked workflow run, including reruns
+    max_attempts: int = 1
+    #: Outputs of tracked workflow run, read from an artifact
+    output: Optional[WorkflowOutput] = None
+    #: Matrix of values, the workflow is dispatched once per combination (cell).
+    #: Use `{{ matrix.<key> }}` in inputs.
+    matrix: Optional[Dict[str, List[Any]]] = None
+    #: Maximum number of concurrent dispatches of matrix cells
+    max_parallel: int = 4
+    #: Ratio of matrix cells that must succeed before the stage can move forward
+    success_ratio: float = 1.0
+    #: Reuse the successful run with the same workflow, commit and inputs instead of dispatching
+    memoize: bool = False
+    #: Repository of the workflow (owner/repo), the repository of the process if not set.
+    #: Runs of other repositories don't send `workflow_run` events here, they are polled by `castanets sweep`.
+    repo: Optional[str] = None
+    #: Branch or tag to run the workflow on, the ref of the process if not set
+    ref: Optional[str] = None
+    #: Repositories to dispatch the workflow to, instead of `repo`
+    targets: Optional[List[WorkflowTarget]] = None
+
+    @property
+    def dispatch_targets(self) -> Tuple[WorkflowTarget, ...]:
+        """
+        Targets to dispatch the workflow to, `repo` and `ref` if targets are not set.
+        """
+        return tuple(self.targets) if self.targets else (WorkflowTarget(repo=self.repo, ref=self.ref),)
+
+    @property
+    def is_fan_out(self) -> bool:
+        """
+        Whether the workflow is dispatched more than once, per matrix cell or target.
+        """
+        return self.matrix is not None or len(self.targets or []) > 1
+
+    @validator("on_success")
+    def _validate_on_success(cls, v: Optional[str]) -> Optional[str]:
+        assert v in [None, "stage_next"], f"Invalid on_success action: {v}"
+        return v
+
+    @validator("on_failure")
+    def _validate_on_failure(cls, v: Optional[str]) -> Optional[str]:
+        assert v in [None, "rerun"], f"Invalid on_failure action: {v}"
+        return v
+
+    @validator("max_attempts", always=True)
+    def _validate_max_attempts(cls, v: int) -> int:
+        assert v > 0, "Max attempts must be greater than 0."
+        return v
+
+    @validator("output")
+    def _validate_output(cls, v: Optional[WorkflowOutput], values: dict) -> Optional[WorkflowOutput]:
+        assert v is None or values.get("track"), "Workflow output requires track: true."
+        return v
+
+    @validator("matrix")
+    def _validate_matrix(cls, v: Optional[Dict[str, List[Any]]], values: dict) -> Optional[Dict[str, List[Any]]]:
+        if v is None:
+            return v
+        assert values.get("track"), "Workflow matrix requires track: true."
+        assert v and all(len(items) > 0 for items in v.values()), "Matrix must have at least one value for each key."
+        return v
+
+    @validator("memoize")
+    def _validate_memoize(cls, v: bool, values: dict) -> bool:
+        assert not v or values.get("track"), "Workflow memoize requires track: true."
+        return v
+
+    @validator("max_parallel", always=True)
+    def _validate_max_parallel(cls, v: int) -> int:
+        assert v > 0, "Max parallel must be greater than 0."
+        return v
+
+    @validator("repo")
+    def _validate_repo(cls, v: Optional[str]) -> Optional[str]:
+        assert v is None or len(v.split("/")) == 2, f"Repository must be owner/repo: {v}"
+        return v
+
+    @validator("targets")
+    def _validate_targets(cls, v: Optional[List[WorkflowTarget]], values: dict) -> Optional[List[WorkflowTarget]]:
+        if v is None:
+            return v
+        assert len(v) > 0, "Targets must be at least one."
+        assert values.get("repo") is None, "Workflow repo and targets can't be set together."
+        assert len(v) == 1 or values.get("track"), "Workflow targets require track: true."
+        return v
+
+    @validator("success_ratio", always=True)
+    def _validate_success_ratio(cls, v: float) -> float:
+        assert 0 < v <= 1, "Success ratio must be in (0, 1]."
+        return v
 
 
 @dataclass
@@ -71,6 +277,54 @@ class CastanetsStage:
     workflow: Optional[Workflow] = None
     #: Workflow to run on stage clean up
     workflow_clean_up: Optional[Workflow] = None
+    #: Labels of stages that must be done before this stage starts.
+    #: If not set, the stage needs the previous stage in the list.
+    needs: Optional[List[str]] = None
+    #: Jinja expression over `params`, `state` and `github`. The stage is skipped if it is false.
+    when: Optional[str] = None
+    #: Dispatch the workflow speculatively before the stage starts, once the stages it needs are started
+    prefetch: bool = False
+    #: Ratio of minimum approvals the stages it needs must reach before prefetching
+    prefetch_approval_ratio: float = 0.0
+    #: Remind pending reviewers when the stage runs longer than it, and again after each interval (like `12h`)
+    remind_after: Optional[str] = None
+    #: Escalate once when the stage runs longer than it (like `3d`)
+    timeout: Optional[str] = None
+
+    @property
+    def remind_after_seconds(self) -> Optional[float]:
+        """
+        Seconds of `remind_after`.
+        """
+        return parse_duration(self.remind_after) if self.remind_after is not None else None
+
+    @property
+    def timeout_seconds(self) -> Optional[float]:
+        """
+        Seconds of `timeout`.
+        """
+        return parse_duration(self.timeout) if self.timeout is not None else None
+
+    @validator("prefetch")
+    def _validate_prefetch(cls, v: bool, values: dict) -> bool:
+        if not v:
+            return v
+        workflow = values.get("workflow")
+        assert workflow is not None and workflow.track, "Stage prefetch requires a workflow with track: true."
+        assert workflow.matrix is None, "Stage prefetch does not support matrix workflows."
+        assert workflow.repo is None and workflow.targets is None, "Stage prefetch does not support other repositories."
+        return v
+
+    @validator("remind_after", "timeout")
+    def _validate_duration(cls, v: Optional[str]) -> Optional[str]:
+        if v is not None:
+            parse_duration(v)
+        return v
+
+    @validator("prefetch_approval_ratio", always=True)
+    def _validate_prefetch_approval_ratio(cls, v: float) -> float:
+        assert 0 <= v <= 1, "Prefetch approval ratio must be in [0, 1]."
+        return v
 
 
 @dataclass
@@ -85,6 +339,85 @@ class CastanetsConfig:
     description: str
     #: Stages to run
     stages: List[CastanetsStage]
+    #: Slack user IDs by GitHub username, checked before looking up by email
+    slack_users: Optional[Dict[str, str]] = None
+    #: Keep one status comment, re-rendered on each transition, instead of a comment per stage
+    status_comment: bool = False
+    #: Count approvals from pull request reviews instead of `/approve` comments. Approvers are not stored in the state.
+    pull_request_reviews: bool = False
+
+    @validator("stages")
+    def _validate_stages(cls, v: List[CastanetsStage]) -> List[CastanetsStage]:
+        assert len(v) > 0, "Stages must be at least one."
+        labels = [stage.label for stage in v]
+        assert len(set(labels)) == len(labels), "Stage labels must be unique."
+        for stage in v:
+            for need in stage.needs or []:
+                assert need in labels, f"Stage {stage.label} needs unknown stage {need}."
+
+        # Check cycles with depth-first search
+        needs = {stage.label: stage.needs for stage in v}
+        for idx, stage in enumerate(v):
+            if needs[stage.label] is None:
+                needs[stage.label] = [labels[idx - 1]] if idx > 0 else []
+        visited, visiting = set(), set()
+
+        def visit(label: str):
+            assert label not in visiting, f"Stage dependencies have a cycle on {label}."
+            if label in visited:
+                return
+            visiting.add(label)
+            for need in needs[label]:
+                visit(need)
+            visiting.discard(label)
+            visited.add(label)
+
+        for label in labels:
+            visit(label)
+        return v
+
+    def get_stage_idx(self, label: str) -> int:
+        """
+        Get index of stage by label.
+
+        :param label: Stage label
+        """
+        for idx, stage in enumerate(self.stages):
+            if stage.label == label:
+                return idx
+        raise ValueError(f"Stage {label} does not exist.")
+
+    def get_needs(self, stage_idx: int) -> List[int]:
+        """
+        Get indices of stages that the stage needs.
+
+        :param stage_idx: Stage index
+        """
+        needs = self.stages[stage_idx].needs
+        if needs is None:
+            return [stage_idx - 1] if stage_idx > 0 else []
+        return [self.get_stage_idx(label) for label in needs]
+
+    def get_dependents(self, stage_idx: int) -> List[int]:
+        """
+        Get indices of stages that need the stage.
+
+        :param stage_idx: Stage index
+        """
+        return [idx for idx in range(len(self.stages)) if stage_idx in self.get_needs(idx)]
+
+    def get_ready_stages(self, stage_status: Dict[str, str]) -> List[int]:
+        """
+        Get indices of pending stages whose needs are all done or skipped.
+
+        :param stage_status: Status of stages by label (running, done, skipped). Pending stages are omitted.
+        """
+        return [
+            idx
+            for idx, stage in enumerate(self.stages)
+            if stage.label not in stage_status
+            and all(stage_status.get(self.stages[need].label) in ["done", "skipped"] for need in self.get_needs(idx))
+        ]
 
     @staticmethod
     def from_dict(config_dict: dict) -> "CastanetsConfig":
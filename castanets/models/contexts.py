@@ -1,12 +1,63 @@
+import functools
 import json
 import os
+import re
 from typing import List, Optional
 
-import yaml
 from jinja2 import Environment, FileSystemLoader
 from pydantic.dataclasses import dataclass
 
-from .castanets_config import CastanetsConfig
+from .runtime import SlimModel, compile_config, slim_model
+
+#: Pattern of matrix placeholder, left in rendered config until each matrix cell is rendered
+MATRIX_PLACEHOLDER_PATTERN = re.compile(r"\$\(matrix\.(\w+)\)")
+
+
+class MatrixPlaceholder:
+    """
+    Jinja variable `matrix` on config rendering.
+    `{{ matrix.key }}` is rendered as `$(matrix.key)`, which is replaced with the value of each matrix cell on dispatch.
+    """
+
+    def __getattr__(self, key: str) -> str:
+        return f"$(matrix.{key})"
+
+    def __getitem__(self, key: str) -> str:
+        return self.__getattr__(key)
+
+
+class WorkflowOutput(dict):
+    """
+    Jinja variable `state.workflow_output` on config rendering.
+    Outputs of workflows which didn't run yet are rendered as empty, other undefined values are not.
+    """
+
+    def __missing__(self, key: str) -> str:
+        return ""
+
+
+@dataclass
+class WorkflowRun:
+    """
+    Completed workflow run from `workflow_run` event.
+    """
+
+    #: Workflow run ID
+    id: int
+    #: Workflow filename
+    path: str
+    #: Run name shown in GitHub Actions (contains correlation ID of tracked workflows)
+    display_title: str
+    #: Conclusion (success, failure, cancelled, ...)
+    conclusion: Optional[str] = None
+    #: Run attempt, starting from 1
+    run_attempt: int = 1
+    #: Time the run (attempt) started
+    run_started_at: Optional[str] = None
+    #: Time the run was updated last
+    updated_at: Optional[str] = None
+    #: Web URL of the run
+    html_url: Optional[str] = None
 
 
 @dataclass
@@ -31,6 +82,12 @@ class GithubActionsContext:
     issue_comment: Optional[str] = None
     #: Author of issue comment
     issue_comment_author: Optional[str] = None
+    #: ID of issue comment
+    issue_comment_id: Optional[int] = None
+    #: Creation time of issue comment (ISO 8601)
+    issue_comment_created_at: Optional[str] = None
+    #: Workflow run of `workflow_run` event
+    workflow_run: Optional[WorkflowRun] = None
 
     @classmethod
     def construct(
@@ -40,9 +97,12 @@ class GithubActionsContext:
         repo: str,
         ref: str,
         token: str,
-    ) -> "GithubActionsContext":
+    ) -> SlimModel:
         """
-        Construct GithubActionsContext.
+        Construct the context of the event in the slim form.
+        Values are read from the webhook payload of GitHub, so they are not validated.
+
+        :returns: SlimGithubActionsContext
         """
         with open(event_path, "r") as f:
             webhook_payload = json.load(f)
@@ -58,8 +118,26 @@ class GithubActionsContext:
 
         issue_comment = webhook_payload["comment"]["body"] if "comment" in webhook_payload else None
         issue_comment_author = webhook_payload["comment"]["user"]["login"] if "comment" in webhook_payload else None
+        issue_comment_id = webhook_payload["comment"].get("id") if "comment" in webhook_payload else None
+        issue_comment_created_at = (
+            webhook_payload["comment"].get("created_at") if "comment" in webhook_payload else None
+        )
 
-        return cls(
+        workflow_run = None
+        if "workflow_run" in webhook_payload:
+            payload = webhook_payload["workflow_run"]
+            workflow_run = SlimWorkflowRun(
+                id=payload["id"],
+                path=os.path.basename(payload["path"]),
+                display_title=payload.get("display_title") or payload["name"],
+                conclusion=payload.get("conclusion"),
+                run_attempt=payload.get("run_attempt", 1),
+                run_started_at=payload.get("run_started_at"),
+                updated_at=payload.get("updated_at"),
+                html_url=payload.get("html_url"),
+            )
+
+        return SlimGithubActionsContext(
             event_name=event_name,
             action=action,
             repo=repo,
@@ -68,52 +146,106 @@ class GithubActionsContext:
             issue_id=issue_id,
             issue_comment=issue_comment,
             issue_comment_author=issue_comment_author,
+            issue_comment_id=issue_comment_id,
+            issue_comment_created_at=issue_comment_created_at,
+            workflow_run=workflow_run,
         )
 
 
-@dataclass
+@functools.lru_cache(maxsize=None)
+def _get_jinja_env(directory: str) -> Environment:
+    """
+    Get Jinja environment of config directory, shared by renders so templates are parsed once.
+    """
+    return Environment(
+        loader=FileSystemLoader(directory),
+        extensions=["jinja2_time.TimeExtension"],
+    )
+
+
+SlimWorkflowRun = slim_model(WorkflowRun)
+SlimGithubActionsContext = slim_model(GithubActionsContext)
+
+
 class CastanetsContext:
     """
-    Castanets Context
+    Castanets Context.
+    Commands update the progress of the process, so it is mutable and keeps the compiled config as is.
     """
 
-    #: Castanets process info
-    config: CastanetsConfig
-    #: Is Finished
-    finished: Optional[bool] = False
-    #: Process' Global Parameters
-    params: Optional[dict] = None
-    #: Current Stage Index
-    stage_idx: Optional[int] = None
-    #: Current Stage's Approvers
-    approvers: Optional[List[str]] = None
+    __slots__ = ("config", "finished", "params", "stage_idx", "approvers", "config_path", "config_name")
+
+    def __init__(
+        self,
+        config: SlimModel,
+        finished: Optional[bool] = False,
+        params: Optional[dict] = None,
+        stage_idx: Optional[int] = None,
+        approvers: Optional[List[str]] = None,
+        config_path: Optional[str] = None,
+        config_name: Optional[str] = None,
+    ):
+        #: Castanets process info (SlimCastanetsConfig)
+        self.config = config
+        #: Is Finished
+        self.finished = finished
+        #: Process' Global Parameters
+        self.params = params
+        #: Index of the stage started last
+        self.stage_idx = stage_idx
+        #: Approvers of the stage started last
+        self.approvers = approvers
+        #: Process config path
+        self.config_path = config_path
+        #: Config filename routed in the config directory, None with a single config file
+        self.config_name = config_name
 
     @classmethod
     def construct(
         cls,
         config_path: str,
-        github_actions_context: GithubActionsContext,
+        github_actions_context: SlimModel,
         state: Optional[dict] = None,
         finished: bool = False,
         params: Optional[dict] = None,
         stage_idx: Optional[int] = None,
         approvers: Optional[List[str]] = None,
+        config_name: Optional[str] = None,
     ) -> "CastanetsContext":
         """
         Create castanets context.
         """
-        jinja_env = Environment(
-            loader=FileSystemLoader(os.path.dirname(config_path)), extensions=["jinja2_time.TimeExtension"]
-        )
-        template = jinja_env.get_template(os.path.basename(config_path))
-        config_dict = yaml.load(
-            template.render(params=params, github=github_actions_context, state=state), Loader=yaml.FullLoader
-        )
-
         return cls(
-            config=CastanetsConfig.from_dict(config_dict),
+            config=cls.render_config(config_path, github_actions_context, state, params),
             finished=finished,
             params=params,
             stage_idx=stage_idx,
             approvers=approvers,
+            config_path=config_path,
+            config_name=config_name,
         )
+
+    @staticmethod
+    def render_config(
+        config_path: str,
+        github_actions_context: SlimModel,
+        state: Optional[dict] = None,
+        params: Optional[dict] = None,
+    ) -> SlimModel:
+        """
+        Render Jinja template of config and compile it.
+        Outputs in `state.workflow_output` before the workflow ran are rendered as empty.
+        The same rendered config is validated once, see `compile_config`.
+        """
+        state = dict(state or {})
+        state["workflow_output"] = WorkflowOutput(state.get("workflow_output") or {})
+        template = _get_jinja_env(os.path.dirname(config_path)).get_template(os.path.basename(config_path))
+        return compile_config(
+            template.render(params=params, github=github_actions_context, state=state, matrix=MatrixPlaceholder())
+        )
+
+    def reload_config(self, github_actions_context: SlimModel, state: dict):
+        """
+        Render config again with updated state, like new workflow outputs.
+        """
+        self.config = self.render_config(self.config_path, github_actions_context, state, self.params)
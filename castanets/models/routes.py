@@ -0,0 +1,94 @@
+import functools
+import os
+from typing import Any, Dict, List, Optional
+
+import yaml
+from pydantic import validator
+from pydantic.dataclasses import dataclass
+
+from .runtime import SlimModel, slim_model, to_slim
+
+#: Filename of the routes in a config directory
+CONFIG_INDEX_FILENAME = "routes.yaml"
+
+
+@dataclass
+class ProcessRoute:
+    """
+    Rule to route an issue to a process config. All conditions given must match.
+    A route without conditions matches every issue, so it works as the default at the end.
+    """
+
+    #: Config filename, relative to the config directory
+    config: str
+    #: Issue title starts with it
+    title_prefix: Optional[str] = None
+    #: Issue has the label
+    label: Optional[str] = None
+    #: Parameters in the issue body (from the issue template) have these values
+    params: Optional[Dict[str, Any]] = None
+
+    def match(self, title: str, labels: List[str], params: Dict[str, Any]) -> bool:
+        """
+        Check the issue matches the route.
+
+        :param title: Issue title
+        :param labels: Names of issue labels
+        :param params: Castanets parameters in the issue body
+        """
+        if self.title_prefix is not None and not title.startswith(self.title_prefix):
+            return False
+        if self.label is not None and self.label not in labels:
+            return False
+        return all(params.get(key) == value for key, value in (self.params or {}).items())
+
+
+@dataclass
+class ConfigIndex:
+    """
+    Routes of a config directory, read from `routes.yaml`.
+    """
+
+    #: Routes in order, the first matching route is used
+    routes: List[ProcessRoute]
+
+    @validator("routes")
+    def _validate_routes(cls, v: List[ProcessRoute]) -> List[ProcessRoute]:
+        assert len(v) > 0, "Routes must be at least one."
+        return v
+
+    def route(self, issue: dict, params: Dict[str, Any]) -> Optional[str]:
+        """
+        Get config filename of the issue.
+
+        :param issue: Issue data
+        :param params: Castanets parameters in the issue body
+        :returns: Config filename, None if no route matches
+        """
+        title = issue.get("title") or ""
+        labels = [label["name"] for label in issue.get("labels") or []]
+        for route in self.routes:
+            if route.match(title, labels, params):
+                return route.config
+        return None
+
+
+SlimProcessRoute = slim_model(ProcessRoute)
+SlimConfigIndex = slim_model(ConfigIndex)
+
+
+@functools.lru_cache(maxsize=None)
+def load_config_index(directory: str) -> SlimModel:
+    """
+    Load and validate routes of a config directory, once per process.
+    Configs are not read here, only the routed config is rendered.
+
+    :param directory: Config directory
+    :returns: SlimConfigIndex
+    """
+    with open(os.path.join(directory, CONFIG_INDEX_FILENAME), "r") as f:
+        index = ConfigIndex(**yaml.safe_load(f))
+    for route in index.routes:
+        if not os.path.isfile(os.path.join(directory, route.config)):
+            raise ValueError(f"Config {route.config} of the route does not exist in {directory}.")
+    return to_slim(index)
@@ -0,0 +1,147 @@
+import dataclasses
+import functools
+from types import FunctionType
+from typing import Any, Callable, Dict, Tuple, Type
+
+import yaml
+
+from .castanets_config import CastanetsConfig, CastanetsStage, Review, Workflow, WorkflowOutput, WorkflowTarget
+
+#: Slim classes by the model they were created from
+_SLIM_MODELS: Dict[type, Type["SlimModel"]] = {}
+
+
+class SlimModel:
+    """
+    Immutable runtime form of a validated model, with `__slots__` instead of a per-instance `__dict__`.
+    Attributes and methods are the same as the model's, but the values are not validated again.
+    """
+
+    __slots__ = ()
+    #: Model the class was created from
+    _model: type
+    #: Field names of the model
+    _fields: Tuple[str, ...]
+    #: Factories of default values by field name
+    _defaults: Dict[str, Callable[[], Any]]
+
+    def __init__(self, **values: Any):
+        unknown = set(values) - set(self._fields)
+        if unknown:
+            raise TypeError(f"{type(self).__name__} got unknown fields: {', '.join(sorted(unknown))}")
+        for name in self._fields:
+            if name in values:
+                value = values[name]
+            elif name in self._defaults:
+                value = self._defaults[name]()
+            else:
+                raise TypeError(f"{type(self).__name__} missing field: {name}")
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError(f"{type(self).__name__} is immutable, use replace().")
+
+    def __delattr__(self, name: str):
+        raise AttributeError(f"{type(self).__name__} is immutable.")
+
+    def __eq__(self, other: Any) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self._fields)
+
+    def __repr__(self) -> str:
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self._fields)
+        return f"{type(self).__name__}({values})"
+
+    def replace(self, **changes: Any) -> "SlimModel":
+        """
+        Return a copy with changed fields.
+
+        :param changes: New values by field name
+        """
+        return type(self)(**{**{name: getattr(self, name) for name in self._fields}, **changes})
+
+
+def slim_model(model: type) -> Type[SlimModel]:
+    """
+    Create a slim class of a pydantic dataclass.
+    Public methods, properties and static methods are shared with the model, validators and constructors are not.
+
+    :param model: Pydantic dataclass
+    """
+    fields = dataclasses.fields(model)
+    defaults: Dict[str, Callable[[], Any]] = {}
+    for field in fields:
+        if field.default is not dataclasses.MISSING:
+            defaults[field.name] = lambda default=field.default: default
+        elif field.default_factory is not dataclasses.MISSING:
+            defaults[field.name] = field.default_factory
+
+    names = tuple(field.name for field in fields)
+    namespace: Dict[str, Any] = {
+        "__slots__": names,
+        "__doc__": model.__doc__,
+        "__module__": model.__module__,
+        "_model": model,
+        "_fields": names,
+        "_defaults": defaults,
+    }
+    for name, attr in vars(model).items():
+        if name.startswith("_") or name in names or name in ["construct", "from_dict"]:
+            continue
+        if isinstance(attr, (FunctionType, property, staticmethod)):
+            namespace[name] = attr
+
+    slim = type(f"Slim{model.__name__}", (SlimModel,), namespace)
+    _SLIM_MODELS[model] = slim
+    return slim
+
+
+def to_slim(value: Any) -> Any:
+    """
+    Convert validated models to their slim form, recursively. Lists become tuples.
+
+    :param value: Model, or a list or dict of models
+    """
+    slim = _SLIM_MODELS.get(type(value))
+    if slim is not None:
+        return slim(**{name: to_slim(getattr(value, name)) for name in slim._fields})
+    if isinstance(value, list):
+        return tuple(to_slim(item) for item in value)
+    if isinstance(value, dict):
+        return {key: to_slim(item) for key, item in value.items()}
+    return value
+
+
+SlimReview = slim_model(Review)
+SlimWorkflowOutput = slim_model(WorkflowOutput)
+SlimWorkflowTarget = slim_model(WorkflowTarget)
+SlimWorkflow = slim_model(Workflow)
+SlimCastanetsStage = slim_model(CastanetsStage)
+SlimCastanetsConfig = slim_model(CastanetsConfig)
+
+
+def _get_slim_dispatch_targets(workflow: SlimModel) -> Tuple[SlimModel, ...]:
+    """
+    Targets to dispatch the slim workflow to. The default target is a slim model,
+    so workflows without targets don't validate a `WorkflowTarget` on each dispatch and poll.
+
+    :param workflow: Slim workflow
+    """
+    return workflow.targets or (SlimWorkflowTarget(repo=workflow.repo, ref=workflow.ref),)
+
+
+SlimWorkflow.dispatch_targets = property(_get_slim_dispatch_targets)
+
+
+@functools.lru_cache(maxsize=32)
+def compile_config(text: str) -> SlimModel:
+    """
+    Load and validate a rendered config, and convert it to the slim form.
+    Compiled configs are cached by the rendered text, so a config is validated once per process.
+    Dicts in the config (like workflow inputs) are shared by the cached config and must not be changed.
+
+    :param text: Rendered YAML of the config
+    :returns: SlimCastanetsConfig
+    """
+    return to_slim(CastanetsConfig.from_dict(yaml.load(text, Loader=yaml.FullLoader)))
@@ -0,0 +1,59 @@
+from typing import Dict, Optional, Type
+
+from .base import BaseStateStore
+from .comment import CommentStateStore
+from .git_ref import GitRefStateStore
+from .migrate import migrate_state
+from .sqlite import SqliteStateStore
+
+#: Store classes by name
+STATE_STORES: Dict[str, Type[BaseStateStore]] = {
+    store.name: store for store in [CommentStateStore, GitRefStateStore, SqliteStateStore]
+}
+
+_store: BaseStateStore = CommentStateStore()
+
+
+def create_state_store(name: str, location: Optional[str] = None) -> BaseStateStore:
+    """
+    Create a state store by name.
+
+    :param name: `comment`, `git_ref` or `sqlite`
+    :param location: Reference of `git_ref`, database path of `sqlite`, the default if not given
+    """
+    if name not in STATE_STORES:
+        raise ValueError(f"Unknown state store: {name}, use one of {', '.join(STATE_STORES)}")
+    store = STATE_STORES[name]
+    if store is CommentStateStore or location is None:
+        return store()
+    return store(location)
+
+
+def set_state_store(store: BaseStateStore):
+    """
+    Set the store of Castanets state. Set before the context is constructed, so the state is read from it.
+
+    :param store: State store
+    """
+    global _store
+    _store = store
+
+
+def get_state_store() -> BaseStateStore:
+    """
+    Get the store of Castanets state, the comment store if not set.
+    """
+    return _store
+
+
+__all__ = [
+    "BaseStateStore",
+    "CommentStateStore",
+    "GitRefStateStore",
+    "SqliteStateStore",
+    "STATE_STORES",
+    "create_state_store",
+    "set_state_store",
+    "get_state_store",
+    "migrate_state",
+]
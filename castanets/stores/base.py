@@ -0,0 +1,84 @@
+from typing import Dict, List, Optional
+
+from castanets.models import GithubActionsContext
+from castanets.utils import get_logger, github
+
+logger = get_logger(__name__)
+
+
+class BaseStateStore:
+    """
+    Base class for stores of Castanets state, one state per issue.
+
+    Stores other than the comment store keep the state outside of the issue,
+    and update the body of the Castanets comment only for the status comment.
+
+    Example
+    --------
+    .. code-block:: python
+        class MemoryStateStore(BaseStateStore):
+            name = "memory"
+
+            def __init__(self):
+                self.states = {}
+
+            def read(self, context):
+                return self.states.get(context.issue_id, {})
+
+            def write(self, context, state, body=None):
+                self.states[context.issue_id] = state
+                self.write_body(context, body)
+
+            def issue_ids(self, context):
+                return sorted(self.states)
+    """
+
+    #: Name of the store, used by `CASTANETS_STATE_STORE`
+    name: str = ""
+
+    def read(self, context: GithubActionsContext) -> dict:
+        """
+        Read state of the issue of the context.
+
+        :param context: Context of Github Actions
+        :returns: State, empty if the issue has no state
+        """
+        raise NotImplementedError
+
+    def write(self, context: GithubActionsContext, state: dict, body: Optional[str] = None):
+        """
+        Write state of the issue of the context.
+
+        :param context: Context of Github Actions
+        :param state: State
+        :param body: New body of the Castanets comment, kept if not given
+        """
+        raise NotImplementedError
+
+    def write_many(self, context: GithubActionsContext, states: Dict[int, dict]):
+        """
+        Write states of several issues, like on migration. Comment bodies are kept.
+
+        :param context: Context of Github Actions
+        :param states: State by issue number
+        """
+        for issue_id, state in states.items():
+            self.write(context.replace(issue_id=issue_id), state)
+
+    def issue_ids(self, context: GithubActionsContext) -> List[int]:
+        """
+        Get numbers of issues with state in the store, for migration.
+
+        :param context: Context of Github Actions
+        """
+        raise NotImplementedError
+
+    def write_body(self, context: GithubActionsContext, body: Optional[str]):
+        """
+        Update body of the Castanets comment, if given.
+
+        :param context: Context of Github Actions
+        :param body: New body of the comment
+        """
+        if body is not None:
+            github.update_first_comment_body(context, body)
@@ -0,0 +1,25 @@
+from typing import List, Optional
+
+from castanets.models import GithubActionsContext
+from castanets.utils import github
+
+from .base import BaseStateStore
+
+
+class CommentStateStore(BaseStateStore):
+    """
+    Store state in the first comment of Castanets on the issue, in a processing instruction.
+    Reading and writing list comments of the issue to find the comment.
+    """
+
+    name = "comment"
+
+    def read(self, context: GithubActionsContext) -> dict:
+        return github.read_state_from_first_comment(context)
+
+    def write(self, context: GithubActionsContext, state: dict, body: Optional[str] = None):
+        github.write_state_to_first_comment(context, state, body)
+
+    def issue_ids(self, context: GithubActionsContext) -> List[int]:
+        # Castanets processes always have the comment
+        return [issue["number"] for issue in github.list_issues_since(context) if issue["comments"] > 0]
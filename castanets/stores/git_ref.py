@@ -0,0 +1,55 @@
+import json
+from typing import Dict, List, Optional
+
+from castanets.models import GithubActionsContext
+from castanets.utils import github
+
+from .base import BaseStateStore
+
+
+class GitRefStateStore(BaseStateStore):
+    """
+    Store state as a JSON file per issue (`issues/<number>.json`) in a dedicated git reference,
+    with the Git Data API. Reading is one call regardless of comments of the issue, and the history of states is kept.
+    Writes to the same reference from other issues are retried on top of them.
+
+    :param ref: Fully qualified reference
+    """
+
+    name = "git_ref"
+
+    def __init__(self, ref: str = "refs/heads/castanets-state"):
+        self.ref = ref
+
+    @staticmethod
+    def _path(issue_id: int) -> str:
+        return f"issues/{issue_id}.json"
+
+    def read(self, context: GithubActionsContext) -> dict:
+        content = github.get_file_content(context, self._path(context.issue_id), self.ref)
+        return json.loads(content) if content else {}
+
+    def write(self, context: GithubActionsContext, state: dict, body: Optional[str] = None):
+        github.commit_files(
+            context,
+            self.ref,
+            {self._path(context.issue_id): json.dumps(state, ensure_ascii=False)},
+            f"Update state of #{context.issue_id}",
+        )
+        self.write_body(context, body)
+
+    def write_many(self, context: GithubActionsContext, states: Dict[int, dict]):
+        # One commit for all issues
+        files = {self._path(issue_id): json.dumps(state, ensure_ascii=False) for issue_id, state in states.items()}
+        github.commit_files(context, self.ref, files, f"Migrate state of {len(states)} issues")
+
+    def issue_ids(self, context: GithubActionsContext) -> List[int]:
+        sha = github.get_git_ref_sha(context, self.ref)
+        if sha is None:
+            return []
+        paths = github.get_tree_paths(context, sha)
+        return sorted(
+            int(path[len("issues/") : -len(".json")])
+            for path in paths
+            if path.startswith("issues/") and path.endswith(".json")
+        )
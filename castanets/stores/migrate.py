@@ -0,0 +1,45 @@
+from castanets.models import GithubActionsContext
+from castanets.utils import get_logger
+
+from .base import BaseStateStore
+
+logger = get_logger(__name__)
+
+#: Issues written to the target store at once
+MIGRATION_BATCH_SIZE = 100
+
+
+def migrate_state(
+    context: GithubActionsContext,
+    source: BaseStateStore,
+    target: BaseStateStore,
+    batch_size: int = MIGRATION_BATCH_SIZE,
+) -> int:
+    """
+    Copy state of all issues from a store to another. Issues without state are skipped.
+    The source store is kept as is, so switching `CASTANETS_STATE_STORE` back is safe.
+
+    :param context: Context of Github Actions
+    :param source: Store to read
+    :param target: Store to write
+    :param batch_size: Issues written to the target store at once
+    :returns: Number of issues migrated
+    """
+    issue_ids = source.issue_ids(context)
+    logger.info("Migrate state of %d issues from %s to %s", len(issue_ids), source.name, target.name)
+
+    migrated = 0
+    batch = {}
+    for issue_id in issue_ids:
+        state = source.read(context.replace(issue_id=issue_id))
+        if state:
+            batch[issue_id] = state
+        if len(batch) >= batch_size:
+            target.write_many(context, batch)
+            migrated += len(batch)
+            batch = {}
+    if batch:
+        target.write_many(context, batch)
+        migrated += len(batch)
+    logger.info("Migrated state of %d issues", migrated)
+    return migrated
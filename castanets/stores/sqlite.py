@@ -0,0 +1,58 @@
+import json
+import os
+import sqlite3
+from typing import Dict, List, Optional
+
+from castanets.models import GithubActionsContext
+from castanets.utils import format_github_datetime
+
+from .base import BaseStateStore
+
+
+class SqliteStateStore(BaseStateStore):
+    """
+    Store state in a local SQLite database, for batch and server deployments, and for tests.
+    States of several repositories can share a database.
+
+    :param path: Database file path, `:memory:` for an in-memory database
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = ".castanets/state.db"):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            if path != ":memory:":
+                self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "repo TEXT NOT NULL, issue_id INTEGER NOT NULL, state TEXT NOT NULL, updated_at TEXT NOT NULL, "
+                "PRIMARY KEY (repo, issue_id))"
+            )
+
+    def read(self, context: GithubActionsContext) -> dict:
+        row = self.connection.execute(
+            "SELECT state FROM state WHERE repo = ? AND issue_id = ?", (context.repo, context.issue_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def write(self, context: GithubActionsContext, state: dict, body: Optional[str] = None):
+        self.write_many(context, {context.issue_id: state})
+        self.write_body(context, body)
+
+    def write_many(self, context: GithubActionsContext, states: Dict[int, dict]):
+        updated_at = format_github_datetime()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO state (repo, issue_id, state, updated_at) VALUES (?, ?, ?, ?)",
+                [
+                    (context.repo, issue_id, json.dumps(state, ensure_ascii=False), updated_at)
+                    for issue_id, state in states.items()
+                ],
+            )
+
+    def issue_ids(self, context: GithubActionsContext) -> List[int]:
+        rows = self.connection.execute("SELECT issue_id FROM state WHERE repo = ? ORDER BY issue_id", (context.repo,))
+        return [row[0] for row in rows]
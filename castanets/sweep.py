@@ -0,0 +1,142 @@
+"""
+Sweep of running stages for reminders and escalations, run on a schedule with `castanets sweep`.
+
+Issues waiting longer than the shortest `remind_after` or `timeout` are found with one paginated Search API query
+over the stage labels, instead of reading every open issue.
+Tracked workflows of other repositories don't send `workflow_run` events, so the sweep polls their runs too.
+`castanets flush-alerts` redelivers alerts left in the outbox of running processes, without waiting for their next event.
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set
+
+from castanets import context, engine
+from castanets.constants import CASTANETS_CONFIG_PATH, GITHUB_WORKSPACE
+from castanets.models import CastanetsContext, SlimModel, load_config_index
+from castanets.utils import format_github_datetime, get_logger, get_stage_search_queries, github
+
+logger = get_logger(__name__)
+
+
+def _get_process_configs() -> List[SlimModel]:
+    """
+    Get process configs, rendered without state. With a config directory, all routed configs.
+    """
+    config_path = os.path.join(GITHUB_WORKSPACE, CASTANETS_CONFIG_PATH)
+    if not os.path.isdir(config_path):
+        return [CastanetsContext.render_config(config_path, context.github_actions, {}, {})]
+
+    names = dict.fromkeys(route.config for route in load_config_index(config_path).routes)
+    return [
+        CastanetsContext.render_config(os.path.join(config_path, name), context.github_actions, {}, {})
+        for name in names
+    ]
+
+
+def get_reminder_intervals() -> Dict[str, float]:
+    """
+    Get the shortest interval of `remind_after` and `timeout` of each stage label which has them.
+
+    :returns: Seconds by stage label
+    """
+    intervals: Dict[str, float] = {}
+    for config in _get_process_configs():
+        for stage in config.stages:
+            seconds = [value for value in [stage.remind_after_seconds, stage.timeout_seconds] if value is not None]
+            if stage.label in intervals:
+                seconds.append(intervals[stage.label])
+            if seconds:
+                intervals[stage.label] = min(seconds)
+    return intervals
+
+
+def get_polled_stage_labels() -> List[str]:
+    """
+    Get labels of stages with tracked workflows of other repositories.
+    """
+    labels = []
+    for config in _get_process_configs():
+        for stage in config.stages:
+            workflow = stage.workflow
+            if workflow is not None and workflow.track and any(target.repo for target in workflow.dispatch_targets):
+                labels.append(stage.label)
+    return labels
+
+
+def _search_issue_ids(stage_labels: Iterable[str], updated_before: Optional[str] = None) -> Set[int]:
+    """
+    Search numbers of open issues of the stages.
+
+    :param stage_labels: Stage labels
+    :param updated_before: Only issues not updated since the time, if given
+    """
+    issue_ids = set()
+    for query in get_stage_search_queries(context.github_actions.repo, stage_labels, updated_before):
+        issue_ids.update(issue["number"] for issue in github.search_issues(context.github_actions, query))
+    return issue_ids
+
+
+def sweep() -> int:
+    """
+    Run `remind` on open issues of stages waiting longer than the shortest interval,
+    and `poll_workflow_runs` on open issues of stages with workflows of other repositories.
+    A failure of an issue is logged, and the sweep goes on with the other issues.
+
+    :returns: Number of issues failed
+    """
+    intervals = get_reminder_intervals()
+    polled_labels = get_polled_stage_labels()
+    if not intervals and not polled_labels:
+        logger.info("No stage has remind_after, timeout or workflows of other repositories, skip the sweep.")
+        return 0
+
+    remind_ids = set()
+    if intervals:
+        # Stages waiting on review don't update the issue, so not-updated issues are the candidates.
+        seconds = min(intervals.values())
+        updated_before = format_github_datetime(datetime.now(timezone.utc) - timedelta(seconds=seconds))
+        remind_ids = _search_issue_ids(intervals, updated_before)
+        logger.info("Sweep %d issues waiting since %s", len(remind_ids), updated_before)
+    poll_ids = _search_issue_ids(polled_labels) if polled_labels else set()
+    if poll_ids:
+        logger.info("Poll workflow runs of %d issues", len(poll_ids))
+
+    failures = 0
+    for issue_id in sorted(remind_ids | poll_ids):
+        try:
+            context.switch_issue(issue_id)
+            if context.castanets is None or context.castanets.finished:
+                continue
+            engine.reset()
+            if issue_id in poll_ids:
+                engine.push_command("poll_workflow_runs")
+            if issue_id in remind_ids:
+                engine.push_command("remind")
+            engine.run()
+        except Exception:
+            logger.exception("Sweep of issue #%d failed", issue_id)
+            failures += 1
+    return failures
+
+
+def flush_alerts() -> int:
+    """
+    Redeliver alerts of the outbox on open issues of all stages.
+    A failure of an issue is logged, and the flush goes on with the other issues.
+
+    :returns: Number of issues failed
+    """
+    labels = dict.fromkeys(stage.label for config in _get_process_configs() for stage in config.stages)
+    failures = 0
+    for issue_id in sorted(_search_issue_ids(labels)):
+        try:
+            context.switch_issue(issue_id)
+            if context.castanets is None or not (context.state or {}).get("alert_outbox"):
+                continue
+            engine.reset()
+            engine.run()
+        except Exception:
+            logger.exception("Flushing alerts of issue #%d failed", issue_id)
+            failures += 1
+    return failures
@@ -1,22 +1,64 @@
+from .auth import AppCredential, Credential, CredentialPool, TokenCredential
+from .cache import TTLCache
 from .common import (
+    STATE_MARKER,
+    WORKFLOW_CORRELATION_INPUT,
+    WORKFLOW_SPECULATIVE_INPUT,
     Singleton,
+    create_correlation_id,
     embed_state_to_comment,
+    evaluate_stage_condition,
+    expand_matrix,
+    find_correlation_id,
+    format_github_datetime,
     get_castanets_params_from_comment,
     get_castanets_stage_label,
     get_castanets_state_from_comment,
-    get_logger,
+    get_issue_id_from_correlation_id,
+    get_issue_metadata_patch,
+    get_matrix_cell_key,
     get_mermaid_from_context,
+    get_stage_search_queries,
+    get_workflow_hash,
+    parse_github_datetime,
+    parse_slash_commands,
+    read_outputs_from_artifact,
+    render_matrix_inputs,
     state_dict_to_process_instruction,
 )
+from .log import configure_logging, get_logger
 
 __all__ = [
     "get_logger",
+    "configure_logging",
     "get_mermaid_from_context",
     "get_castanets_state_from_comment",
     "get_castanets_params_from_comment",
     "get_castanets_stage_label",
+    "get_issue_metadata_patch",
     "state_dict_to_process_instruction",
     "embed_state_to_comment",
+    "STATE_MARKER",
+    "WORKFLOW_CORRELATION_INPUT",
+    "WORKFLOW_SPECULATIVE_INPUT",
+    "create_correlation_id",
+    "find_correlation_id",
+    "get_issue_id_from_correlation_id",
+    "parse_github_datetime",
+    "format_github_datetime",
+    "parse_slash_commands",
+    "read_outputs_from_artifact",
+    "expand_matrix",
+    "get_matrix_cell_key",
+    "get_stage_search_queries",
+    "render_matrix_inputs",
+    "get_workflow_hash",
+    "evaluate_stage_condition",
     "Singleton",
+    "TTLCache",
+    "Credential",
+    "TokenCredential",
+    "AppCredential",
+    "CredentialPool",
     "github",
 ]
@@ -0,0 +1,246 @@
+import csv
+import json
+import os
+import statistics
+import tempfile
+from typing import IO, Any, Dict, Iterable, List, Optional
+
+from .common import CASTANETS_STAGE_LABEL_PREFIX, parse_github_datetime, parse_slash_commands
+
+#: Version of the analytics store, a store of another version is fetched again
+ANALYTICS_STORE_VERSION = 1
+#: Header of reminder comments of the bot
+REMINDER_HEADER = "## Castanets reminder"
+#: Columns of per-stage metrics
+STAGE_METRIC_FIELDS = [
+    "stage",
+    "visits",
+    "completed",
+    "time_in_stage_mean_hours",
+    "time_in_stage_median_hours",
+    "time_in_stage_p90_hours",
+    "time_to_first_approval_mean_hours",
+    "time_to_first_approval_median_hours",
+    "time_to_first_approval_p90_hours",
+    "reruns",
+    "reruns_per_visit",
+    "reminders",
+]
+
+
+def compact_timeline_event(event: dict, bot_login: str) -> List[dict]:
+    """
+    Get compact events of a timeline event, which are kept in the analytics store.
+    Stage labels start and end stages, slash comments approve and rerun them, bot reminder comments remind them.
+
+    :param event: Timeline event of GitHub API
+    :param bot_login: Username of the Castanets bot
+    :returns: Compact events with `id`, `at`, `type` and `stage` (None for running stages)
+    """
+    kind = event.get("event")
+    if kind in ["labeled", "unlabeled"]:
+        name = event["label"]["name"]
+        if not name.startswith(CASTANETS_STAGE_LABEL_PREFIX):
+            return []
+        stage = name[len(CASTANETS_STAGE_LABEL_PREFIX) :]
+        return [
+            {
+                "id": event["id"],
+                "at": event["created_at"],
+                "type": "start" if kind == "labeled" else "end",
+                "stage": stage,
+            }
+        ]
+
+    if kind == "reviewed" and (event.get("state") or "").lower() == "approved":
+        return [{"id": event["id"], "at": event["submitted_at"], "type": "approve", "stage": None}]
+
+    if kind == "commented":
+        body = event.get("body") or ""
+        if (event.get("user") or {}).get("login") == bot_login:
+            if body.startswith(REMINDER_HEADER):
+                return [{"id": event["id"], "at": event["created_at"], "type": "remind", "stage": None}]
+            return []
+        return [
+            {
+                "id": f"{event['id']}:{idx}",
+                "at": event["created_at"],
+                "type": tokens[0],
+                "stage": tokens[1] if len(tokens) > 1 and not tokens[1].startswith("--") else None,
+            }
+            for idx, tokens in enumerate(parse_slash_commands(body))
+            if tokens[0] in ["approve", "rerun"]
+        ]
+
+    return []
+
+
+class AnalyticsStore:
+    """
+    Local store of compact timeline events, with the checkpoint of incremental fetches.
+    Each issue keeps the last timeline page and its ETag, so later runs fetch only new events.
+
+    :param path: JSON file path of the store
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        data = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+        if data.get("version") != ANALYTICS_STORE_VERSION:
+            data = {"version": ANALYTICS_STORE_VERSION, "since": None, "issues": {}}
+        self.data = data
+
+    @property
+    def since(self) -> Optional[str]:
+        """
+        Update time of the last issue fetched, issues updated since then are fetched next.
+        """
+        return self.data["since"]
+
+    @since.setter
+    def since(self, value: Optional[str]):
+        self.data["since"] = value
+
+    def get_issue(self, issue_id: int) -> dict:
+        """
+        Get store of an issue with `page`, `etag` and `events`.
+
+        :param issue_id: Issue number
+        """
+        return self.data["issues"].setdefault(str(issue_id), {"page": 1, "etag": None, "events": []})
+
+    def add_events(self, issue_id: int, events: Iterable[dict]):
+        """
+        Add compact events of an issue. Events already stored, from a page fetched again, are skipped.
+
+        :param issue_id: Issue number
+        :param events: Compact events
+        """
+        stored = self.get_issue(issue_id)["events"]
+        ids = {event["id"] for event in stored}
+        stored.extend(event for event in events if event["id"] not in ids)
+
+    def save(self):
+        """
+        Write the store atomically, so an interrupted run keeps the previous checkpoint.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as f:
+            json.dump(self.data, f)
+        os.replace(f.name, self.path)
+
+    def iter_issue_events(self) -> Iterable[List[dict]]:
+        """
+        Iterate compact events of each issue.
+        """
+        for issue in self.data["issues"].values():
+            yield issue["events"]
+
+
+def get_stage_visits(events: List[dict]) -> List[dict]:
+    """
+    Get visits of stages from compact events of an issue. A stage started again is another visit.
+    Events without a stage apply to all running stages.
+
+    :param events: Compact events of an issue
+    :returns: Visits with `stage`, `started_at`, `ended_at`, `first_approval_at`, `reruns` and `reminders`
+    """
+    visits = []
+    running: Dict[str, dict] = {}
+    for event in sorted(events, key=lambda event: event["at"]):
+        stage = event["stage"]
+        if event["type"] == "start":
+            if stage not in running:
+                running[stage] = {
+                    "stage": stage,
+                    "started_at": event["at"],
+                    "ended_at": None,
+                    "first_approval_at": None,
+                    "reruns": 0,
+                    "reminders": 0,
+                }
+                visits.append(running[stage])
+            continue
+        if event["type"] == "end":
+            if stage in running:
+                running.pop(stage)["ended_at"] = event["at"]
+            continue
+
+        targets = [running[stage]] if stage in running else list(running.values()) if stage is None else []
+        for visit in targets:
+            if event["type"] == "approve" and visit["first_approval_at"] is None:
+                visit["first_approval_at"] = event["at"]
+            elif event["type"] == "rerun":
+                visit["reruns"] += 1
+            elif event["type"] == "remind":
+                visit["reminders"] += 1
+    return visits
+
+
+def _hours(start: str, end: str) -> float:
+    return (parse_github_datetime(end) - parse_github_datetime(start)).total_seconds() / 3600
+
+
+def _summarize(values: List[float], prefix: str) -> Dict[str, Optional[float]]:
+    if not values:
+        return {f"{prefix}_mean_hours": None, f"{prefix}_median_hours": None, f"{prefix}_p90_hours": None}
+    values = sorted(values)
+    return {
+        f"{prefix}_mean_hours": round(statistics.mean(values), 2),
+        f"{prefix}_median_hours": round(statistics.median(values), 2),
+        f"{prefix}_p90_hours": round(values[min(len(values) - 1, int(len(values) * 0.9))], 2),
+    }
+
+
+def aggregate_stage_metrics(visits: Iterable[dict]) -> List[Dict[str, Any]]:
+    """
+    Aggregate visits into per-stage metrics. Time in stage counts completed visits only.
+
+    :param visits: Visits of all issues
+    :returns: Metrics of each stage, with `STAGE_METRIC_FIELDS`
+    """
+    by_stage: Dict[str, List[dict]] = {}
+    for visit in visits:
+        by_stage.setdefault(visit["stage"], []).append(visit)
+
+    metrics = []
+    for stage, stage_visits in sorted(by_stage.items()):
+        completed = [visit for visit in stage_visits if visit["ended_at"] is not None]
+        approved = [visit for visit in stage_visits if visit["first_approval_at"] is not None]
+        reruns = sum(visit["reruns"] for visit in stage_visits)
+        metrics.append(
+            {
+                "stage": stage,
+                "visits": len(stage_visits),
+                "completed": len(completed),
+                **_summarize([_hours(visit["started_at"], visit["ended_at"]) for visit in completed], "time_in_stage"),
+                **_summarize(
+                    [_hours(visit["started_at"], visit["first_approval_at"]) for visit in approved],
+                    "time_to_first_approval",
+                ),
+                "reruns": reruns,
+                "reruns_per_visit": round(reruns / len(stage_visits), 2),
+                "reminders": sum(visit["reminders"] for visit in stage_visits),
+            }
+        )
+    return metrics
+
+
+def write_stage_metrics(metrics: List[Dict[str, Any]], f: IO[str], fmt: str = "csv"):
+    """
+    Write per-stage metrics.
+
+    :param metrics: Metrics of `aggregate_stage_metrics`
+    :param f: Text file
+    :param fmt: `csv` or `json`
+    """
+    if fmt == "json":
+        json.dump(metrics, f, indent=2)
+        return
+    writer = csv.DictWriter(f, fieldnames=STAGE_METRIC_FIELDS)
+    writer.writeheader()
+    writer.writerows(metrics)
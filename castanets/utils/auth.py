@@ -0,0 +1,192 @@
+import threading
+import time
+from typing import Callable, List, Mapping, Optional
+
+import jwt
+import requests
+
+from .common import parse_github_datetime
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+class Credential:
+    """
+    Credential for GitHub API, with the rate limit seen on its last response.
+
+    :param name: Name of the credential in logs
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        #: Remaining requests of the rate limit, None until the first response
+        self.remaining: Optional[int] = None
+        #: Epoch seconds when the rate limit resets
+        self.reset_at: Optional[float] = None
+
+    def get_token(self) -> str:
+        """
+        Return a token for the Authorization header.
+        """
+        raise NotImplementedError
+
+    def update_rate_limit(self, headers: Mapping[str, str]):
+        """
+        Update the rate limit from headers of a response.
+
+        :param headers: Response headers
+        """
+        if "X-RateLimit-Remaining" in headers:
+            self.remaining = int(headers["X-RateLimit-Remaining"])
+        if "X-RateLimit-Reset" in headers:
+            self.reset_at = float(headers["X-RateLimit-Reset"])
+
+    def get_remaining(self, now: float) -> float:
+        """
+        Return remaining requests at the time. Unknown or reset rate limit counts as unlimited.
+
+        :param now: Epoch seconds
+        """
+        if self.remaining is None or (self.reset_at is not None and self.reset_at <= now):
+            return float("inf")
+        return self.remaining
+
+
+class TokenCredential(Credential):
+    """
+    Personal access token, or a token of GitHub Actions.
+
+    :param token: Token
+    :param name: Name of the credential in logs
+    """
+
+    def __init__(self, token: str, name: str = "token"):
+        super().__init__(name)
+        self.token = token
+
+    def get_token(self) -> str:
+        return self.token
+
+
+class AppCredential(Credential):
+    """
+    GitHub App installation. The JWT is signed locally with the App's private key,
+    and exchanged for an installation token, which is cached until shortly before it expires.
+
+    :param app_id: GitHub App ID
+    :param private_key: PEM private key of the App
+    :param installation_id: Installation ID, looked up from the repository if not given
+    :param repo: Repository (org/repo) to look up the installation
+    :param api_url: GitHub API URL
+    :param refresh_margin: Seconds before expiry to refresh the installation token
+    :param clock: Function returning current time in epoch seconds
+    """
+
+    def __init__(
+        self,
+        app_id: str,
+        private_key: str,
+        installation_id: Optional[str] = None,
+        repo: Optional[str] = None,
+        api_url: str = "https://api.github.com",
+        refresh_margin: int = 300,
+        clock: Callable[[], float] = time.time,
+    ):
+        super().__init__(f"app:{app_id}")
+        if installation_id is None and repo is None:
+            raise ValueError("Installation ID or repository is required for GitHub App credential.")
+        self.app_id = app_id
+        self.private_key = private_key
+        self.installation_id = installation_id
+        self.repo = repo
+        self.api_url = api_url.rstrip("/")
+        self.refresh_margin = refresh_margin
+        self.clock = clock
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def create_jwt(self) -> str:
+        """
+        Create a JWT of the App, valid for 9 minutes. Issued 60 seconds in the past for clock drift.
+        """
+        now = int(self.clock())
+        payload = {"iat": now - 60, "exp": now + 540, "iss": str(self.app_id)}
+        return jwt.encode(payload, self.private_key, algorithm="RS256")
+
+    def _app_headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.create_jwt()}", "Accept": "application/vnd.github.v3+json"}
+
+    def _get_installation_id(self) -> str:
+        if self.installation_id is None:
+            response = requests.get(f"{self.api_url}/repos/{self.repo}/installation", headers=self._app_headers())
+            if not response.ok:
+                raise Exception(f"GitHub App installation lookup failed. {response.status_code}: {response.text}")
+            self.installation_id = str(response.json()["id"])
+        return self.installation_id
+
+    def get_user(self) -> dict:
+        """
+        Return the bot user of the App (`<app-slug>[bot]`), which authors comments made with the App.
+        """
+        response = requests.get(f"{self.api_url}/app", headers=self._app_headers())
+        if not response.ok:
+            raise Exception(f"GitHub App lookup failed. {response.status_code}: {response.text}")
+        response = requests.get(
+            f"{self.api_url}/users/{response.json()['slug']}[bot]",
+            headers={"Authorization": f"token {self.get_token()}", "Accept": "application/vnd.github.v3+json"},
+        )
+        if not response.ok:
+            raise Exception(f"GitHub App bot user lookup failed. {response.status_code}: {response.text}")
+        return response.json()
+
+    def get_token(self) -> str:
+        with self._lock:
+            if self._token is not None and self.clock() < self._expires_at - self.refresh_margin:
+                return self._token
+
+            installation_id = self._get_installation_id()
+            logger.info("Creating installation token of GitHub App %s", self.app_id)
+            response = requests.post(
+                f"{self.api_url}/app/installations/{installation_id}/access_tokens", headers=self._app_headers()
+            )
+            if not response.ok:
+                raise Exception(f"GitHub App token creation failed. {response.status_code}: {response.text}")
+            result = response.json()
+            self._token = result["token"]
+            self._expires_at = parse_github_datetime(result["expires_at"]).timestamp()
+            return self._token
+
+
+class CredentialPool:
+    """
+    Credentials for GitHub API calls.
+    The primary credential makes writes, so comments have one author. Reads use the least-loaded credential,
+    by remaining requests of the rate limit.
+
+    :param credentials: Credentials, the first is the primary credential
+    :param clock: Function returning current time in epoch seconds
+    """
+
+    def __init__(self, credentials: List[Credential], clock: Callable[[], float] = time.time):
+        if not credentials:
+            raise ValueError("Credential pool must have at least one credential.")
+        self.credentials = credentials
+        self.clock = clock
+
+    @property
+    def primary(self) -> Credential:
+        return self.credentials[0]
+
+    def select(self, method: str = "GET") -> Credential:
+        """
+        Select a credential for a call.
+
+        :param method: HTTP method of the call
+        """
+        if method != "GET" or len(self.credentials) == 1:
+            return self.primary
+        now = self.clock()
+        # max() keeps the first of equals, so the primary is preferred
+        return max(self.credentials, key=lambda credential: credential.get_remaining(now))
@@ -0,0 +1,58 @@
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+
+class TTLCache:
+    """
+    Cache with time-to-live over a JSON serializable dict, so it can be persisted in the state.
+    Entries are stored as `{key: {"value": value, "expires_at": epoch seconds}}`.
+    """
+
+    def __init__(self, entries: Dict[str, dict], ttl: float, clock: Callable[[], float] = time.time):
+        """
+        :param entries: Dict to store entries, updated in place
+        :param ttl: Default time-to-live of entries in seconds
+        :param clock: Function returning current time in epoch seconds
+        """
+        self.entries = entries
+        self.ttl = ttl
+        self.clock = clock
+
+    def __contains__(self, key: str) -> bool:
+        entry = self.entries.get(key)
+        return entry is not None and entry["expires_at"] > self.clock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Get value of the key, or default if it does not exist or is expired.
+
+        :param key: Cache key
+        :param default: Value returned on cache miss
+        """
+        return self.entries[key]["value"] if key in self else default
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """
+        Set value of the key.
+
+        :param key: Cache key
+        :param value: JSON serializable value, None can be cached as a negative result
+        :param ttl: Time-to-live in seconds, default TTL of the cache if not given
+        """
+        self.entries[key] = {"value": value, "expires_at": self.clock() + (ttl if ttl is not None else self.ttl)}
+
+    def missing(self, keys: Iterable[str]) -> list:
+        """
+        Get keys which do not exist or are expired.
+
+        :param keys: Cache keys
+        """
+        return [key for key in keys if key not in self]
+
+    def prune(self):
+        """
+        Remove expired entries, so the persisted cache does not grow.
+        """
+        now = self.clock()
+        for key in [key for key, entry in self.entries.items() if entry["expires_at"] <= now]:
+            del self.entries[key]
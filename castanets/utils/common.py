@@ -1,41 +1,272 @@
 import base64
+import hashlib
+import itertools
 import json
-import logging
-import sys
+import os
+import re
+import uuid
+import zipfile
 import zlib
-from typing import Any, Dict
+from datetime import datetime, timezone
+from typing import IO, Any, Dict, Iterable, List, Optional
+from urllib.parse import quote
 
 import yaml
+from jinja2 import ChainableUndefined
+from jinja2.sandbox import SandboxedEnvironment
 from markdown import markdown
 
 from castanets.models import CastanetsContext
+from castanets.models.contexts import MATRIX_PLACEHOLDER_PATTERN
 
+#: Prefix of stage labels set by Castanets
+CASTANETS_STAGE_LABEL_PREFIX = "castanets:stage:"
 
-def get_logger(name: str) -> logging.Logger:
+
+def get_castanets_stage_label(label: str) -> str:
     """
-    Create logger.
+    Return stage label for current stage.
 
-    :param name: Logger name
-    :returns: Logger instance
+    :returns: Label for current stage
     """
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
-    logger.propagate = False
+    return f"{CASTANETS_STAGE_LABEL_PREFIX}{label}"
 
-    stream_handler = logging.StreamHandler(sys.stdout)
-    stream_handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
-    logger.addHandler(stream_handler)
 
-    return logger
+def get_issue_metadata_patch(
+    issue: Dict[str, Any],
+    stage_labels: Iterable[str],
+    assignees_to_remove: Iterable[str] = (),
+    assignees_to_add: Iterable[str] = (),
+) -> Dict[str, List[str]]:
+    """
+    Diff issue's labels and assignees against the desired state.
+    Every `castanets:stage:*` label is replaced with `stage_labels`.
+
+    :param issue: Issue data from GitHub API
+    :param stage_labels: Desired stage labels, empty to remove stage labels
+    :param assignees_to_remove: Assignees to remove
+    :param assignees_to_add: Assignees to add
+    :returns: Payload for `PATCH issues/{id}`, empty if nothing changed
+    """
+    current_labels = [label["name"] for label in issue.get("labels") or []]
+    labels = [label for label in current_labels if not label.startswith(CASTANETS_STAGE_LABEL_PREFIX)]
+    labels.extend(stage_labels)
+
+    current_assignees = [assignee["login"] for assignee in issue.get("assignees") or []]
+    assignees_to_add = list(assignees_to_add)
+    assignees = [
+        assignee
+        for assignee in current_assignees
+        if assignee not in assignees_to_remove or assignee in assignees_to_add
+    ]
+    assignees.extend(assignee for assignee in assignees_to_add if assignee not in assignees)
+
+    payload = {}
+    if set(labels) != set(current_labels):
+        payload["labels"] = labels
+    if set(assignees) != set(current_assignees):
+        payload["assignees"] = assignees
+    return payload
+
+
+def get_stage_search_queries(
+    repo: str, stage_labels: Iterable[str], updated_before: Optional[str] = None, max_length: int = 256
+) -> List[str]:
+    """
+    Get search queries of open issues with any of the stage labels, not updated since the time if given.
+    Labels are ORed with commas in one `label:` qualifier, and split into several queries only if it is too long.
+
+    :param repo: Repository (org/repo)
+    :param stage_labels: Stage labels, without the Castanets prefix
+    :param updated_before: Datetime string like 2022-06-01T12:00:00Z
+    :param max_length: Maximum length of a query, the Search API allows 256 characters
+    :returns: Search queries
+    """
+    prefix = f"repo:{repo} is:open " + (f"updated:<={updated_before} " if updated_before else "") + "label:"
+    queries = []
+    chunk: List[str] = []
+    for label in dict.fromkeys(stage_labels):
+        quoted = f'"{get_castanets_stage_label(label)}"'
+        if chunk and len(prefix) + len(",".join(chunk + [quoted])) > max_length:
+            queries.append(prefix + ",".join(chunk))
+            chunk = []
+        chunk.append(quoted)
+    if chunk:
+        queries.append(prefix + ",".join(chunk))
+    return queries
+
+
+def parse_slash_commands(comment: str) -> List[List[str]]:
+    """
+    Parse slash commands of a comment, one command per line.
 
+    :param comment: Comment body
+    :returns: Tokens of each command without the leading slash (ex. `[["approve", "stage_one"]]`)
+    """
+    commands = []
+    for line in comment.splitlines():
+        line = line.strip()
+        if line.startswith("/") and len(line) > 1:
+            commands.append(line[1:].split())
+    return commands
 
-def get_castanets_stage_label(label: str) -> str:
+
+#: Workflow input name of correlation ID, which links a workflow run to its issue
+WORKFLOW_CORRELATION_INPUT = "castanets_correlation_id"
+#: Workflow input name of speculative flag, set on runs dispatched before their stage starts
+WORKFLOW_SPECULATIVE_INPUT = "castanets_speculative"
+_CORRELATION_ID_PATTERN = re.compile(r"castanets#(\d+):[\w.%-]+:[0-9a-f]{8}")
+
+
+def create_correlation_id(issue_id: int, stage_label: str) -> str:
     """
-    Return stage label for current stage.
+    Create correlation ID of a workflow dispatch.
+    Format: castanets#<issue_id>:<stage_label>:<nonce>, with the stage label percent-encoded,
+    so labels with spaces or punctuation are found in run names too.
 
-    :returns: Label for current stage
+    :param issue_id: Github PR/Issue number
+    :param stage_label: Label of the stage dispatching the workflow
+    :returns: Correlation ID
+    """
+    return f"castanets#{issue_id}:{quote(stage_label, safe='')}:{uuid.uuid4().hex[:8]}"
+
+
+def find_correlation_id(text: str) -> Optional[str]:
+    """
+    Find correlation ID in text, like workflow run name.
+
+    :param text: Text to search
+    :returns: Correlation ID, or None if not found
+    """
+    match = _CORRELATION_ID_PATTERN.search(text or "")
+    return match.group(0) if match else None
+
+
+def get_issue_id_from_correlation_id(correlation_id: str) -> int:
+    """
+    Get issue number from correlation ID.
+
+    :param correlation_id: Correlation ID
+    :returns: Github PR/Issue number
+    """
+    return int(_CORRELATION_ID_PATTERN.match(correlation_id).group(1))
+
+
+def parse_github_datetime(value: str) -> datetime:
+    """
+    Parse datetime string of GitHub API (ISO 8601, UTC).
+
+    :param value: Datetime string like 2022-06-01T12:00:00Z
+    :returns: Datetime
+    """
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+
+
+def format_github_datetime(value: Optional[datetime] = None) -> str:
+    """
+    Format datetime like GitHub API.
+
+    :param value: Datetime, current time if not given
+    :returns: Datetime string like 2022-06-01T12:00:00Z
+    """
+    value = value or datetime.now(timezone.utc)
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def read_outputs_from_artifact(artifact: IO[bytes], path: str, max_output_size: int) -> Dict[str, Any]:
+    """
+    Read outputs file (JSON or YAML) from an artifact zip.
+    Only the central directory and the outputs file are read, other files are not loaded.
+
+    :param artifact: Seekable file object of artifact zip
+    :param path: Path of outputs file in the zip
+    :param max_output_size: Maximum size of outputs file in bytes
+    :returns: Outputs
+    """
+    with zipfile.ZipFile(artifact) as zf:
+        try:
+            info = zf.getinfo(path)
+        except KeyError:
+            raise ValueError(f"Outputs file {path} is not in the artifact.")
+        if info.file_size > max_output_size:
+            raise ValueError(f"Outputs file {path} is too large: {info.file_size} > {max_output_size} bytes")
+
+        # Bounded read, in case the header lies about the size
+        with zf.open(info) as f:
+            content = f.read(max_output_size + 1)
+        if len(content) > max_output_size:
+            raise ValueError(f"Outputs file {path} is larger than {max_output_size} bytes")
+
+    if os.path.splitext(path)[1] in [".yml", ".yaml"]:
+        outputs = yaml.safe_load(content)
+    else:
+        outputs = json.loads(content)
+
+    if not isinstance(outputs, dict):
+        raise ValueError(f"Outputs file {path} must be a mapping.")
+    return outputs
+
+
+def expand_matrix(matrix: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """
+    Expand matrix into cells, every combination of values.
+
+    :param matrix: Values by key
+    :returns: Cells, value by key
+    """
+    keys = list(matrix.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*(matrix[key] for key in keys))]
+
+
+def get_matrix_cell_key(cell: Dict[str, Any]) -> str:
     """
-    return f"castanets:stage:{label}"
+    Get readable key of matrix cell, like `dataset=a, region=b`.
+
+    :param cell: Matrix cell
+    """
+    return ", ".join(f"{key}={value}" for key, value in cell.items())
+
+
+def render_matrix_inputs(inputs: Optional[Dict[str, Any]], cell: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Replace matrix placeholders in workflow inputs with values of the cell.
+    Values are rendered as strings, since `workflow_dispatch` only accepts string inputs.
+    Booleans are `true` or `false`, like boolean inputs of workflows.
+
+    :param inputs: Workflow inputs
+    :param cell: Matrix cell
+    :returns: Inputs of the cell
+    """
+    if inputs is None:
+        return None
+
+    def render(match: re.Match) -> str:
+        value = cell[match.group(1)]
+        return str(value).lower() if isinstance(value, bool) else str(value)
+
+    rendered = {}
+    for name, value in inputs.items():
+        if isinstance(value, str):
+            value = MATRIX_PLACEHOLDER_PATTERN.sub(render, value)
+        rendered[name] = value
+    return rendered
+
+
+def get_workflow_hash(workflow: str, sha: str, inputs: Optional[Dict[str, Any]]) -> str:
+    """
+    Get content hash of a workflow dispatch, used to find memoized runs.
+
+    :param workflow: Workflow filename
+    :param sha: Commit SHA of the ref the workflow runs on
+    :param inputs: Rendered workflow inputs, without correlation ID
+    :returns: SHA-256 hex digest
+    """
+    payload = json.dumps({"workflow": workflow, "sha": sha, "inputs": inputs or {}}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+#: Start of the process instruction of Castanets state in a comment
+STATE_MARKER = "<?castanets"
 
 
 def get_castanets_state_from_comment(comment: str) -> Dict[str, Any]:
@@ -79,7 +310,7 @@ def state_dict_to_process_instruction(state: Dict[str, Any]) -> str:
     """
     With state dict, return process instruction.
     """
-    return f"<?castanets {json.dumps(state)}?>"
+    return f"{STATE_MARKER} {json.dumps(state)}?>"
 
 
 def embed_state_to_comment(comment: str, state: Dict[str, Any]) -> str:
@@ -96,19 +327,25 @@ def embed_state_to_comment(comment: str, state: Dict[str, Any]) -> str:
     return comment.replace(prev_state_pi, state_pi)
 
 
-def get_mermaid_from_context(context: CastanetsContext, stage_idx: int):
+#: Mermaid class of stage status, stages without status are pending
+_MERMAID_STATUS_CLASSES = {"running": "Running", "done": "Done", "skipped": "Skipped"}
+
+
+def get_mermaid_from_context(context: CastanetsContext, stage_status: Dict[str, str]):
     """
     Render mermaid from Castanets context.
+
+    :param context: Castanets context
+    :param stage_status: Status of stages by label (running, done, ...)
     """
     stage_nodes = []
+    stage_edges = []
     for idx, stage in enumerate(context.config.stages):
-        if idx < stage_idx:
-            stage_nodes.append(f"{stage.label}[{stage.name}]:::Done")
-        elif idx == stage_idx:
-            stage_nodes.append(f"{stage.label}[{stage.name}]:::Running")
-        else:
-            stage_nodes.append(f"{stage.label}[{stage.name}]:::Pending")
-    stage_flow = " --> ".join(stage_nodes)
+        status_class = _MERMAID_STATUS_CLASSES.get(stage_status.get(stage.label), "Pending")
+        stage_nodes.append(f"{stage.label}[{stage.name}]:::{status_class}")
+        for need in context.config.get_needs(idx):
+            stage_edges.append(f"{context.config.stages[need].label} --> {stage.label}")
+    stage_flow = "\n        ".join(stage_nodes + stage_edges)
 
     return f"""
     flowchart LR
@@ -117,7 +354,26 @@ def get_mermaid_from_context(context: CastanetsContext, stage_idx: int):
     classDef Done fill:#2da44e,stroke:#fff,color:white
     classDef Running fill:#bf8700,stroke:#fff,color:white
     classDef Pending fill:#888,stroke:#fff,color:white
+    classDef Skipped fill:#fff,stroke:#888,color:#888,stroke-dasharray:5 5
+    """
+
+
+#: Sandbox for stage conditions, undefined values are falsy
+_condition_env = SandboxedEnvironment(undefined=ChainableUndefined)
+
+
+def evaluate_stage_condition(expression: str, **variables) -> bool:
+    """
+    Evaluate `when` condition of a stage in Jinja sandbox.
+
+    .. code-block:: python
+        evaluate_stage_condition("params.model_changed and github.ref == 'main'", params=..., github=...)
+
+    :param expression: Jinja expression
+    :param variables: Variables available in the expression (params, state, github)
+    :returns: Truthiness of the expression
     """
+    return bool(_condition_env.compile_expression(expression)(**variables))
 
 
 def get_mermaid_image_url(mermaid: str):
@@ -1,84 +1,449 @@
-from typing import List, Optional
+import math
+import time
+from typing import IO, Any, Dict, Iterable, List, Mapping, Optional, Tuple
+from urllib.parse import quote
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from castanets import hooks
 from castanets.models import GithubActionsContext
 from castanets.utils import (
+    STATE_MARKER,
+    WORKFLOW_CORRELATION_INPUT,
     embed_state_to_comment,
     get_castanets_params_from_comment,
     get_castanets_state_from_comment,
+    get_issue_metadata_patch,
     get_logger,
 )
+from castanets.utils.auth import AppCredential, Credential, CredentialPool
 
 logger = get_logger(__name__)
 
+#: Credentials of API calls, the token of the context is used if not set
+_credential_pool: Optional[CredentialPool] = None
+#: User authenticated by the primary credential, which does not change during a run
+_action_user: Optional[dict] = None
+#: Remaining requests of the rate limit in the latest response
+_rate_limit_remaining: Optional[int] = None
+#: Credentials of other repositories by `owner/repo` or `owner`
+_repo_credentials: Dict[str, Credential] = {}
+#: Connections kept alive for each host, enough for concurrent dispatches
+POOL_MAXSIZE = 16
+_session: Optional[requests.Session] = None
 
-def _base_api_call(
-    context: GithubActionsContext, endpoint: str, method: str, payload: Optional[dict] = None, no_repo: bool = False
-):
+
+class GithubApiError(Exception):
     """
-    Call a GitHub API
+    Error response of GitHub API.
+    """
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        #: HTTP status code of the response
+        self.status_code = status_code
+
+
+def set_credential_pool(pool: Optional[CredentialPool]):
+    """
+    Set credentials of API calls. Set before the context is constructed, so all calls use them.
+
+    :param pool: Credential pool, None to use the token of the context
+    """
+    global _credential_pool, _action_user
+    _credential_pool = pool
+    _action_user = None
+
+
+def set_repo_credentials(credentials: Dict[str, Credential]):
+    """
+    Set credentials of API calls to other repositories, like dispatching workflows of cross-repository stages.
+
+    :param credentials: Credential by `owner/repo`, or by `owner` for all repositories of the owner
+    """
+    global _repo_credentials
+    _repo_credentials = dict(credentials)
+
+
+def _get_session() -> requests.Session:
+    """
+    Get the session shared by API calls, whose connection pool is reused by concurrent calls.
+    """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE)
+        _session.mount("https://", adapter)
+    return _session
+
+
+def _get_headers(context: GithubActionsContext, credential: Optional[Credential] = None) -> dict:
+    """
+    Return headers for GitHub API.
+
+    :param context: Context of Github Actions
+    :param credential: Credential of the call, the token of the context if not given
+    """
+    token = credential.get_token() if credential is not None else context.token
+    return {
+        "Authorization": f"token {token}",
+        "Content-Type": "application/json",
+        "Accept": "application/vnd.github.v3+json",
+    }
+
+
+def _select_credential(method: str, primary: bool = False, repo: Optional[str] = None) -> Optional[Credential]:
+    """
+    Select a credential of the pool for a call, None if the pool is not set.
+    Calls to other repositories use their credential, if set.
+
+    :param method: HTTP method of the call
+    :param primary: Use the primary credential, which makes comments
+    :param repo: Other repository of the call (owner/repo)
+    """
+    if repo is not None:
+        credential = _repo_credentials.get(repo) or _repo_credentials.get(repo.split("/")[0])
+        if credential is not None:
+            return credential
+    if _credential_pool is None:
+        return None
+    return _credential_pool.primary if primary else _credential_pool.select(method)
+
+
+def _update_rate_limit(credential: Optional[Credential], headers: Mapping[str, str]):
+    """
+    Update the rate limit of the credential, or of the token of the context, from headers of a response.
+
+    :param credential: Credential of the call, None for the token of the context
+    :param headers: Response headers
+    """
+    global _rate_limit_remaining
+
+    if credential is not None:
+        credential.update_rate_limit(headers)
+    if "X-RateLimit-Remaining" in headers:
+        _rate_limit_remaining = int(headers["X-RateLimit-Remaining"])
+
+
+def _call(
+    context: GithubActionsContext,
+    endpoint: str,
+    method: str,
+    payload: Optional[dict] = None,
+    no_repo: bool = False,
+    primary: bool = False,
+    headers: Optional[dict] = None,
+    repo: Optional[str] = None,
+) -> requests.Response:
+    """
+    Send a request to GitHub API, and raise on an error response.
 
     :param context: Context of Github Actions
     :param endpoint: Github API Endpoint
     :param method: Github API Method
     :param payload: Github API Payload
     :param no_repo: If True, do not include repository in the URL
-    :return: Github API Response
+    :param primary: Use the primary credential even for reads
+    :param headers: Extra headers, like `If-None-Match`
+    :param repo: Repository of the call (owner/repo), the repository of the context if not given
+    :return: Response
     """
-    headers = {
-        "Authorization": f"token {context.token}",
-        "Content-Type": "application/json",
-        "Accept": "application/vnd.github.v3+json",
-    }
+    repo = repo if repo != context.repo else None
+    credential = _select_credential(method, primary, repo)
+    headers = {**_get_headers(context, credential), **(headers or {})}
 
     if no_repo:
         url = f"https://api.github.com/{endpoint}"
     else:
-        url = f"https://api.github.com/repos/{context.repo}/{endpoint}"
-
-    logger.info(f"Calling {url} with payload {payload}")
-    if method == "POST":
-        response = requests.post(url, headers=headers, json=payload)
-    elif method == "GET":
-        response = requests.get(url, headers=headers)
-    elif method == "PATCH":
-        response = requests.patch(url, headers=headers, json=payload)
-    elif method == "DELETE":
-        response = requests.delete(url, headers=headers, json=payload)
-    else:
+        url = f"https://api.github.com/repos/{repo or context.repo}/{endpoint}"
+
+    logger.info("Calling %s %s", method, url)
+    if payload is not None:
+        logger.debug("Payload of %s %s: %s", method, url, payload)
+    if method not in ["POST", "GET", "PATCH", "DELETE"]:
         raise ValueError(f"Invalid Method: {method}")
+    with hooks.span("http", f"{method} /{endpoint}", method=method, url=url) as span:
+        response = _get_session().request(method, url, headers=headers, json=payload if method != "GET" else None)
+
+        if span is not None:
+            span.args["status"] = response.status_code
+    _update_rate_limit(credential, response.headers)
 
     if not response.ok:
-        raise Exception(f"Github API Call on {method} /{endpoint} Failed. {response.status_code}: {response.text}")
+        raise GithubApiError(
+            f"Github API Call on {method} /{endpoint} Failed. {response.status_code}: {response.text}",
+            response.status_code,
+        )
+    return response
+
 
+def _parse_response(response: requests.Response):
+    """
+    Return JSON of the response, or text if it is not JSON.
+    """
     if "Content-Type" in response.headers and "application/json" in response.headers["Content-Type"]:
-        result = response.json()
-    else:
-        result = response.text
+        return response.json()
+    return response.text
 
-    return result
+
+def _base_api_call(
+    context: GithubActionsContext,
+    endpoint: str,
+    method: str,
+    payload: Optional[dict] = None,
+    no_repo: bool = False,
+    primary: bool = False,
+    repo: Optional[str] = None,
+):
+    """
+    Call a GitHub API
+
+    :param context: Context of Github Actions
+    :param endpoint: Github API Endpoint
+    :param method: Github API Method
+    :param payload: Github API Payload
+    :param no_repo: If True, do not include repository in the URL
+    :param primary: Use the primary credential even for reads
+    :param repo: Repository of the call (owner/repo), the repository of the context if not given
+    :return: Github API Response
+    """
+    return _parse_response(_call(context, endpoint, method, payload, no_repo, primary, repo=repo))
+
+
+def _conditional_get(
+    context: GithubActionsContext, endpoint: str, etag: Optional[str] = None, no_repo: bool = False
+) -> Tuple[Optional[Any], Optional[str]]:
+    """
+    GET with `If-None-Match`. Not modified responses don't count against the rate limit.
+
+    :param context: Context of Github Actions
+    :param endpoint: Github API Endpoint
+    :param etag: ETag of the response fetched before
+    :param no_repo: If True, do not include repository in the URL
+    :return: Response data (None if not modified) and ETag of the response
+    """
+    response = _call(context, endpoint, "GET", no_repo=no_repo, headers={"If-None-Match": etag} if etag else None)
+    if response.status_code == 304:
+        return None, etag
+    return _parse_response(response), response.headers.get("ETag")
+
+
+def get_rate_limit_remaining() -> float:
+    """
+    Return remaining requests of the rate limit, of the credential reads would use with a credential pool.
+    Unknown rate limit, before any response, counts as unlimited.
+    """
+    if _credential_pool is not None:
+        return _credential_pool.select("GET").get_remaining(time.time())
+    return _rate_limit_remaining if _rate_limit_remaining is not None else math.inf
 
 
 def get_user(context: GithubActionsContext):
     """
-    Return the user authenticated by the token.
+    Return the user authenticated by the primary credential, cached during the run.
+    For a GitHub App, it is the bot user of the App.
+
+    :param context: Context of Github Actions
+    """
+    global _action_user
+    if _action_user is None:
+        credential = _select_credential("GET", primary=True)
+        if isinstance(credential, AppCredential):
+            _action_user = credential.get_user()
+        else:
+            _action_user = _base_api_call(context=context, endpoint="user", method="GET", no_repo=True, primary=True)
+    return _action_user
+
+
+def get_user_by_login(context: GithubActionsContext, username: str) -> dict:
+    """
+    Return the public profile of a user.
+
+    :param context: Context of Github Actions
+    :param username: GitHub username
+    """
+    return _base_api_call(context=context, endpoint=f"users/{username}", method="GET", no_repo=True)
+
+
+def get_team_members(context: GithubActionsContext, team: str, per_page: int = 100) -> List[str]:
+    """
+    Get usernames of team members, including members of child teams.
+    The token needs `read:org` scope.
+
+    :param context: Context of Github Actions
+    :param team: Team as `org/team-slug`
+    :param per_page: Number of members per page
+    :return: Usernames of members
+    """
+    org, slug = team.split("/")
+    members = []
+    page = 1
+    while True:
+        result = _base_api_call(
+            context=context,
+            endpoint=f"orgs/{org}/teams/{slug}/members?per_page={per_page}&page={page}",
+            method="GET",
+            no_repo=True,
+        )
+        members.extend(member["login"] for member in result)
+        if len(result) < per_page:
+            return members
+        page += 1
+
+
+#: Latest approving or change-requesting review of each reviewer with write access
+LATEST_REVIEWS_QUERY = """
+query($owner: String!, $name: String!, $number: Int!, $first: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      latestOpinionatedReviews(first: $first, after: $cursor, writersOnly: true) {
+        nodes { state submittedAt author { login } }
+        pageInfo { hasNextPage endCursor }
+      }
+    }
+  }
+}
+"""
+
+
+def graphql(context: GithubActionsContext, query: str, variables: Optional[dict] = None) -> dict:
+    """
+    Call GitHub GraphQL API.
+
+    :param context: Context of Github Actions
+    :param query: GraphQL query
+    :param variables: Variables of the query
+    :return: Data of the response
+    """
+    result = _base_api_call(
+        context=context,
+        endpoint="graphql",
+        method="POST",
+        payload={"query": query, "variables": variables or {}},
+        no_repo=True,
+    )
+    if result.get("errors"):
+        raise Exception(f"Github GraphQL Call Failed. {result['errors']}")
+    return result["data"]
+
+
+def get_latest_reviews(context: GithubActionsContext, per_page: int = 100) -> Dict[str, dict]:
+    """
+    Get the latest review of each reviewer of the pull request, one GraphQL query per page.
+    Comment-only reviews are not included, so a comment after an approval keeps the approval.
+
+    :param context: Context of Github Actions
+    :param per_page: Number of reviews per page
+    :return: Review by username, with `state` (APPROVED, CHANGES_REQUESTED, DISMISSED) and `submitted_at`
+    """
+    owner, name = context.repo.split("/")
+    reviews = {}
+    cursor = None
+    while True:
+        data = graphql(
+            context,
+            LATEST_REVIEWS_QUERY,
+            {"owner": owner, "name": name, "number": context.issue_id, "first": per_page, "cursor": cursor},
+        )
+        connection = data["repository"]["pullRequest"]["latestOpinionatedReviews"]
+        for node in connection["nodes"]:
+            # Author is null for deleted users
+            if node["author"] is None:
+                continue
+            # The latest review of the author wins, even if pages list an older one later
+            latest = reviews.get(node["author"]["login"])
+            if latest is None or latest["submitted_at"] < node["submittedAt"]:
+                reviews[node["author"]["login"]] = {"state": node["state"], "submitted_at": node["submittedAt"]}
+        if not connection["pageInfo"]["hasNextPage"]:
+            return reviews
+        cursor = connection["pageInfo"]["endCursor"]
+
+
+def search_issues(context: GithubActionsContext, query: str, per_page: int = 100) -> List[dict]:
+    """
+    Search issues and pull requests. The Search API returns up to 1,000 results.
 
     :param context: Context of Github Actions
+    :param query: Search query, like `repo:org/repo is:open label:bug`
+    :param per_page: Number of issues per page
+    :return: Issues
     """
-    return _base_api_call(context=context, endpoint="user", method="GET", no_repo=True)
+    issues = []
+    page = 1
+    while True:
+        result = _base_api_call(
+            context=context,
+            endpoint=f"search/issues?q={quote(query)}&per_page={per_page}&page={page}",
+            method="GET",
+            no_repo=True,
+        )
+        issues.extend(result["items"])
+        if len(result["items"]) < per_page or len(issues) >= min(result["total_count"], 1000):
+            return issues
+        page += 1
 
 
-def run_workflow(context: GithubActionsContext, workflow: str, inputs: Optional[dict] = None):
+def list_issues_since(context: GithubActionsContext, since: Optional[str] = None, per_page: int = 100) -> List[dict]:
+    """
+    List issues and pull requests of any state, updated at or after the time, oldest update first.
+
+    :param context: Context of Github Actions
+    :param since: Datetime string like 2022-06-01T12:00:00Z, all issues if not given
+    :param per_page: Number of issues per page
+    :return: Issues
+    """
+    endpoint = f"issues?state=all&sort=updated&direction=asc&per_page={per_page}"
+    if since is not None:
+        endpoint += f"&since={since}"
+    issues = []
+    page = 1
+    while True:
+        result = _base_api_call(context=context, endpoint=f"{endpoint}&page={page}", method="GET")
+        issues.extend(result)
+        if len(result) < per_page:
+            return issues
+        page += 1
+
+
+def get_timeline_page(
+    context: GithubActionsContext, issue_id: int, page: int, etag: Optional[str] = None, per_page: int = 100
+) -> Tuple[Optional[List[dict]], Optional[str]]:
+    """
+    Get a page of timeline events of an issue, with a conditional request.
+
+    :param context: Context of Github Actions
+    :param issue_id: Issue number
+    :param page: Page number, from 1
+    :param etag: ETag of the page fetched before
+    :param per_page: Number of events per page
+    :return: Events (None if not modified) and ETag of the page
+    """
+    return _conditional_get(context, f"issues/{issue_id}/timeline?per_page={per_page}&page={page}", etag)
+
+
+def run_workflow(
+    context: GithubActionsContext,
+    workflow: str,
+    inputs: Optional[dict] = None,
+    correlation_id: Optional[str] = None,
+    repo: Optional[str] = None,
+    ref: Optional[str] = None,
+):
     """
     Run a GitHub workflow.
 
     :param context: Context of Github Actions
     :param workflow: Github Workflow File Name or ID
     :param inputs: Github Workflow Inputs
+    :param correlation_id: Correlation ID injected to `castanets_correlation_id` input
+    :param repo: Repository (owner/repo), the repository of the context if not given
+    :param ref: Branch or tag to run the workflow on, the ref of the context if not given
     :return: Github Workflow Response
     """
-    payload = {"ref": context.ref}
+    payload = {"ref": ref or context.ref}
+    if correlation_id is not None:
+        inputs = {**(inputs or {}), WORKFLOW_CORRELATION_INPUT: correlation_id}
     if inputs is not None:
         payload["inputs"] = inputs
 
@@ -87,7 +452,136 @@ def run_workflow(context: GithubActionsContext, workflow: str, inputs: Optional[
         endpoint=f"actions/workflows/{workflow}/dispatches",
         method="POST",
         payload=payload,
+        repo=repo,
+    )
+
+
+def get_commit_sha(context: GithubActionsContext, ref: str, repo: Optional[str] = None) -> str:
+    """
+    Get commit SHA of a ref.
+
+    :param context: Context of Github Actions
+    :param ref: Branch, tag or SHA
+    :param repo: Repository (owner/repo), the repository of the context if not given
+    :return: Commit SHA
+    """
+    return _base_api_call(context=context, endpoint=f"commits/{ref}", method="GET", repo=repo)["sha"]
+
+
+def rerun_workflow_run(
+    context: GithubActionsContext, run_id: int, failed_only: bool = True, repo: Optional[str] = None
+):
+    """
+    Rerun a GitHub workflow run. The rerun keeps run ID and run name.
+
+    :param context: Context of Github Actions
+    :param run_id: Workflow run ID
+    :param failed_only: Rerun failed jobs only
+    :param repo: Repository (owner/repo), the repository of the context if not given
+    """
+    endpoint = f"actions/runs/{run_id}/rerun-failed-jobs" if failed_only else f"actions/runs/{run_id}/rerun"
+    return _base_api_call(context=context, endpoint=endpoint, method="POST", repo=repo)
+
+
+def find_workflow_run(
+    context: GithubActionsContext,
+    workflow: str,
+    correlation_id: str,
+    created_since: Optional[str] = None,
+    repo: Optional[str] = None,
+) -> Optional[dict]:
+    """
+    Find a dispatched workflow run by correlation ID in its run name.
+
+    :param context: Context of Github Actions
+    :param workflow: Github Workflow File Name or ID
+    :param correlation_id: Correlation ID of the dispatch
+    :param created_since: Only search runs created at or after this time (ISO 8601)
+    :param repo: Repository (owner/repo), the repository of the context if not given
+    :return: Workflow run, or None if not found (ex. not created yet)
+    """
+    endpoint = f"actions/workflows/{workflow}/runs?event=workflow_dispatch&per_page=100"
+    if created_since is not None:
+        endpoint += f"&created=>={created_since}"
+    result = _base_api_call(context=context, endpoint=endpoint, method="GET", repo=repo)
+    runs = [run for run in result["workflow_runs"] if correlation_id in (run.get("display_title") or "")]
+    return runs[0] if runs else None
+
+
+def cancel_workflow_run(context: GithubActionsContext, run_id: int, repo: Optional[str] = None):
+    """
+    Cancel a GitHub workflow run.
+
+    :param context: Context of Github Actions
+    :param run_id: Workflow run ID
+    :param repo: Repository (owner/repo), the repository of the context if not given
+    """
+    return _base_api_call(context=context, endpoint=f"actions/runs/{run_id}/cancel", method="POST", repo=repo)
+
+
+def get_workflow_run_artifact(
+    context: GithubActionsContext, run_id: int, name: str, repo: Optional[str] = None
+) -> Optional[dict]:
+    """
+    Get an artifact of a workflow run by name.
+
+    :param context: Context of Github Actions
+    :param run_id: Workflow run ID
+    :param name: Artifact name
+    :param repo: Repository (owner/repo), the repository of the context if not given
+    :return: Artifact, or None if not found
+    """
+    result = _base_api_call(
+        context=context,
+        endpoint=f"actions/runs/{run_id}/artifacts?name={quote(name, safe='')}",
+        method="GET",
+        repo=repo,
     )
+    artifacts = [artifact for artifact in result["artifacts"] if artifact["name"] == name and not artifact["expired"]]
+    return artifacts[0] if artifacts else None
+
+
+def download_artifact(
+    context: GithubActionsContext,
+    artifact_id: int,
+    fileobj: IO[bytes],
+    max_size: int,
+    chunk_size: int = 1024 * 1024,
+    repo: Optional[str] = None,
+):
+    """
+    Download an artifact zip by streaming it to a file object.
+
+    :param context: Context of Github Actions
+    :param artifact_id: Artifact ID
+    :param fileobj: File object to write the zip
+    :param max_size: Maximum size of the zip in bytes
+    :param chunk_size: Size of each chunk in bytes
+    :param repo: Repository (owner/repo), the repository of the context if not given
+    """
+    repo = repo if repo != context.repo else None
+    url = f"https://api.github.com/repos/{repo or context.repo}/actions/artifacts/{artifact_id}/zip"
+    logger.info("Downloading %s", url)
+    with hooks.span("http", f"GET /actions/artifacts/{artifact_id}/zip", method="GET", url=url):
+        # Redirected to blob storage, `requests` drops Authorization header on redirect to other host.
+        credential = _select_credential("GET", repo=repo)
+        with _get_session().get(url, headers=_get_headers(context, credential), stream=True) as response:
+            # Rate limit headers are on the redirect of GitHub API, not on the response of blob storage
+            _update_rate_limit(credential, response.history[0].headers if response.history else response.headers)
+            if not response.ok:
+                raise GithubApiError(
+                    f"Artifact {artifact_id} download Failed. {response.status_code}: {response.text}",
+                    response.status_code,
+                )
+
+            size = 0
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                size += len(chunk)
+                if size > max_size:
+                    raise ValueError(f"Artifact {artifact_id} is larger than {max_size} bytes")
+                fileobj.write(chunk)
+
+    fileobj.seek(0)
 
 
 def comment(context: GithubActionsContext, message: str):
@@ -118,6 +612,44 @@ def get_comments(context: GithubActionsContext):
     )
 
 
+def get_comments_since(context: GithubActionsContext, since: str, per_page: int = 100) -> List[dict]:
+    """
+    Get all issue comments updated at or after the given time.
+
+    :param context: Context of Github Actions
+    :param since: Time in ISO 8601 format
+    :param per_page: Number of comments per page
+    """
+    comments = []
+    page = 1
+    while True:
+        result = _base_api_call(
+            context=context,
+            endpoint=f"issues/{context.issue_id}/comments?since={since}&per_page={per_page}&page={page}",
+            method="GET",
+        )
+        comments.extend(result)
+        if len(result) < per_page:
+            return comments
+        page += 1
+
+
+def add_reaction(context: GithubActionsContext, comment_id: int, content: str):
+    """
+    Add a reaction to an issue comment.
+
+    :param context: Context of Github Actions
+    :param comment_id: Comment ID
+    :param content: Reaction (ex. +1, eyes, confused)
+    """
+    return _base_api_call(
+        context=context,
+        endpoint=f"issues/comments/{comment_id}/reactions",
+        method="POST",
+        payload={"content": content},
+    )
+
+
 def update_comment(context: GithubActionsContext, comment_id: str, message: str):
     """
     Write a comment to GitHub Issue.
@@ -136,7 +668,9 @@ def update_comment(context: GithubActionsContext, comment_id: str, message: str)
 
 def _get_first_comment_from_action_user(context: GithubActionsContext):
     """
-    Get first GitHub issue comment written by Castanets
+    Get first GitHub issue comment written by Castanets.
+    Without a comment of the action user, like after switching from `token` to a GitHub App,
+    the first comment with the state of Castanets is used, whoever wrote it.
 
     :param context: Context of Github Actions
     """
@@ -145,6 +679,10 @@ def _get_first_comment_from_action_user(context: GithubActionsContext):
     for comment in comments:
         if comment["user"]["id"] == action_user["id"]:
             return comment
+    for comment in comments:
+        if STATE_MARKER in (comment["body"] or ""):
+            logger.info("Use state comment %s of %s", comment["id"], comment["user"]["login"])
+            return comment
     return None
 
 
@@ -161,20 +699,133 @@ def read_state_from_first_comment(context: GithubActionsContext):
     return state
 
 
-def write_state_to_first_comment(context: GithubActionsContext, state: dict):
+def write_state_to_first_comment(context: GithubActionsContext, state: dict, body: Optional[str] = None):
     """
     Write state to issue comment written by Castanets.
 
     :param context: Context of Github Actions
     :param state: State
+    :param body: New body of the comment, the current body is kept if not given
     """
     comment = _get_first_comment_from_action_user(context=context)
     if comment is None:
         raise Exception("No Comment Found")
-    state_embedded_comment = embed_state_to_comment(comment["body"], state)
+    state_embedded_comment = embed_state_to_comment(body if body is not None else comment["body"], state)
     return update_comment(context, comment["id"], state_embedded_comment)
 
 
+def update_first_comment_body(context: GithubActionsContext, body: str):
+    """
+    Update body of the first comment written by Castanets, for state stores outside of the comment.
+
+    :param context: Context of Github Actions
+    :param body: New body of the comment
+    """
+    comment = _get_first_comment_from_action_user(context=context)
+    if comment is None:
+        raise Exception("No Comment Found")
+    return update_comment(context, comment["id"], body)
+
+
+def get_git_ref_sha(context: GithubActionsContext, ref: str) -> Optional[str]:
+    """
+    Get commit SHA of a git reference.
+
+    :param context: Context of Github Actions
+    :param ref: Fully qualified reference like `refs/heads/castanets-state`
+    :return: Commit SHA, None if the reference does not exist
+    """
+    try:
+        result = _base_api_call(context=context, endpoint=f"git/ref/{ref[len('refs/'):]}", method="GET")
+    except GithubApiError as e:
+        if e.status_code == 404:
+            return None
+        raise
+    return result["object"]["sha"]
+
+
+def get_file_content(context: GithubActionsContext, path: str, ref: str) -> Optional[str]:
+    """
+    Get content of a file at a ref, with the raw media type so the content is not base64 encoded.
+
+    :param context: Context of Github Actions
+    :param path: File path in the repository
+    :param ref: Reference or commit SHA
+    :return: Content, None if the file or the ref does not exist
+    """
+    try:
+        response = _call(
+            context, f"contents/{path}?ref={quote(ref)}", "GET", headers={"Accept": "application/vnd.github.raw"}
+        )
+    except GithubApiError as e:
+        if e.status_code == 404:
+            return None
+        raise
+    return response.text
+
+
+def get_tree_paths(context: GithubActionsContext, sha: str) -> List[str]:
+    """
+    Get paths of files in the tree of a commit, recursively.
+
+    :param context: Context of Github Actions
+    :param sha: Commit SHA
+    :return: File paths
+    """
+    result = _base_api_call(context=context, endpoint=f"git/trees/{sha}?recursive=1", method="GET")
+    return [item["path"] for item in result["tree"] if item["type"] == "blob"]
+
+
+def commit_files(
+    context: GithubActionsContext, ref: str, files: Dict[str, str], message: str, max_retries: int = 3
+) -> str:
+    """
+    Commit files to a git reference with the Git Data API, without a checkout.
+    The reference is created on the first commit. If another commit moved the reference meanwhile,
+    the files are committed again on top of it.
+
+    :param context: Context of Github Actions
+    :param ref: Fully qualified reference like `refs/heads/castanets-state`
+    :param files: Content by file path
+    :param message: Commit message
+    :param max_retries: Maximum retries when the reference moved
+    :return: Commit SHA
+    """
+    tree = [{"path": path, "mode": "100644", "type": "blob", "content": content} for path, content in files.items()]
+    for attempt in range(max_retries + 1):
+        parent = get_git_ref_sha(context, ref)
+        payload = {"tree": tree}
+        if parent is not None:
+            payload["base_tree"] = _base_api_call(context=context, endpoint=f"git/commits/{parent}", method="GET")[
+                "tree"
+            ]["sha"]
+        tree_sha = _base_api_call(context=context, endpoint="git/trees", method="POST", payload=payload)["sha"]
+        commit = _base_api_call(
+            context=context,
+            endpoint="git/commits",
+            method="POST",
+            payload={"message": message, "tree": tree_sha, "parents": [parent] if parent else []},
+        )
+        try:
+            if parent is None:
+                _base_api_call(
+                    context=context, endpoint="git/refs", method="POST", payload={"ref": ref, "sha": commit["sha"]}
+                )
+            else:
+                _base_api_call(
+                    context=context,
+                    endpoint=f"git/{ref}",
+                    method="PATCH",
+                    payload={"sha": commit["sha"], "force": False},
+                )
+            return commit["sha"]
+        except GithubApiError as e:
+            # Not a fast-forward, or the reference was created meanwhile
+            if e.status_code != 422 or attempt == max_retries:
+                raise
+            logger.info("Reference %s moved, commit again (attempt %d)", ref, attempt + 1)
+
+
 def get_issue(context: GithubActionsContext):
     """
     Get a GitHub issue.
@@ -264,3 +915,28 @@ def remove_assignees(context: GithubActionsContext, assignees: List[str]):
         method="DELETE",
         payload={"assignees": assignees},
     )
+
+
+def reconcile_issue_metadata(
+    context: GithubActionsContext,
+    issue: dict,
+    stage_labels: Iterable[str],
+    assignees_to_remove: Iterable[str] = (),
+    assignees_to_add: Iterable[str] = (),
+):
+    """
+    Apply stage labels and assignees to a GitHub issue with a single PATCH call.
+    Skip the call when the issue is already in the desired state.
+
+    :param context: Context of Github Actions
+    :param issue: Issue data fetched before
+    :param stage_labels: Stage labels to set, empty to remove stage labels
+    :param assignees_to_remove: Assignees to remove
+    :param assignees_to_add: Assignees to add
+    :return: Updated issue data
+    """
+    payload = get_issue_metadata_patch(issue, stage_labels, assignees_to_remove, assignees_to_add)
+    if not payload:
+        logger.info("Issue metadata is up to date, skip update.")
+        return issue
+    return update_issue(context, payload)
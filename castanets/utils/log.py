@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import re
+import sys
+from typing import Any, Dict, Mapping, Optional
+
+#: Parent logger of all Castanets loggers, which has the handler
+ROOT_LOGGER = "castanets"
+#: Replacement of redacted values
+REDACTED = "***"
+#: Keys of payloads whose values are redacted
+SENSITIVE_KEY_PATTERN = re.compile(r"token|secret|password|authorization|private_key|credential", re.IGNORECASE)
+#: Token-like strings redacted from messages (GitHub tokens, Slack tokens, JWTs, Authorization headers)
+TOKEN_PATTERN = re.compile(
+    r"\b(?:gh[pousr]_\w{20,}|github_pat_\w{20,}|xox[abeprs]-[\w-]{10,}|eyJ[\w-]+\.[\w-]+\.[\w-]+)"
+    r"|(?<=Bearer )\S+|(?<=token )[\w.-]{20,}"
+)
+
+_handler: Optional[logging.Handler] = None
+
+
+def redact(value: Any) -> Any:
+    """
+    Redact values of sensitive keys and token-like strings, recursively.
+
+    :param value: Payload
+    """
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if isinstance(key, str) and SENSITIVE_KEY_PATTERN.search(key) else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, str):
+        return TOKEN_PATTERN.sub(REDACTED, value)
+    return value
+
+
+def truncate(text: str, max_length: int) -> str:
+    """
+    Truncate text longer than max length, with the number of dropped characters.
+
+    :param text: Text
+    :param max_length: Maximum length, unlimited if 0
+    """
+    if max_length <= 0 or len(text) <= max_length:
+        return text
+    return f"{text[:max_length]}... ({len(text) - max_length} more chars)"
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Format records as text. Arguments are redacted and truncated when the record is emitted,
+    so disabled records cost no formatting.
+
+    :param max_payload: Maximum length of each argument (or of the message without arguments), unlimited if 0
+    """
+
+    def __init__(self, max_payload: int = 1000, fmt: str = "[%(asctime)s] %(levelname)s %(name)s: %(message)s"):
+        super().__init__(fmt)
+        self.max_payload = max_payload
+
+    def get_message(self, record: logging.LogRecord) -> str:
+        if not record.args:
+            return TOKEN_PATTERN.sub(REDACTED, truncate(str(record.msg), self.max_payload))
+
+        # A single mapping argument is the mapping of `%(key)s` placeholders
+        if isinstance(record.args, Mapping) and "%(" in str(record.msg):
+            args = {key: self._format_arg(value) for key, value in record.args.items()}
+        else:
+            args = record.args if isinstance(record.args, tuple) else (record.args,)
+            args = tuple(self._format_arg(arg) for arg in args)
+        return TOKEN_PATTERN.sub(REDACTED, str(record.msg) % args)
+
+    def _format_arg(self, arg: Any) -> Any:
+        # Numbers are kept for `%d` and `%f`
+        if isinstance(arg, (int, float)):
+            return arg
+        return truncate(self._to_text(redact(arg)), self.max_payload)
+
+    @staticmethod
+    def _to_text(value: Any) -> str:
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False, default=str)
+        return str(value)
+
+    def format(self, record: logging.LogRecord) -> str:
+        # Formatted on a copy, so other handlers get the original record
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg, record.args = self.get_message(record), None
+        return super().format(record)
+
+
+class JsonFormatter(TextFormatter):
+    """
+    Format records as JSON lines with `time`, `level`, `logger`, `message` and `exception`.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": self.get_message(record),
+        }
+        if record.exc_info:
+            line["exception"] = self.formatException(record.exc_info)
+        return json.dumps(line, ensure_ascii=False)
+
+
+def parse_log_levels(value: Optional[str]) -> Dict[str, str]:
+    """
+    Parse per-subsystem levels like `utils.github=WARNING,alerts=ERROR`.
+    Names are relative to `castanets`, full logger names work too.
+
+    :param value: Comma separated `name=LEVEL`
+    """
+    levels = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        name, _, level = item.partition("=")
+        name = name.strip()
+        if name != ROOT_LOGGER and not name.startswith(f"{ROOT_LOGGER}."):
+            name = f"{ROOT_LOGGER}.{name}"
+        levels[name] = level.strip().upper()
+    return levels
+
+
+def configure_logging(
+    level: Optional[str] = None,
+    fmt: Optional[str] = None,
+    levels: Optional[str] = None,
+    max_payload: Optional[int] = None,
+):
+    """
+    Install the handler of Castanets loggers, replacing the one installed before.
+    Arguments not given are read from `CASTANETS_LOG_LEVEL`, `CASTANETS_LOG_FORMAT`, `CASTANETS_LOG_LEVELS`
+    and `CASTANETS_LOG_MAX_PAYLOAD`.
+
+    :param level: Level of Castanets loggers (default INFO)
+    :param fmt: `text` or `json` (JSON lines)
+    :param levels: Per-subsystem levels, see `parse_log_levels`
+    :param max_payload: Maximum length of each logged argument, unlimited if 0 (default 1000)
+    """
+    global _handler
+
+    level = (level or os.environ.get("CASTANETS_LOG_LEVEL") or "INFO").upper()
+    fmt = (fmt or os.environ.get("CASTANETS_LOG_FORMAT") or "text").lower()
+    if max_payload is None:
+        max_payload = int(os.environ.get("CASTANETS_LOG_MAX_PAYLOAD") or 1000)
+    if levels is None:
+        levels = os.environ.get("CASTANETS_LOG_LEVELS")
+
+    root = logging.getLogger(ROOT_LOGGER)
+    if _handler is not None:
+        root.removeHandler(_handler)
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(JsonFormatter(max_payload) if fmt == "json" else TextFormatter(max_payload))
+    root.addHandler(_handler)
+    root.setLevel(level)
+    root.propagate = False
+
+    for name, subsystem_level in parse_log_levels(levels).items():
+        logging.getLogger(name).setLevel(subsystem_level)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Get logger. The handler is installed on the first call, and loggers share it through `castanets`.
+
+    :param name: Logger name, usually `__name__`
+    :returns: Logger instance
+    """
+    if _handler is None:
+        configure_logging()
+    return logging.getLogger(name)
@@ -0,0 +1,19 @@
+#!/usr/bin/env bash
+# Run Castanets with the prebuilt runner of the release, downloaded once per runner tool cache.
+# The runner is built by scripts/build_runner.py for the Python version and the platform of the runner.
+set -euo pipefail
+
+tag=$(python3 -c 'import sys, sysconfig; print(f"cp{sys.version_info[0]}{sys.version_info[1]}-" + sysconfig.get_platform().replace("-", "_").replace(".", "_"))')
+runner_dir="${RUNNER_TOOL_CACHE:-${RUNNER_TEMP:-/tmp}}/castanets/${CASTANETS_RUNNER_VERSION}/${tag}"
+
+if [ ! -d "${runner_dir}/castanets-runner" ]; then
+  url="https://github.com/${CASTANETS_RUNNER_REPOSITORY}/releases/download/${CASTANETS_RUNNER_VERSION}/castanets-runner-${tag}.tar.gz"
+  mkdir -p "${runner_dir}"
+  # Extracted aside and moved, so an interrupted download is not taken for the runner
+  extract_dir=$(mktemp -d "${runner_dir}/extract.XXXXXX")
+  curl -fsSL --retry 3 "${url}" | tar xz -C "${extract_dir}"
+  mv "${extract_dir}/castanets-runner" "${runner_dir}/castanets-runner" || test -d "${runner_dir}/castanets-runner"
+  rm -rf "${extract_dir}"
+fi
+
+PYTHONPATH="${runner_dir}/castanets-runner" exec python3 -m castanets "$@"
@@ -0,0 +1,100 @@
+"""
+Build the prebuilt runner of the composite action (`runner/action.yml`).
+
+The runner is a directory with Castanets and its dependencies, so events run it with `python3 -m castanets`
+without installing anything. Jinja templates are compiled to Python modules and all modules are compiled to
+bytecode ahead of time. Bytecode uses unchecked hashes, so it stays valid after extraction regardless of mtimes.
+
+The runner is packed as `castanets-runner-<tag>.tar.gz`, where the tag is the Python version and the platform
+(ex. `cp310-linux_x86_64`), because dependencies like pydantic-core and cryptography have native extensions.
+For the same reason it is not a zipapp, as native extensions can't be imported from a zip file.
+
+Usage: python3 scripts/build_runner.py [--output dist]
+"""
+
+import argparse
+import compileall
+import os
+import py_compile
+import shutil
+import subprocess
+import sys
+import sysconfig
+import tarfile
+import tempfile
+
+from jinja2 import Environment, FileSystemLoader
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RUNNER_NAME = "castanets-runner"
+
+
+def get_runner_tag() -> str:
+    """
+    Get the tag of runners the current Python can run. `runner/run.sh` computes the same tag.
+    """
+    platform = sysconfig.get_platform().replace("-", "_").replace(".", "_")
+    return f"cp{sys.version_info[0]}{sys.version_info[1]}-{platform}"
+
+
+def compile_templates(templates_dir: str):
+    """
+    Compile Jinja templates to Python modules in `compiled` of the directory, loaded with `jinja2.ModuleLoader`.
+
+    :param templates_dir: Template directory
+    """
+    env = Environment(loader=FileSystemLoader(templates_dir))
+    env.compile_templates(os.path.join(templates_dir, "compiled"), zip=None, ignore_errors=False)
+
+
+def build(output_dir: str) -> str:
+    """
+    Build the runner.
+
+    :param output_dir: Directory of the runner archive
+    :returns: Path of the runner archive
+    """
+    with tempfile.TemporaryDirectory() as build_dir:
+        runner_dir = os.path.join(build_dir, RUNNER_NAME)
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "pip",
+                "install",
+                "--quiet",
+                "--no-compile",
+                "--only-binary=:all:",
+                "--target",
+                runner_dir,
+                "-r",
+                os.path.join(ROOT_DIR, "requirements.txt"),
+            ],
+            check=True,
+        )
+        shutil.copytree(
+            os.path.join(ROOT_DIR, "castanets"),
+            os.path.join(runner_dir, "castanets"),
+            ignore=shutil.ignore_patterns("__pycache__", "compiled"),
+        )
+        compile_templates(os.path.join(runner_dir, "castanets", "templates"))
+        compileall.compile_dir(
+            runner_dir, quiet=1, invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH, workers=0
+        )
+
+        os.makedirs(output_dir, exist_ok=True)
+        archive = os.path.join(output_dir, f"{RUNNER_NAME}-{get_runner_tag()}.tar.gz")
+        with tarfile.open(archive, "w:gz") as f:
+            f.add(runner_dir, arcname=RUNNER_NAME)
+    return archive
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", default=os.path.join(ROOT_DIR, "dist"))
+    args = parser.parse_args()
+    print(build(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,7 @@ setup(
         "markdown",
         "importlib_metadata",
         "pymsteams",
+        "PyJWT[crypto]",
     ],
     url="https://github.com/team-castanets/castanets.git",
     author="Castanets",
@@ -28,3 +28,21 @@ def test_alert():
     alert.alert("test", {"item": "modified"})
 
     assert must_be_modified.item == "modified"
+
+
+def test_alert_batch_stops_at_failure():
+    sent = []
+
+    @alert_handler
+    class FlakyAlert(BaseAlert):
+        @subscribe(on="test")
+        def test_command(self, payload: dict):
+            if payload["fail"]:
+                raise ConnectionError("Backend is down")
+            sent.append(payload["item"])
+
+    events = [("test", {"item": 1, "fail": False}), ("unknown", {}), ("test", {"item": 2, "fail": True})]
+    events.append(("test", {"item": 3, "fail": False}))
+
+    assert FlakyAlert().alert_batch(events) == 2
+    assert sent == [1]
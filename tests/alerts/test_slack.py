@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+from slack_sdk.errors import SlackApiError
+
+from castanets.alerts.slack import SlackAlert, SlackMentionResolver
+from castanets.utils import github
+
+
+def test_mention_resolver(monkeypatch):
+    emails = {"alice": "alice@example.com", "bob": "bob@example.com", "carol": None, "dave": "dave@example.com"}
+    lookups = []
+
+    class FakeClient:
+        def users_lookupByEmail(self, email: str):
+            lookups.append(email)
+            if email == "alice@example.com":
+                return {"user": {"id": "UALICE"}}
+            if email == "dave@example.com":
+                raise SlackApiError("ratelimited", {"ok": False, "error": "ratelimited"})
+            raise SlackApiError("not found", {"ok": False, "error": "users_not_found"})
+
+    monkeypatch.setattr(github, "get_user_by_login", lambda context, username: {"email": emails[username]})
+    context = SimpleNamespace(
+        castanets=SimpleNamespace(config=SimpleNamespace(slack_users={"erin": "UERIN"})),
+        state={},
+        state_changed=False,
+        github_actions=None,
+    )
+    resolver = SlackMentionResolver(context, FakeClient(), ttl=60)
+
+    mentions = resolver.resolve(["alice", "bob", "carol", "dave", "erin", "org/infra"])
+    assert mentions == {"alice": "UALICE", "bob": None, "carol": None, "dave": None, "erin": "UERIN"}
+    assert context.state_changed
+    # Not found users are cached, failed lookups are not
+    assert set(context.state["cache"]["slack_users"]) == {"alice", "bob", "carol"}
+
+    lookups.clear()
+    assert resolver.resolve(["alice", "bob"]) == {"alice": "UALICE", "bob": None}
+    assert lookups == []
+
+
+def test_alert_batch_merges_messages(monkeypatch):
+    posted = []
+    alert = SlackAlert(None, "#channel", "token")
+    monkeypatch.setattr(alert.client, "chat_postMessage", lambda blocks, **kwargs: posted.append(blocks))
+    monkeypatch.setattr(alert, "_render_header", lambda title, **kwargs: [{"type": "header", "text": title}] * 20)
+    monkeypatch.setattr(alert, "_render_finish", lambda: [])
+    monkeypatch.setattr(alert, "_render_footer", lambda: [])
+
+    assert alert.alert_batch([("finish", {}), ("finish", {}), ("unknown", {}), ("finish", {})]) == 4
+    # Two messages of 20 blocks fit with a divider, the third exceeds the limit
+    assert [len(blocks) for blocks in posted] == [41, 20]
@@ -0,0 +1,171 @@
+import pytest
+import yaml
+
+from castanets import context, engine
+from castanets.commands import castanets as commands
+from castanets.models import compile_config
+from castanets.stores import CommentStateStore, get_state_store, set_state_store
+from castanets.utils import get_castanets_state_from_comment, github
+
+
+def _config(status_comment: bool = True, **stage_fields):
+    """
+    Config of stages one, two and three, with extra fields by stage label.
+    """
+    stages = [
+        {
+            "name": f"Stage {label}",
+            "label": label,
+            "description": f"Description of {label}",
+            "review": {"reviewers": ["alice"], "must_review": [], "minimum_approval": 1},
+            **stage_fields.get(label, {}),
+        }
+        for label in ["one", "two", "three"]
+    ]
+    return compile_config(
+        yaml.safe_dump({"name": "Process", "description": "", "status_comment": status_comment, "stages": stages})
+    )
+
+
+@pytest.fixture
+def comments(monkeypatch):
+    """
+    Comments of issue 5, kept by a fake GitHub API.
+    """
+    comments = []
+
+    def comment(github_actions, message):
+        comments.append({"id": len(comments) + 1, "body": message})
+        return comments[-1]
+
+    def update_comment(github_actions, comment_id, message):
+        comments[comment_id - 1]["body"] = message
+        return comments[comment_id - 1]
+
+    monkeypatch.setattr(github, "comment", comment)
+    monkeypatch.setattr(github, "update_comment", update_comment)
+    monkeypatch.setattr(github, "_get_first_comment_from_action_user", lambda context: comments[0])
+    monkeypatch.setattr(github, "reconcile_issue_metadata", lambda github_actions, issue, *args, **kwargs: issue)
+    monkeypatch.setattr(context, "github_actions", context.github_actions.replace(issue_id=5))
+    monkeypatch.setattr(context.castanets, "config", _config())
+    monkeypatch.setattr(context, "issue", {"number": 5, "labels": [], "assignees": []})
+    monkeypatch.setattr(context, "state", {})
+    monkeypatch.setattr(context, "state_changed", False)
+    previous_store = get_state_store()
+    set_state_store(CommentStateStore())
+    engine.reset()
+    yield comments
+    engine.reset()
+    set_state_store(previous_store)
+
+
+def test_status_comment_is_posted_once_and_edited(comments):
+    engine.push_command("initialize")
+    engine.push_command("process_start")
+    engine.run()
+
+    assert len(comments) == 1
+    assert "### Stage one" in comments[0]["body"]
+    assert get_castanets_state_from_comment(comments[0]["body"])["stages"]["one"]["status"] == "running"
+
+    engine.push_command("stage_next", "one")
+    engine.run()
+
+    assert len(comments) == 1
+    assert "### Stage two" in comments[0]["body"]
+    assert "### Stage one" not in comments[0]["body"]
+    assert "Stage **Stage two** started after **Stage one**." in comments[0]["body"]
+
+
+def test_render_status_comment(comments):
+    context.state = {"stages": {"one": {"status": "done"}, "two": {"status": "running", "approvers": ["alice"]}}}
+
+    body = commands._render_status_comment()
+
+    assert "one[Stage one]:::Done" in body
+    assert "two[Stage two]:::Running" in body
+    assert "three[Stage three]:::Pending" in body
+    assert "### Stage two" in body and "### Stage one" not in body
+    assert "**1** of at least **1** approvals." in body
+
+
+def test_render_status_comment_without_status_comment(comments, monkeypatch):
+    monkeypatch.setattr(context.castanets, "config", _config(status_comment=False))
+
+    assert commands._render_status_comment() is None
+
+
+@pytest.mark.parametrize("status_comment, kept", [(True, {"stages", "events", "config"}), (False, {"config"})])
+def test_finish_keeps_state_of_status_comment(comments, monkeypatch, status_comment, kept):
+    monkeypatch.setattr(context.castanets, "config", _config(status_comment=status_comment))
+    context.state = {
+        "stage_idx": 1,
+        "config": "process.yaml",
+        "stages": {"one": {"status": "done"}},
+        "events": [],
+        "approvers": [],
+    }
+
+    commands.finish()
+
+    assert set(context.state) == kept | {"finished"}
+    assert context.state["finished"]
+    assert len(comments) == (0 if status_comment else 1)
+
+
+def test_stage_rerun_rejects_stage_without_workflow(comments):
+    context.state = {"stage_idx": 0, "stages": {"one": {"status": "running", "approvers": []}}}
+
+    with pytest.raises(ValueError, match="Stage `one` has no workflow to rerun."):
+        commands.stage_rerun("one")
+    assert comments == []
+
+
+def test_poll_workflow_runs_of_stage_without_workflow(comments, monkeypatch):
+    run = {
+        "id": 7,
+        "status": "completed",
+        "conclusion": "success",
+        "run_attempt": 1,
+        "html_url": "https://github.com/org/infra/actions/runs/7",
+        "updated_at": "2024-01-01T00:10:00Z",
+        "run_started_at": "2024-01-01T00:00:00Z",
+    }
+    monkeypatch.setattr(github, "find_workflow_run", lambda *args, **kwargs: run)
+    record = {"stage_idx": 0, "workflow": "deploy.yaml", "repo": "org/infra", "status": "dispatched"}
+    context.state = {"stages": {"one": {"status": "running"}}, "workflow_runs": {"id": {**record, "dispatched_at": ""}}}
+
+    assert commands.poll_workflow_runs() == {"completed": ["id"]}
+    assert context.state["workflow_runs"]["id"]["conclusion"] == "success"
+    assert context.state["stages"]["one"]["status"] == "running"
+
+
+def test_prefetch_runs_on_workflow_ref(comments, monkeypatch):
+    workflow = {"filename": "build.yaml", "track": True, "ref": "release"}
+    monkeypatch.setattr(context.castanets, "config", _config(two={"workflow": workflow, "prefetch": True}))
+    shas = {"main": "sha-main", "release": "sha-release"}
+    monkeypatch.setattr(github, "get_commit_sha", lambda github_actions, ref, repo=None: shas[ref])
+    dispatches = []
+    monkeypatch.setattr(github, "run_workflow", lambda *args, **kwargs: dispatches.append(kwargs))
+    context.state = {"stages": {"one": {"status": "running", "approvers": []}}}
+
+    commands._prefetch_dependents(0)
+
+    assert [dispatch["ref"] for dispatch in dispatches] == ["release"]
+    # The run is adopted by the commit of its ref, not of the process ref
+    shas["main"] = "sha-main-2"
+    assert commands._adopt_prefetch(1, context.castanets.config.stages[1].workflow)
+
+
+def test_slash_command_without_stage_of_parallel_stages_is_replied(comments):
+    comments.append({"id": 1, "body": "Status"})
+    stages = {"one": {"status": "running", "approvers": []}, "two": {"status": "running", "approvers": []}}
+    context.state = {"stage_idx": 1, "stages": stages}
+
+    engine.push_command("approve", "alice")
+    engine.push_command("approve", "alice", "two")
+    engine.run()
+
+    assert comments[1]["body"] == "`approve` was ignored. Target stage must be given, running stages: `one`, `two`"
+    assert context.state["stages"]["one"]["approvers"] == []
+    assert context.state["stages"]["two"]["approvers"] == ["alice"]
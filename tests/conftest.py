@@ -0,0 +1,25 @@
+import json
+import os
+import tempfile
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Castanets loads the Github Actions environment on import, so tests of modules using the context run on
+# a scheduled event of the example process, without an issue
+fd, EVENT_PATH = tempfile.mkstemp(suffix=".json")
+with os.fdopen(fd, "w") as f:
+    json.dump({"schedule": "0 * * * *"}, f)
+
+for key, value in {
+    "GITHUB_EVENT_NAME": "schedule",
+    "GITHUB_EVENT_PATH": EVENT_PATH,
+    "GITHUB_WORKSPACE": ROOT_DIR,
+    "GITHUB_TOKEN": "token",
+    "GITHUB_REPOSITORY": "org/repo",
+    "GITHUB_REF_NAME": "main",
+    "CASTANETS_CONFIG_PATH": "resources/castanets_example.yaml",
+    "ISSUE_AUTOCLOSE": "false",
+    "SLACK": "false",
+    "TEAMS": "false",
+}.items():
+    os.environ.setdefault(key, value)
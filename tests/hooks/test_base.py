@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from castanets.hooks import BaseHook, ChromeTraceHook
+from castanets.hooks.base import HookRegistry
+
+
+def test_span_disabled():
+    registry = HookRegistry()
+
+    with registry.span("command", "test") as span:
+        assert span is None
+    assert not registry.enabled
+
+
+def test_span_hooks():
+    calls = []
+
+    class RecordHook(BaseHook):
+        def before(self, span):
+            calls.append(("before", span.kind, span.name))
+
+        def after(self, span):
+            calls.append(("after", span.kind, span.name, span.args, span.error))
+
+    registry = HookRegistry()
+    registry.register_hook(RecordHook())
+
+    with registry.span("command", "stage_start", stage_idx=0):
+        pass
+    with pytest.raises(ValueError):
+        with registry.span("http", "GET /user"):
+            raise ValueError("failed")
+
+    assert calls == [
+        ("before", "command", "stage_start"),
+        ("after", "command", "stage_start", {"stage_idx": 0}, None),
+        ("before", "http", "GET /user"),
+        ("after", "http", "GET /user", {}, "ValueError('failed')"),
+    ]
+
+
+def test_chrome_trace(tmp_path):
+    path = tmp_path / "trace.json"
+    registry = HookRegistry()
+    registry.register_hook(ChromeTraceHook(str(path)))
+
+    with registry.span("command", "approve", username="octocat"):
+        with registry.span("http", "GET /user"):
+            pass
+    registry.close()
+
+    events = json.loads(path.read_text())["traceEvents"]
+    assert [(event["cat"], event["name"], event["ph"]) for event in events] == [
+        ("http", "GET /user", "X"),
+        ("command", "approve", "X"),
+    ]
+    assert events[1]["args"] == {"username": "'octocat'"}
+    assert events[1]["dur"] >= events[0]["dur"]
@@ -0,0 +1,109 @@
+import pytest
+
+from castanets.models import CastanetsConfig, parse_duration
+
+
+def _config(*stages):
+    review = {"reviewers": ["octocat"], "must_review": [], "minimum_approval": 1}
+    return CastanetsConfig.from_dict(
+        {
+            "name": "Process",
+            "description": "Description",
+            "stages": [
+                {"name": label, "label": label, "description": "", "review": review, **extra} for label, extra in stages
+            ],
+        }
+    )
+
+
+def test_linear_stages():
+    config = _config(("one", {}), ("two", {}))
+
+    assert config.get_needs(0) == []
+    assert config.get_needs(1) == [0]
+    assert config.get_ready_stages({}) == [0]
+    assert config.get_ready_stages({"one": "done"}) == [1]
+
+
+def test_parallel_stages():
+    config = _config(
+        ("build", {}),
+        ("security", {"needs": ["build"]}),
+        ("quality", {"needs": ["build"]}),
+        ("release", {"needs": ["security", "quality"]}),
+    )
+
+    assert config.get_ready_stages({"build": "done"}) == [1, 2]
+    assert config.get_ready_stages({"build": "done", "security": "done", "quality": "running"}) == []
+    assert config.get_ready_stages({"build": "done", "security": "done", "quality": "done"}) == [3]
+    assert config.get_dependents(0) == [1, 2]
+
+
+def test_invalid_needs():
+    with pytest.raises(Exception):
+        _config(("one", {"needs": ["unknown"]}))
+    with pytest.raises(Exception):
+        _config(("one", {"needs": ["two"]}), ("two", {"needs": ["one"]}))
+
+
+def test_prefetch_requires_tracked_workflow():
+    tracked = {"workflow": {"filename": "build.yaml", "track": True}, "prefetch": True}
+    config = _config(("one", {}), ("two", {**tracked, "prefetch_approval_ratio": 0.5}))
+
+    assert config.stages[1].prefetch
+    with pytest.raises(Exception):
+        _config(("one", {}), ("two", {"workflow": {"filename": "build.yaml"}, "prefetch": True}))
+    with pytest.raises(Exception):
+        _config(("one", {}), ("two", {**tracked, "prefetch_approval_ratio": 2}))
+
+
+def test_team_reviewers():
+    config = _config(
+        ("one", {"review": {"reviewers": ["alice", "org/infra", "org/ml"], "must_review": [], "minimum_approval": 2}}),
+        ("two", {"review": {"reviewers": ["alice", "org/infra"], "must_review": ["org/infra"], "minimum_approval": 1}}),
+    )
+    members = {"org/infra": ["bob", "carol"], "org/ml": ["dave"]}
+
+    review = config.stages[0].review
+    assert review.users == ["alice"]
+    assert review.required_teams == []
+    assert review.is_stage_approved(["alice", "bob"])
+    review.one_per_team = True
+    assert review.required_teams == ["org/infra", "org/ml"]
+    assert not review.is_stage_approved(["alice", "bob"], members)
+    assert review.is_stage_approved(["bob", "dave"], members)
+
+    review = config.stages[1].review
+    assert not review.is_stage_approved(["alice"], members)
+    assert review.is_stage_approved(["carol"], members)
+
+
+def test_stage_durations():
+    config = _config(("a", {"remind_after": "12h", "timeout": "1.5d"}), ("b", {}))
+    assert config.stages[0].remind_after_seconds == 12 * 3600
+    assert config.stages[0].timeout_seconds == 36 * 3600
+    assert config.stages[1].remind_after_seconds is None
+    assert parse_duration("30m") == 1800
+
+    with pytest.raises(ValueError):
+        _config(("a", {"timeout": "3 days"}))
+
+
+def test_workflow_targets():
+    targets = [{"repo": "org/infra", "ref": "main"}, {"repo": "org/serving", "inputs": {"region": "us"}}]
+    workflow = {"filename": "deploy.yaml", "track": True, "ref": "release", "targets": targets}
+    stage = _config(("a", {"workflow": workflow})).stages[0]
+    assert stage.workflow.is_fan_out
+    assert [(target.repo, target.ref) for target in stage.workflow.dispatch_targets] == [
+        ("org/infra", "main"),
+        ("org/serving", None),
+    ]
+
+    single = _config(("a", {"workflow": {"filename": "deploy.yaml", "repo": "org/infra"}})).stages[0]
+    assert not single.workflow.is_fan_out
+    assert single.workflow.dispatch_targets[0].repo == "org/infra"
+
+    with pytest.raises(ValueError):
+        _config(("a", {"workflow": {**workflow, "track": False}}))
+    with pytest.raises(ValueError):
+        _config(("a", {"workflow": {**workflow, "repo": "org/infra"}}))
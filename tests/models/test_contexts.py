@@ -0,0 +1,33 @@
+import pytest
+from jinja2 import UndefinedError
+
+from castanets.models import CastanetsContext, SlimGithubActionsContext
+
+CONFIG = """
+name: Process
+description: "{{ params.description }}"
+stages:
+  - name: Train
+    label: train
+    description: ""
+    review: {reviewers: [alice], must_review: [], minimum_approval: 1}
+    workflow:
+      filename: train.yaml
+      inputs: {model: "{{ state.workflow_output.model }}"}
+"""
+
+
+def _render(tmp_path, text: str, state=None):
+    (tmp_path / "process.yaml").write_text(text)
+    github = SlimGithubActionsContext(event_name="issues", repo="org/repo", ref="main", token="token", issue_id=1)
+    return CastanetsContext.render_config(str(tmp_path / "process.yaml"), github, state, {"description": "Desc"})
+
+
+def test_render_config_workflow_output(tmp_path):
+    assert _render(tmp_path, CONFIG).stages[0].workflow.inputs == {"model": ""}
+    assert _render(tmp_path, CONFIG, {"workflow_output": {"model": "v2"}}).stages[0].workflow.inputs == {"model": "v2"}
+
+
+def test_render_config_raises_on_undefined_variable(tmp_path):
+    with pytest.raises(UndefinedError):
+        _render(tmp_path, CONFIG.replace("params.description", "parmas.description"))
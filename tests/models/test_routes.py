@@ -0,0 +1,27 @@
+import pytest
+
+from castanets.models import load_config_index
+
+
+def test_config_index_routes_issue(tmp_path):
+    for name in ["model.yaml", "data.yaml", "default.yaml"]:
+        (tmp_path / name).write_text("name: Process\n")
+    (tmp_path / "routes.yaml").write_text(
+        "routes:\n"
+        "  - {config: model.yaml, title_prefix: '[Model]'}\n"
+        "  - {config: data.yaml, label: data, params: {kind: dataset}}\n"
+        "  - {config: default.yaml}\n"
+    )
+    index = load_config_index(str(tmp_path))
+
+    assert load_config_index(str(tmp_path)) is index
+    assert index.route({"title": "[Model] v2", "labels": []}, {}) == "model.yaml"
+    assert index.route({"title": "Data", "labels": [{"name": "data"}]}, {"kind": "dataset"}) == "data.yaml"
+    assert index.route({"title": "Data", "labels": [{"name": "data"}]}, {}) == "default.yaml"
+
+
+def test_config_index_requires_configs(tmp_path):
+    (tmp_path / "routes.yaml").write_text("routes:\n  - {config: missing.yaml}\n")
+
+    with pytest.raises(ValueError):
+        load_config_index(str(tmp_path))
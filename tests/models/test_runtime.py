@@ -0,0 +1,63 @@
+import pytest
+import yaml
+
+from castanets.models import (
+    CastanetsConfig,
+    SlimCastanetsConfig,
+    SlimReview,
+    SlimWorkflowTarget,
+    compile_config,
+    to_slim,
+)
+
+CONFIG = {
+    "name": "Process",
+    "description": "Description",
+    "stages": [
+        {
+            "name": label,
+            "label": label,
+            "description": "",
+            "review": {"reviewers": ["alice", "org/infra"], "must_review": ["org/infra"], "minimum_approval": 1},
+        }
+        for label in ["one", "two"]
+    ],
+}
+
+
+def test_compile_config():
+    text = yaml.safe_dump(CONFIG)
+    config = compile_config(text)
+
+    assert isinstance(config, SlimCastanetsConfig)
+    assert compile_config(text) is config
+    assert config == to_slim(CastanetsConfig.from_dict(CONFIG))
+    assert config.get_ready_stages({"one": "done"}) == [1]
+
+    review = config.stages[0].review
+    assert isinstance(review, SlimReview)
+    assert review.reviewers == ("alice", "org/infra")
+    assert review.teams == ["org/infra"]
+    assert review.is_stage_approved(["bob"], {"org/infra": ["bob"]})
+    assert not hasattr(review, "__dict__")
+
+    with pytest.raises(Exception):
+        compile_config(yaml.safe_dump({**CONFIG, "stages": []}))
+
+
+def test_slim_model_is_immutable():
+    review = compile_config(yaml.safe_dump(CONFIG)).stages[0].review
+
+    with pytest.raises(AttributeError):
+        review.minimum_approval = 2
+    changed = review.replace(minimum_approval=2)
+    assert changed.minimum_approval == 2
+    assert review.minimum_approval == 1
+
+
+def test_slim_workflow_dispatch_targets():
+    workflow = {"filename": "deploy.yaml", "repo": "org/infra", "ref": "release"}
+    config = compile_config(yaml.safe_dump({**CONFIG, "stages": [{**CONFIG["stages"][0], "workflow": workflow}]}))
+
+    targets = config.stages[0].workflow.dispatch_targets
+    assert targets == (SlimWorkflowTarget(repo="org/infra", ref="release"),)
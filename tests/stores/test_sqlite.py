@@ -0,0 +1,27 @@
+from castanets.models import SlimGithubActionsContext
+from castanets.stores import SqliteStateStore, migrate_state
+
+
+def _context(repo: str = "org/repo", issue_id: int = 1):
+    return SlimGithubActionsContext(event_name="issues", repo=repo, ref="main", token="token", issue_id=issue_id)
+
+
+def test_sqlite_state_store_round_trip(tmp_path):
+    store = SqliteStateStore(str(tmp_path / "state.db"))
+    store.write(_context(), {"stage_idx": 0})
+    store.write(_context(), {"stage_idx": 1, "finished": False})
+    store.write(_context("org/other"), {"stage_idx": 2})
+
+    assert store.read(_context()) == {"stage_idx": 1, "finished": False}
+    assert store.read(_context(issue_id=2)) == {}
+    assert SqliteStateStore(str(tmp_path / "state.db")).read(_context("org/other")) == {"stage_idx": 2}
+    assert store.issue_ids(_context()) == [1]
+
+
+def test_migrate_state_skips_issues_without_state():
+    source, target = SqliteStateStore(":memory:"), SqliteStateStore(":memory:")
+    source.write_many(_context(), {1: {"stage_idx": 0}, 2: {}, 3: {"finished": True}})
+
+    assert migrate_state(_context(), source, target, batch_size=1) == 2
+    assert target.issue_ids(_context()) == [1, 3]
+    assert target.read(_context(issue_id=3)) == {"finished": True}
@@ -0,0 +1,166 @@
+import copy
+
+import pytest
+
+from castanets import context, engine
+from castanets.commands import command
+from castanets.stores import BaseStateStore, get_state_store, set_state_store
+
+RUN_ID = "100"
+
+effects = []
+failing_steps = set()
+
+
+@command("test_engine_effects")
+def effects_command(*steps):
+    for step in steps:
+        if step in failing_steps:
+            raise ValueError(step)
+        engine.run_once(step, lambda: effects.append(step))
+
+
+class MemoryStateStore(BaseStateStore):
+    name = "memory"
+
+    def __init__(self, fail: bool = False):
+        self.states = []
+        self.fail = fail
+
+    def read(self, context):
+        return copy.deepcopy(self.states[-1]) if self.states else {}
+
+    def write(self, context, state, body=None):
+        if self.fail:
+            raise ConnectionError("State store is down")
+        self.states.append(copy.deepcopy(state))
+
+    def issue_ids(self, context):
+        return []
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = MemoryStateStore()
+    previous_store = get_state_store()
+    set_state_store(store)
+    monkeypatch.setitem(type(engine).run.__globals__, "GITHUB_RUN_ID", RUN_ID)
+    monkeypatch.setattr(engine, "_comment_renderer", None)
+    monkeypatch.setattr(context, "state", {"stage_idx": 0})
+    monkeypatch.setattr(context, "state_changed", False)
+    engine.reset()
+    effects.clear()
+    failing_steps.clear()
+    yield store
+    engine.reset()
+    set_state_store(previous_store)
+
+
+def _run_failing(store) -> int:
+    seq = engine._last_seq + 1
+    failing_steps.add("b")
+    engine.push_command("test_engine_effects", "a", "b")
+    engine.push_command("test_engine_effects", "c")
+    with pytest.raises(RuntimeError):
+        engine.run()
+    return seq
+
+
+def test_failed_command_writes_journal(store):
+    seq = _run_failing(store)
+
+    assert effects == ["a"]
+    assert store.states == [
+        {
+            "stage_idx": 0,
+            "journal": {
+                "run_id": RUN_ID,
+                "pending": [
+                    [seq, "test_engine_effects", ["a", "b"], {}],
+                    [seq + 1, "test_engine_effects", ["c"], {}],
+                ],
+                "steps": {f"{seq}:test_engine_effects:a#0": None},
+            },
+        }
+    ]
+
+
+def test_rerun_resumes_journal(store):
+    _run_failing(store)
+    engine.reset()
+    effects.clear()
+    failing_steps.clear()
+    context.state = store.read(context.github_actions)
+
+    engine.push_command_from_context()
+    engine.run()
+
+    # The completed step is skipped, steps not completed and the remaining command run
+    assert effects == ["b", "c"]
+    assert store.states[-1] == {"stage_idx": 0}
+
+
+def test_journal_of_another_run_is_dropped(store, monkeypatch):
+    _run_failing(store)
+    engine.reset()
+    effects.clear()
+    context.state = store.read(context.github_actions)
+    monkeypatch.setitem(type(engine).run.__globals__, "GITHUB_RUN_ID", "200")
+
+    engine.push_command_from_context()
+    engine.run()
+
+    assert effects == []
+    assert store.states[-1] == {"stage_idx": 0}
+
+
+def test_failed_state_write_keeps_command_error(store):
+    store.fail = True
+    failing_steps.add("a")
+    engine.push_command("test_engine_effects", "a")
+
+    with pytest.raises(RuntimeError, match="test_engine_effects") as e:
+        engine.run()
+    assert isinstance(e.value.__cause__, ValueError)
+
+
+@pytest.mark.parametrize("pull_request_reviews, expected", [(True, ["sync_reviews"]), (False, [])])
+def test_pull_request_review_pushes_sync_reviews(store, monkeypatch, pull_request_reviews, expected):
+    github_actions = context.github_actions.replace(event_name="pull_request_review", action="submitted")
+    monkeypatch.setattr(context, "github_actions", github_actions)
+    config = context.castanets.config.replace(pull_request_reviews=pull_request_reviews)
+    monkeypatch.setattr(context.castanets, "config", config)
+
+    engine.push_command_from_context()
+
+    pushed = []
+    while not engine._command_queue.empty():
+        pushed.append(engine._command_queue.get()[1])
+    assert pushed == expected
+
+
+@command("test_engine_mutate")
+def mutate_command(key, fail=False):
+    context.state[key] = True
+    context.state_changed = True
+    if fail:
+        raise ValueError(key)
+
+
+def test_failed_command_outside_of_actions_restores_state(store, monkeypatch):
+    monkeypatch.setitem(type(engine).run.__globals__, "GITHUB_RUN_ID", None)
+    engine.push_command("test_engine_mutate", "done")
+    engine.push_command("test_engine_mutate", "failed", fail=True)
+
+    with pytest.raises(RuntimeError):
+        engine.run()
+    assert store.states == [{"stage_idx": 0, "done": True}]
+
+
+def test_failed_command_without_state_writes_nothing(store, monkeypatch):
+    monkeypatch.setattr(context, "state", {})
+    engine.push_command("test_engine_mutate", "failed", fail=True)
+
+    with pytest.raises(RuntimeError):
+        engine.run()
+    assert store.states == []
@@ -0,0 +1,74 @@
+import io
+import json
+
+from castanets.utils.analytics import (
+    AnalyticsStore,
+    aggregate_stage_metrics,
+    compact_timeline_event,
+    get_stage_visits,
+    write_stage_metrics,
+)
+
+
+def _label(event_id, kind, stage, at):
+    return {"id": event_id, "event": kind, "label": {"name": f"castanets:stage:{stage}"}, "created_at": at}
+
+
+def _comment(event_id, login, body, at):
+    return {"id": event_id, "event": "commented", "user": {"login": login}, "body": body, "created_at": at}
+
+
+TIMELINE = [
+    _label(1, "labeled", "one", "2022-06-01T00:00:00Z"),
+    _comment(2, "alice", "/rerun\n/rerun one --force", "2022-06-01T01:00:00Z"),
+    _comment(3, "bot", "## Castanets reminder\n\n...", "2022-06-01T12:00:00Z"),
+    _comment(4, "bob", "/approve", "2022-06-01T18:00:00Z"),
+    {"id": 5, "event": "labeled", "label": {"name": "bug"}, "created_at": "2022-06-01T19:00:00Z"},
+    _label(6, "unlabeled", "one", "2022-06-02T00:00:00Z"),
+    _label(7, "labeled", "two", "2022-06-02T00:00:00Z"),
+    {"id": 8, "event": "reviewed", "state": "APPROVED", "submitted_at": "2022-06-02T06:00:00Z"},
+]
+
+
+def _events(timeline):
+    return [compact for event in timeline for compact in compact_timeline_event(event, "bot")]
+
+
+def test_stage_visits_and_metrics():
+    visits = get_stage_visits(_events(TIMELINE))
+    assert [(visit["stage"], visit["ended_at"]) for visit in visits] == [
+        ("one", "2022-06-02T00:00:00Z"),
+        ("two", None),
+    ]
+    assert visits[0]["reruns"] == 2 and visits[0]["reminders"] == 1
+    assert visits[0]["first_approval_at"] == "2022-06-01T18:00:00Z"
+
+    metrics = {metric["stage"]: metric for metric in aggregate_stage_metrics(visits)}
+    assert metrics["one"]["time_in_stage_median_hours"] == 24
+    assert metrics["one"]["time_to_first_approval_mean_hours"] == 18
+    assert metrics["two"]["completed"] == 0 and metrics["two"]["time_in_stage_mean_hours"] is None
+    assert metrics["two"]["time_to_first_approval_p90_hours"] == 6
+
+    f = io.StringIO()
+    write_stage_metrics(list(metrics.values()), f)
+    assert f.getvalue().splitlines()[0].startswith("stage,visits,completed,")
+
+
+def test_analytics_store_checkpoint(tmp_path):
+    path = str(tmp_path / "store" / "analytics.json")
+    store = AnalyticsStore(path)
+    store.add_events(5, _events(TIMELINE[:3]))
+    # Refetched page adds only new events
+    store.add_events(5, _events(TIMELINE[:5]))
+    store.get_issue(5)["etag"] = 'W/"abc"'
+    store.since = "2022-06-02T00:00:00Z"
+    store.save()
+
+    loaded = AnalyticsStore(path)
+    assert loaded.since == "2022-06-02T00:00:00Z"
+    assert loaded.get_issue(5)["etag"] == 'W/"abc"'
+    assert len(loaded.get_issue(5)["events"]) == len(_events(TIMELINE[:5]))
+
+    with open(path, "w") as f:
+        json.dump({"version": 0}, f)
+    assert AnalyticsStore(path).since is None
@@ -0,0 +1,97 @@
+import json
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from castanets.utils import AppCredential, CredentialPool, TokenCredential
+
+
+@pytest.fixture
+def private_key():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    return key, pem
+
+
+@pytest.fixture
+def token_server(private_key):
+    """
+    Local stand-in of GitHub's installation token endpoint.
+    """
+    public_key = private_key[0].public_key()
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            # Tests run with a fake clock, so the signature and claims are checked without the current time
+            token = self.headers["Authorization"].split()[1]
+            claims = jwt.decode(
+                token, public_key, algorithms=["RS256"], options={"verify_exp": False, "verify_iat": False}
+            )
+            assert claims["exp"] - claims["iat"] == 600
+            requests_seen.append((self.path, claims["iss"]))
+            body = json.dumps({"token": f"ghs_{len(requests_seen)}", "expires_at": "2030-01-01T01:00:00Z"}).encode()
+            self.send_response(201)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", requests_seen
+    server.shutdown()
+
+
+def test_app_credential_caches_installation_token(private_key, token_server):
+    api_url, requests_seen = token_server
+    now = [datetime(2030, 1, 1, tzinfo=timezone.utc).timestamp()]
+    credential = AppCredential("42", private_key[1], installation_id="7", api_url=api_url, clock=lambda: now[0])
+
+    assert credential.get_token() == "ghs_1"
+    assert credential.get_token() == "ghs_1"
+    assert requests_seen == [("/app/installations/7/access_tokens", "42")]
+
+    # Refreshed shortly before the token expires
+    now[0] += 3600 - 60
+    assert credential.get_token() == "ghs_2"
+
+
+def test_credential_pool_selects_least_loaded():
+    now = 1000.0
+    primary, extra = TokenCredential("a"), TokenCredential("b")
+    pool = CredentialPool([primary, extra], clock=lambda: now)
+
+    assert pool.select("GET") is primary
+    primary.update_rate_limit({"X-RateLimit-Remaining": "10", "X-RateLimit-Reset": "2000"})
+    extra.update_rate_limit({"X-RateLimit-Remaining": "4000", "X-RateLimit-Reset": "2000"})
+    assert pool.select("GET") is extra
+    assert pool.select("POST") is primary
+
+    # Rate limit of the primary was reset
+    now = 2000.0
+    assert pool.select("GET") is primary
+
+
+def test_repo_credentials_for_other_repositories():
+    from castanets.utils import github
+
+    infra, org = TokenCredential("infra"), TokenCredential("org")
+    github.set_repo_credentials({"org/infra": infra, "org": org})
+    try:
+        assert github._select_credential("POST", repo="org/infra") is infra
+        assert github._select_credential("POST", repo="org/serving") is org
+        assert github._select_credential("POST", repo="other/repo") is None
+        assert github._select_credential("POST") is None
+    finally:
+        github.set_repo_credentials({})
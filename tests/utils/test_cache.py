@@ -0,0 +1,18 @@
+from castanets.utils import TTLCache
+
+
+def test_ttl_cache():
+    now = [100.0]
+    entries = {}
+    cache = TTLCache(entries, ttl=10, clock=lambda: now[0])
+
+    cache.set("org/infra", ["bob"])
+    cache.set("org/ml", None, ttl=1)
+    assert "org/infra" in cache
+    assert cache.get("org/infra") == ["bob"]
+    assert "org/ml" in cache and cache.get("org/ml", "missing") is None
+
+    now[0] = 105.0
+    assert cache.missing(["org/infra", "org/ml", "org/web"]) == ["org/ml", "org/web"]
+    cache.prune()
+    assert list(entries) == ["org/infra"]
@@ -0,0 +1,143 @@
+import io
+import zipfile
+
+import pytest
+
+from castanets.utils import (
+    create_correlation_id,
+    evaluate_stage_condition,
+    expand_matrix,
+    find_correlation_id,
+    get_issue_id_from_correlation_id,
+    get_issue_metadata_patch,
+    get_stage_search_queries,
+    get_workflow_hash,
+    parse_slash_commands,
+    read_outputs_from_artifact,
+    render_matrix_inputs,
+)
+
+
+def _issue(labels, assignees):
+    return {
+        "labels": [{"name": label} for label in labels],
+        "assignees": [{"login": assignee} for assignee in assignees],
+    }
+
+
+def test_issue_metadata_patch_replaces_stage_label():
+    issue = _issue(["bug", "castanets:stage:one"], ["alice", "carol"])
+
+    patch = get_issue_metadata_patch(issue, ["castanets:stage:two"], ["alice"], ["bob"])
+
+    assert patch == {"labels": ["bug", "castanets:stage:two"], "assignees": ["carol", "bob"]}
+
+
+def test_issue_metadata_patch_keeps_reviewer_of_both_stages():
+    issue = _issue(["castanets:stage:one"], ["alice"])
+
+    patch = get_issue_metadata_patch(issue, ["castanets:stage:two"], ["alice"], ["alice"])
+
+    assert patch == {"labels": ["castanets:stage:two"]}
+
+
+def test_issue_metadata_patch_up_to_date():
+    issue = _issue(["castanets:stage:one"], ["alice"])
+
+    assert get_issue_metadata_patch(issue, ["castanets:stage:one"], [], ["alice"]) == {}
+    assert get_issue_metadata_patch(_issue([], []), [], ["alice"]) == {}
+
+
+def test_correlation_id():
+    correlation_id = create_correlation_id(42, "stage_one")
+
+    assert find_correlation_id(f"Stage One {correlation_id}") == correlation_id
+    assert get_issue_id_from_correlation_id(correlation_id) == 42
+    assert find_correlation_id("Stage One") is None
+
+    correlation_id = create_correlation_id(7, "Stage One: train/eval")
+    assert find_correlation_id(f"Train {correlation_id}") == correlation_id
+    assert get_issue_id_from_correlation_id(correlation_id) == 7
+
+
+def _artifact(files):
+    artifact = io.BytesIO()
+    with zipfile.ZipFile(artifact, "w") as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    artifact.seek(0)
+    return artifact
+
+
+def test_read_outputs_from_artifact():
+    artifact = _artifact({"model.bin": b"0" * 4096, "outputs.json": '{"output_a": 1}', "outputs.yaml": "output_b: 2"})
+
+    assert read_outputs_from_artifact(artifact, "outputs.json", 1024) == {"output_a": 1}
+    assert read_outputs_from_artifact(artifact, "outputs.yaml", 1024) == {"output_b": 2}
+
+
+def test_read_outputs_from_artifact_limit():
+    artifact = _artifact({"outputs.json": '{"output_a": "' + "a" * 2048 + '"}'})
+
+    with pytest.raises(ValueError):
+        read_outputs_from_artifact(artifact, "outputs.json", 1024)
+    with pytest.raises(ValueError):
+        read_outputs_from_artifact(artifact, "missing.json", 1024)
+
+
+def test_matrix():
+    cells = expand_matrix({"dataset": ["a", "b"], "shard": [1, 2]})
+
+    assert cells == [
+        {"dataset": "a", "shard": 1},
+        {"dataset": "a", "shard": 2},
+        {"dataset": "b", "shard": 1},
+        {"dataset": "b", "shard": 2},
+    ]
+    assert render_matrix_inputs(
+        {"shard": "$(matrix.shard)", "name": "$(matrix.dataset)-$(matrix.shard)"}, cells[1]
+    ) == {
+        "shard": "2",
+        "name": "a-2",
+    }
+    assert render_matrix_inputs({"gpu": "$(matrix.gpu)"}, {"gpu": True}) == {"gpu": "true"}
+
+
+def test_workflow_hash():
+    workflow_hash = get_workflow_hash("train.yaml", "abc123", {"lr": "0.1", "epochs": "3"})
+
+    assert workflow_hash == get_workflow_hash("train.yaml", "abc123", {"epochs": "3", "lr": "0.1"})
+    assert workflow_hash != get_workflow_hash("train.yaml", "def456", {"lr": "0.1", "epochs": "3"})
+    assert workflow_hash != get_workflow_hash("train.yaml", "abc123", {"lr": "0.2", "epochs": "3"})
+
+
+def test_evaluate_stage_condition():
+    params = {"model_changed": True, "datasets": ["a", "b"]}
+
+    assert evaluate_stage_condition("params.model_changed", params=params, state={})
+    assert evaluate_stage_condition("'b' in params.datasets and not state.skip", params=params, state={})
+    assert not evaluate_stage_condition("state.workflow_output.retrain", params=params, state={})
+
+
+def test_evaluate_stage_condition_sandbox():
+    with pytest.raises(Exception):
+        evaluate_stage_condition("params.__class__.__subclasses__()", params={})
+
+
+def test_parse_slash_commands():
+    comment = "LGTM!\n/approve stage_one\n  /rerun build --force\n/\nsee /tmp/path"
+
+    assert parse_slash_commands(comment) == [["approve", "stage_one"], ["rerun", "build", "--force"]]
+    assert parse_slash_commands("no command") == []
+
+
+def test_stage_search_queries():
+    queries = get_stage_search_queries("org/repo", ["one", "two", "one"], "2022-06-01T12:00:00Z")
+    assert queries == [
+        'repo:org/repo is:open updated:<=2022-06-01T12:00:00Z label:"castanets:stage:one","castanets:stage:two"'
+    ]
+
+    queries = get_stage_search_queries("org/repo", [f"stage_{idx}" for idx in range(20)], "2022-06-01T12:00:00Z")
+    assert len(queries) > 1
+    assert all(len(query) <= 256 for query in queries)
+    assert sum(query.count("castanets:stage:") for query in queries) == 20
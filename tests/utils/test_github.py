@@ -0,0 +1,120 @@
+import io
+
+import pytest
+
+from castanets.models import SlimGithubActionsContext
+from castanets.utils import github
+
+
+def _context():
+    return SlimGithubActionsContext(
+        event_name="pull_request_review", repo="org/repo", ref="main", token="t", issue_id=3
+    )
+
+
+def _review(author, state, submitted_at):
+    return {"author": author and {"login": author}, "state": state, "submittedAt": submitted_at}
+
+
+def test_get_latest_reviews_pages_and_keeps_latest_review(monkeypatch):
+    pages = {
+        None: {
+            "nodes": [_review("alice", "APPROVED", "2024-01-02T00:00:00Z"), _review(None, "APPROVED", None)],
+            "pageInfo": {"hasNextPage": True, "endCursor": "page2"},
+        },
+        "page2": {
+            "nodes": [
+                _review("bob", "CHANGES_REQUESTED", "2024-01-01T00:00:00Z"),
+                _review("alice", "CHANGES_REQUESTED", "2024-01-01T00:00:00Z"),
+                _review("bob", "APPROVED", "2024-01-03T00:00:00Z"),
+            ],
+            "pageInfo": {"hasNextPage": False, "endCursor": None},
+        },
+    }
+    cursors = []
+
+    def graphql(context, query, variables):
+        cursors.append(variables["cursor"])
+        return {"repository": {"pullRequest": {"latestOpinionatedReviews": pages[variables["cursor"]]}}}
+
+    monkeypatch.setattr(github, "graphql", graphql)
+
+    assert github.get_latest_reviews(_context(), per_page=2) == {
+        "alice": {"state": "APPROVED", "submitted_at": "2024-01-02T00:00:00Z"},
+        "bob": {"state": "APPROVED", "submitted_at": "2024-01-03T00:00:00Z"},
+    }
+    assert cursors == [None, "page2"]
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", headers=None, history=()):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.content = content
+        self.text = content.decode()
+        self.headers = headers or {}
+        self.history = list(history)
+
+    def iter_content(self, chunk_size):
+        return [self.content[idx : idx + chunk_size] for idx in range(0, len(self.content), chunk_size)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+        self.urls = []
+
+    def get(self, url, headers=None, stream=False):
+        self.urls.append(url)
+        return self.response
+
+
+def test_get_workflow_run_artifact_quotes_name(monkeypatch):
+    endpoints = []
+
+    def base_api_call(context, endpoint, method, repo=None):
+        endpoints.append(endpoint)
+        return {"artifacts": [{"name": "out put/1", "expired": False, "id": 1}]}
+
+    monkeypatch.setattr(github, "_base_api_call", base_api_call)
+
+    assert github.get_workflow_run_artifact(_context(), 7, "out put/1")["id"] == 1
+    assert endpoints == ["actions/runs/7/artifacts?name=out%20put%2F1"]
+
+
+def test_download_artifact_uses_session(monkeypatch):
+    redirect = FakeResponse(302, headers={"X-RateLimit-Remaining": "42"})
+    session = FakeSession(FakeResponse(200, b"zipped", history=[redirect]))
+    monkeypatch.setattr(github, "_session", session)
+    monkeypatch.setattr(github, "_rate_limit_remaining", None)
+
+    fileobj = io.BytesIO()
+    github.download_artifact(_context(), 1, fileobj, max_size=100, chunk_size=4)
+    assert fileobj.read() == b"zipped"
+    assert session.urls == ["https://api.github.com/repos/org/repo/actions/artifacts/1/zip"]
+    assert github.get_rate_limit_remaining() == 42
+
+    monkeypatch.setattr(github, "_session", FakeSession(FakeResponse(410, b"Gone")))
+    with pytest.raises(github.GithubApiError) as e:
+        github.download_artifact(_context(), 1, io.BytesIO(), max_size=100)
+    assert e.value.status_code == 410
+
+
+def test_first_comment_falls_back_to_state_comment(monkeypatch):
+    comments = [
+        {"id": 1, "user": {"id": 3, "login": "alice"}, "body": "Looks good"},
+        {"id": 2, "user": {"id": 1, "login": "github-actions[bot]"}, "body": '## Castanets\n<?castanets {"a": 1}?>'},
+    ]
+    monkeypatch.setattr(github, "get_comments", lambda context: comments)
+    monkeypatch.setattr(github, "get_user", lambda context: {"id": 2, "login": "castanets[bot]"})
+
+    assert github.read_state_from_first_comment(_context()) == {"a": 1}
+
+    comments.append({"id": 3, "user": {"id": 2, "login": "castanets[bot]"}, "body": "Castanets"})
+    assert github._get_first_comment_from_action_user(_context())["id"] == 3
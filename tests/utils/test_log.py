@@ -0,0 +1,58 @@
+import json
+import logging
+
+from castanets.utils import configure_logging, get_logger
+from castanets.utils.log import JsonFormatter, TextFormatter, parse_log_levels
+
+
+def _record(msg, *args):
+    return logging.LogRecord("castanets.utils.github", logging.INFO, __file__, 1, msg, args, None)
+
+
+def test_formatter_redacts_and_truncates():
+    formatter = TextFormatter(max_payload=20)
+    payload = {"body": "x" * 100, "token": "secret", "inputs": {"note": "Bearer abc.def"}}
+
+    message = formatter.format(_record("Calling %s with payload %s", "ghp_" + "a" * 36, payload))
+    assert "ghp_" not in message and "secret" not in message and "abc.def" not in message
+    assert "more chars)" in message
+    assert formatter.format(_record("Fetched %d issues in %.1fs", 3, 1.25)).endswith("Fetched 3 issues in 1.2s")
+
+    line = json.loads(JsonFormatter().format(_record("Payload: %s", {"authorization": "token abc"})))
+    assert line["logger"] == "castanets.utils.github"
+    assert line["message"] == 'Payload: {"authorization": "***"}'
+
+
+def test_formatter_keeps_numeric_and_mapping_args():
+    formatter = TextFormatter(max_payload=10)
+
+    assert formatter.format(_record("%d issues, %.2f hours, %s", 12, 1.5, "x" * 20)).endswith(
+        "12 issues, 1.50 hours, xxxxxxxxxx... (10 more chars)"
+    )
+    # A single mapping argument is kept as the mapping of named placeholders, with values redacted
+    args = {"stage": "train", "token": "ghp_" + "a" * 36, "hours": 2.25}
+    assert formatter.format(_record("Stage %(stage)s by %(token)s in %(hours).1f", args)).endswith(
+        "Stage train by *** in 2.2"
+    )
+
+
+def test_configure_logging_installs_one_handler():
+    assert parse_log_levels("utils.github=warning, castanets.alerts=ERROR") == {
+        "castanets.utils.github": "WARNING",
+        "castanets.alerts": "ERROR",
+    }
+
+    get_logger("castanets.engine")
+    configure_logging(level="INFO", fmt="json", levels="utils.github=WARNING")
+    configure_logging(level="INFO", fmt="json", levels="utils.github=WARNING")
+    try:
+        root = logging.getLogger("castanets")
+        # pytest adds its capture handlers too
+        handlers = [handler for handler in root.handlers if isinstance(handler.formatter, TextFormatter)]
+        assert len(handlers) == 1
+        assert isinstance(handlers[0].formatter, JsonFormatter)
+        assert not get_logger("castanets.utils.github").isEnabledFor(logging.INFO)
+        assert get_logger("castanets.engine").isEnabledFor(logging.INFO)
+    finally:
+        logging.getLogger("castanets.utils.github").setLevel(logging.NOTSET)
+        configure_logging(level="INFO", fmt="text", levels="")